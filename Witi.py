@@ -1,13 +1,42 @@
-from core.device.model.Device import Device
 from core.base.model.AliceSkill import AliceSkill
 from core.dialog.model.DialogSession import DialogSession
 from core.util.Decorators import IntentHandler
 from core.commons import constants
 from core.user.model.AccessLevels import AccessLevel
-from skills.Telegram import Telegram
-import RPi.GPIO as GPIO
+from skills.Witi.libraries import AlarmStateMachine, MqttStatePublisher
+from skills.Witi.libraries.AdaptiveInterval import AdaptiveInterval
+from skills.Witi.libraries.AlarmStateMachine import Action, AlarmState
+from skills.Witi.libraries.EventBus import AlarmEvent, Event, EventBus
+from skills.Witi.libraries.GpioBackend import GpioBackend, RPiGpioBackend
+from skills.Witi.libraries.GpioSnapshot import GpioSnapshot
+from skills.Witi.libraries.HandlerProfiler import HandlerProfiler, profiledHandler
+from skills.Witi.libraries.HomeAssistantStateCache import HomeAssistantStateCache
+from skills.Witi.libraries.Metrics import DRIFT_BUCKETS, INTERVAL_BUCKETS, Metrics, SEND_BUCKETS, TICK_BUCKETS
+from skills.Witi.libraries.NotificationPolicy import NotificationPolicy, NotificationType, parseRules
+from skills.Witi.libraries.PresenceAggregate import PresenceAggregate
+from skills.Witi.libraries.RateLimitedLog import RateLimitedLog
+from skills.Witi.libraries import RuntimeSnapshot
+from skills.Witi.libraries.RuntimeSnapshot import UnitState
+from skills.Witi.libraries.SatelliteIndex import SatelliteEntry, SatelliteIndex
+from skills.Witi.libraries.Scheduler import PeriodicTask, Scheduler, ThreadManagerScheduler
+from skills.Witi.libraries.SignalConditioner import SignalConditioner
+from skills.Witi.libraries.SimulatedGpioBackend import SimulatedGpioBackend
+from skills.Witi.libraries.TelegramQueue import TelegramQueue
+from skills.Witi.libraries.TransitionLog import DAY, TransitionLog
+from skills.Witi.libraries.WitiConfig import WitiConfig
+from skills.Witi.libraries.WitiUnit import UnitPins, WitiUnit, loadUnits
+from functools import partial
 from pathlib import Path
-import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+import threading
+import time
+import traceback
+import zlib
+
+if TYPE_CHECKING:
+	# Only for the type hints, the Telegram skill and the metrics endpoint are imported on first use
+	from skills.Telegram import Telegram
+	from skills.Witi.libraries.MetricsServer import MetricsServer
 
 
 class Witi(AliceSkill):
@@ -25,9 +54,17 @@ class Witi(AliceSkill):
 
 	"""
 	DATABASE = {
-		'witi': [
+		'witi'       : [
 			'event TEXT NOT NULL UNIQUE',
 			'active INTEGER NOT NULL DEFAULT 0',
+		],
+		'transitions': [
+			'timestamp REAL NOT NULL',
+			'monotonic REAL NOT NULL',
+			'pin TEXT NOT NULL',
+			'value INTEGER NOT NULL',
+			'alarmState TEXT NOT NULL',
+			"unit TEXT NOT NULL DEFAULT ''"
 		]
 	}
 
@@ -37,32 +74,195 @@ class Witi(AliceSkill):
 	_IGNITION_FEED = 19
 	_PAIRED_TO_VEHICLE = 21
 
-
-	def __init__(self):
-
-		self._gpioPin = dict()
-		self._alarmHasBeenTriggered = False
-		self._presenceObject = dict()
-		self._sessionID = ""
+	_DEFAULT_DB_EVENTS = ('welcomeMessage', 'AlarmState', 'pinCode', 'mqttMessage', 'telegramID', 'telegramReminder')
+	# Seconds to collect database changes before writing them in one transaction
+	_DB_FLUSH_DELAY = 1
+	# Seconds to collect setting changes made by voice before writing the config file
+	_CONFIG_FLUSH_DELAY = 2
+	# Seconds after a change on Alice's settings page before the settings get reloaded
+	_SETTINGS_RELOAD_DELAY = 0.5
+	# Seconds to buffer pin transitions before writing them to the history table
+	_HISTORY_FLUSH_DELAY = 30
+	# Seconds the start up Telegram reminder waits for the satellite lookup
+	_SATELLITE_WAIT = 5
+	# Shared worker threads and queue size per worker delivering the alarm events to the sinks, lossless sinks get a worker of their own
+	_EVENT_WORKERS = 1
+	_EVENT_QUEUE_SIZE = 50
+	# Telegram messages a full queue never drops to make room
+	_CRITICAL_NOTIFICATIONS = (NotificationType.TRIGGERED, NotificationType.DISARMED)
+
+	# States in which the monitor loop keeps its fast cadence
+	_ACTIVE_STATES = (AlarmState.ARMING_PENDING, AlarmState.ARMED, AlarmState.TRIGGERED)
+
+	# Pin map of the unit on the original pins, additional units come from the additionalUnits setting
+	_PRIMARY_PINS = UnitPins(
+		alarm=_ALARM_STATE,
+		triggered=_TRIGGERED_STATE,
+		ignition=_IGNITION_FEED,
+		paired=_PAIRED_TO_VEHICLE,
+		switch=_SWITCH_ALARM
+	)
+
+	# Bounce time (ms) for the edge detection of each input of a unit. The pairing and ignition
+	# signals come from relays so they get a longer settle time than the alarm outputs
+	_BOUNCE_TIME = UnitPins(
+		alarm=200,
+		triggered=50,
+		ignition=300,
+		paired=500,
+		switch=0
+	)
+
+
+	def __init__(self, gpio: GpioBackend = None, scheduler: Scheduler = None):
+		"""
+		:param gpio: pin backend to use instead of the one picked by the gpioBackend setting
+		:param scheduler: timers and clock to use instead of the ThreadManager, for example a VirtualScheduler
+		"""
+		self._scheduler = scheduler or ThreadManagerScheduler(self)
+		self._createdAt = time.monotonic()
+		self._bootToArmed = 0.0
+		self._satelliteReady = threading.Event()
+
+		self._presenceObject: Dict[str, bool] = dict()
+		self._satellites = SatelliteIndex()
+		self._units: List[WitiUnit] = list()
+		# noinspection PyTypeChecker
+		self._conditioner: SignalConditioner = None
 		# noinspection PyTypeChecker
-		self._satelliteUID: Device = None
-		self._autoArmingActive = False
-		self._ignMessageSent = False
-		self._previousMQTTMessage = dict()
-		self._witiDatabaseValues = dict()
-		self._voiceControlled = False
+		self._runtimeSnapshot: RuntimeSnapshot.RuntimeSnapshot = None
+		# Nothing is saved before the last snapshot was loaded, or the start up state would replace it
+		self._runtimeSnapshotLoaded = False
+		# noinspection PyTypeChecker
+		self._primaryUnit: WitiUnit = None
+		self._inputPins: Tuple[int, ...] = tuple()
+		self._witiDatabaseValues: Dict[str, Any] = dict()
+		self._pendingDBWrites: Dict[str, int] = dict()
+		self._dbFlushScheduled = False
+		self._dbLock = threading.Lock()
+		self._settings = WitiConfig()
+		self._pendingConfigWrites: Dict[str, Any] = dict()
+		self._configFlushScheduled = False
+		self._settingsReloadScheduled = False
+		self._configLock = threading.Lock()
+		self._monitor: Optional[PeriodicTask] = None
+		self._monitorInterval = AdaptiveInterval(fast=2, idle=60)
+		self._historyFlushScheduled = False
+		self._history = TransitionLog(
+			executeMany=partial(self.databaseExecuteMany, tableName='transitions'),
+			fetch=self.historyFetch
+		)
+		self._lastTick = None
+		# The monitor failed since its last good run, further failures only get a rate limited line
+		self._monitorFailing = False
+		self._metricsTask: Optional[PeriodicTask] = None
+		self._metricsServer: Optional['MetricsServer'] = None
+		self._telegramQueue = TelegramQueue(
+			sender=self.deliverTelegramMessage,
+			storage=Path(__file__).parent / 'undeliveredTelegramMessages.json',
+			logger=self.logWarning,
+			errorLogger=self.logError
+		)
+		self._metrics = Metrics(
+			counters={
+				'monitor_ticks'       : 'stateMonitor runs',
+				'monitor_errors'      : 'stateMonitor runs that raised',
+				'gpio_reads'          : 'Input pin reads',
+				'telegram_sent'       : 'Telegram messages delivered',
+				'telegram_failures'   : 'Failed Telegram send attempts',
+				'mqtt_publishes'      : 'MQTT messages published',
+				'db_writes'           : 'Values written to the witi table',
+				'db_flushes'          : 'Batched write transactions on the witi table',
+				'homeassistant_parses': 'Reads of the Home Assistant state file',
+				'events_dropped'      : 'Alarm events dropped by a full event queue'
+			},
+			histograms={
+				'monitor_tick_seconds'    : ('Duration of a stateMonitor run', TICK_BUCKETS),
+				'monitor_drift_seconds'   : ('How much later than scheduled a stateMonitor run started', DRIFT_BUCKETS),
+				'monitor_interval_seconds': ('Time between the starts of two stateMonitor runs', INTERVAL_BUCKETS),
+				'telegram_send_seconds'   : ('Duration of a successful Telegram send', SEND_BUCKETS)
+			},
+			gauges={
+				'telegram_pending'             : ('Telegram messages waiting for delivery', lambda: self._telegramQueue.pending),
+				'monitor_next_interval_seconds': ('Current adaptive stateMonitor interval', lambda: self._monitorInterval.current),
+				'boot_to_armed_seconds'        : ('Seconds from creating the skill to restoring the alarm outputs', lambda: self._bootToArmed)
+			}
+		)
 		self._homeassistantActive = False
-
-		GPIO.setmode(GPIO.BCM)
-		GPIO.setwarnings(False)
-		GPIO.setup(Witi._ALARM_STATE, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-		GPIO.setup(Witi._TRIGGERED_STATE, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-		GPIO.setup(Witi._IGNITION_FEED, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-		GPIO.setup(Witi._PAIRED_TO_VEHICLE, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-		GPIO.setup(Witi._SWITCH_ALARM, GPIO.OUT)
+		self._haStates = HomeAssistantStateCache(
+			Path(f'{str(Path.home())}/skills/HomeAssistant/currentStateOfDevices.json'),
+			onParse=self.onHomeAssistantParsed
+		)
+		self._presence = PresenceAggregate(checkIfAllUser=lambda state: self.UserManager.checkIfAllUser(state))
+		self._handlerProfiler = HandlerProfiler(profileDirectory=Path(__file__).parent / 'profiles', logger=self.logWarning)
+		self._edgeDetection = False
+		self._evaluationLock = threading.RLock()
+		self._stateActions = {action: getattr(self, action.value) for action in Action}
+		# noinspection PyTypeChecker
+		self._telegram: 'Telegram.Telegram' = None
+		# Logging of the code running every tick, repeats are counted instead of written
+		self._log = RateLimitedLog(sinks={'debug': self.logDebug, 'info': self.logInfo, 'warning': self.logWarning})
+		self._events = EventBus(
+			workers=Witi._EVENT_WORKERS if self._scheduler.threaded else 0,
+			maxSize=Witi._EVENT_QUEUE_SIZE,
+			logger=partial(self._log.warning, 'eventBus'),
+			onDrop=lambda sink, event: self._metrics.increment('events_dropped')
+		)
+		# The spoken and Telegram alarm notifications never lose an event, only the MQTT feed may
+		self._events.subscribe(sink='tts', handler=self.speakEvent, events=(AlarmEvent.ARMED, AlarmEvent.TRIGGERED, AlarmEvent.PAIRING_LOST), lossless=True)
+		self._events.subscribe(sink='telegram', handler=self.notifyEvent, events=(AlarmEvent.ARMED, AlarmEvent.DISARMED, AlarmEvent.TRIGGERED, AlarmEvent.TRIGGER_CLEARED), lossless=True)
+		self._events.subscribe(sink='mqtt', handler=self.publishEvent)
+		# Throttles the Telegram messages about alarm state changes and merges bursts into digests
+		self._notifications = NotificationPolicy(
+			send=self.queueTelegramMessage,
+			doLater=self._scheduler.doLater,
+			clock=self._scheduler.now
+		)
 
 		super().__init__(databaseSchema=self.DATABASE)
 
+		self._units = self.createUnits()
+		self._primaryUnit = self._units[0]
+		# Every input of every unit, in the order of the batched read done each tick
+		self._inputPins = tuple(pin for unit in self._units for pin in unit.pins.inputs)
+		self._conditioner = SignalConditioner(pins=len(self._inputPins))
+		self._confirmationScheduled = False
+		self._runtimeSnapshot = RuntimeSnapshot.RuntimeSnapshot(
+			path=Path(__file__).parent / 'runtimeState.snapshot',
+			units=len(self._units),
+			layout=zlib.crc32(repr([(unit.name, tuple(unit.pins)) for unit in self._units]).encode())
+		)
+
+		self._gpio = gpio or self.createGpioBackend()
+		for unit in self._units:
+			for pin in unit.pins.inputs:
+				self._gpio.setupInput(pin)
+			self._gpio.setupOutput(unit.pins.switch)
+
+
+	def createUnits(self) -> List[WitiUnit]:
+		""" The unit on the original pins plus the ones in the additionalUnits setting """
+		try:
+			return loadUnits(primaryPins=Witi._PRIMARY_PINS, additionalUnits=self.getConfig('additionalUnits'), publish=self.publish)
+		except ValueError as e:
+			self.logWarning(f'Ignoring the additional units: {e}')
+			return loadUnits(primaryPins=Witi._PRIMARY_PINS, additionalUnits='', publish=self.publish)
+
+
+	def createGpioBackend(self) -> GpioBackend:
+		"""
+		The pin backend selected in the settings. Simulated pins are only used when selected, a Pi
+		without working RPi.GPIO fails the skill load instead of confirming alarms no pin drives
+		"""
+		if self.getConfig('gpioBackend') != 'simulated':
+			return RPiGpioBackend()
+
+		gpio = SimulatedGpioBackend()
+		# A WITI unit reports the alarm as on as soon as its switch pin goes high
+		for unit in self._units:
+			gpio.link(unit.pins.switch, unit.pins.alarm)
+		return gpio
+
 
 	ALARM_CODE = "alarm code"
 
@@ -72,41 +272,219 @@ class Witi(AliceSkill):
 		# run other onbooted code
 		super().onBooted()
 
+		# Stage 1: reset the alarms to their previous state in the event that WITI crashed and rebooted.
+		# Nothing else is needed for that, so it happens before anything else. The runtime snapshot is
+		# quickest and has the full state, the database is the fall back
+		resumed = self.resumeRuntimeState()
+		anyArmed = self.restoreAlarmOutputs(resumed=resumed)
+		self._bootToArmed = time.monotonic() - self._createdAt
+		self.logInfo(f'Alarm outputs restored {self._bootToArmed * 1000:.0f} ms after the skill was created')
+
+		# Stage 2: take a snapshot of the settings, it gets swapped whenever a setting changes
+		self.reloadSettings()
+		self.createHistoryIndexes()
+
+		if not anyArmed:
+			self.markUsersHome()
+		else:
+			self.markUsersOut()
+		# A resumed presence is kept as it was
+		if not resumed:
+			self.updatePresenceDictionary(userchecking=False, userHome=not anyArmed)
+
+		# Start delivering Telegram messages, including any left over from the last run, and the alarm events
+		self._telegramQueue.start()
+		self._events.start()
+
+		# Stage 3: the lookups of other skills and devices don't hold up the start, they run side by side in the background
+		self._scheduler.newThread(name='WitiSatelliteLookup', target=self.lookupSatellite)
+		self._scheduler.newThread(name='WitiTelegramDiscovery', target=self.discoverTelegram)
+
+		# React to pin changes as they happen, the timer loop then only does a slow consistency sweep
+		if self._settings.useEdgeDetection:
+			self.enableEdgeDetection()
+
+		# Serve the metrics to Prometheus if a port is configured
+		if self._settings.prometheusPort:
+			self.startMetricsServer(self._settings.prometheusPort)
+
+		# delay reading GPIO pin states by 2 seconds, then keep one monitor loop running until the skill stops
+		self._monitor = self._scheduler.startPeriodic(
+			name='WitiMonitor',
+			func=self.stateMonitor,
+			initialDelay=2,
+			onError=self.monitorFailed
+		)
+		return True
+
+
+	def resumeRuntimeState(self) -> bool:
+		"""
+		Continue from the runtime snapshot of the last run: switch the alarms back and restore the
+		alarm states, pins, arming flags, presence and MQTT state, so nothing gets announced twice
+		:return: True if there was a snapshot of the current units
+		"""
+		try:
+			restored = self._runtimeSnapshot.load()
+		except OSError as e:
+			self.logWarning(f'Could not read the runtime snapshot: {e}')
+			restored = None
+
+		if not restored:
+			self._runtimeSnapshotLoaded = True
+			return False
+
+		# Saving stays off until every field is back, a save in between would write a newer slot
+		# holding partly restored units over the last good one
+		presence, states = restored
+		try:
+			for unit, state in zip(self._units, states):
+				self.switchAlarm(unit, bool(state.flags & RuntimeSnapshot.SWITCH_ON))
+				unit.alarmState = AlarmState(state.alarmState)
+				# The arming question died with its dialog session, so it gets asked again
+				if unit.alarmState is AlarmState.ARMING_PENDING:
+					unit.alarmState = AlarmState.DISARMED
+				unit.snapshot = GpioSnapshot.fromBits(state.bits)
+				unit.autoArmingActive = bool(state.flags & RuntimeSnapshot.AUTO_ARMED)
+				unit.voiceControlled = bool(state.flags & RuntimeSnapshot.VOICE_CONTROLLED)
+				unit.pinsRead = bool(state.flags & RuntimeSnapshot.PINS_READ)
+				unit.mqtt.restore(bits=state.mqttBits, version=state.mqttVersion)
+
+			self._presenceObject = {
+				"checkingForUser": bool(presence & RuntimeSnapshot.CHECKING_FOR_USER),
+				"someonesHome"   : bool(presence & RuntimeSnapshot.SOMEONES_HOME)
+			}
+		finally:
+			self._runtimeSnapshotLoaded = True
+		self.saveRuntimeState(sync=True)
+		self.logInfo(f'Resumed the runtime state of the last run: {self._units}')
+		return True
+
+
+	def saveRuntimeState(self, sync: bool = False):
+		"""
+		Write the runtime snapshot, this only touches the file when something changed
+		:param sync: wait for the disk, used when a switch pin changed as that must survive a power cut
+		"""
+		if not self._runtimeSnapshotLoaded:
+			return
+
+		presence = 0
+		if self._presenceObject.get('checkingForUser'):
+			presence |= RuntimeSnapshot.CHECKING_FOR_USER
+		if self._presenceObject.get('someonesHome'):
+			presence |= RuntimeSnapshot.SOMEONES_HOME
+
+		states = list()
+		for unit in self._units:
+			flags = 0
+			if unit.autoArmingActive:
+				flags |= RuntimeSnapshot.AUTO_ARMED
+			if unit.voiceControlled:
+				flags |= RuntimeSnapshot.VOICE_CONTROLLED
+			if unit.pinsRead:
+				flags |= RuntimeSnapshot.PINS_READ
+			if unit.switchOn:
+				flags |= RuntimeSnapshot.SWITCH_ON
+			states.append(UnitState(unit.alarmState.value, unit.snapshot.bits, flags, unit.mqtt.bits, unit.mqtt.version))
+
+		try:
+			self._runtimeSnapshot.save(presence, states, sync=sync)
+		except OSError as e:
+			self._log.warning('runtimeSnapshot', f'Could not write the runtime snapshot: {e}')
+
+
+	def restoreAlarmOutputs(self, resumed: bool = False) -> bool:
+		"""
+		Read the database and switch every unit's alarm back to its stored state
+		:param resumed: the outputs were already switched from the runtime snapshot. It can be newer
+			than the database, which is written with a delay, so the database is brought in line instead
+		:return: True if any unit is armed
+		"""
 		# Read and Store database items in a object
 		self.readDatabase()
 
 		# If Witi database is empty, add default values
 		if not self._witiDatabaseValues:
 			self.logInfo('Doing Initial setup of the WITI DataBase')
-			item = ['welcomeMessage', 'AlarmState', 'pinCode', 'mqttMessage', 'telegramID', 'telegramReminder']
-			for rowItem in item:
-				self.databaseInsert(
-					tableName='witi',
-					values={
-						"event" : rowItem,
-						"active": 0
-					}
-				)
+			self.seedDatabase()
+
+		# Units added since the last start get their own alarm state row
+		newUnits = [unit.dbEvent for unit in self._units if unit.dbEvent not in self._witiDatabaseValues]
+		if newUnits:
+			self.seedDatabase(events=newUnits)
+
+		anyArmed = False
+		for unit in self._units:
+			if resumed:
+				armed = unit.switchOn
+				self.updateValueInDB(event=unit.dbEvent, newState=int(armed))
+			else:
+				armed = bool(self._witiDatabaseValues[unit.dbEvent])
+				self.switchAlarm(unit, armed)
+			anyArmed = anyArmed or armed
+		return anyArmed
 
-		# reset the alarm to previous state in the event that WITI crashed and rebooted
-		if self._witiDatabaseValues["AlarmState"] == 0 or not self._witiDatabaseValues["AlarmState"]:
-			GPIO.output(Witi._SWITCH_ALARM, False)
-			self.UserManager.home()
-			self.updatePresenceDictionary(userchecking=False, userHome=True)
-		else:
-			GPIO.output(Witi._SWITCH_ALARM, True)
-			self.UserManager.leftHome()
-			self.updatePresenceDictionary(userchecking=False, userHome=False)
 
-		# Get the UID of the satellite so we know where to speak to
-		device = self.DeviceManager.getAliceTypeDevices(includeMain=False, connectedOnly=False)
-		self._satelliteUID = device[0].name
+	def lookupSatellite(self):
+		""" Background start up stage. Index the satellites so we know where to speak to """
+		started = time.monotonic()
+		try:
+			devices = self.DeviceManager.getAliceTypeDevices(includeMain=False, connectedOnly=False)
+			self._satellites.rebuild(self.satelliteEntry(device) for device in devices)
+			if not devices:
+				self.logWarning('No satellite found, speaking on the default device')
+		finally:
+			self._satelliteReady.set()
+		self.logDebug(f'Satellite lookup took {(time.monotonic() - started) * 1000:.0f} ms')
+
+
+	@staticmethod
+	def satelliteEntry(device) -> SatelliteEntry:
+		""" A device as seen by the satellite index. Not every core version knows the location of a device """
+		return device.name, getattr(device, 'locationID', None), bool(device.connected)
+
+
+	def onDeviceConnecting(self, **kwargs):
+		super().onDeviceConnecting(**kwargs)
+		self.satelliteConnectionChanged(self.satelliteName(**kwargs), connected=True)
+
+
+	def onDeviceDisconnecting(self, **kwargs):
+		super().onDeviceDisconnecting(**kwargs)
+		self.satelliteConnectionChanged(self.satelliteName(**kwargs), connected=False)
+
+
+	def satelliteName(self, uid: str = None, siteId: str = None, **_kwargs) -> Optional[str]:
+		""" The index key of the device Alice reports by uid. Cores that don't send a uid pass the site id """
+		if not uid:
+			return siteId
+		device = self.DeviceManager.getDevice(uid=uid)
+		return device.name if device else None
+
+
+	def satelliteConnectionChanged(self, name: Optional[str], connected: bool):
+		""" Keep the satellite index up to date, only a device it hasn't seen yet needs a new lookup """
+		if not name or not self._satellites.update(name, connected=connected):
+			self.lookupSatellite()
+
+
+	def replySite(self, session: DialogSession = None) -> Optional[str]:
+		""" Answer on the device the user spoke to, or on the best satellite if there's no session """
+		if session and session.siteId:
+			return session.siteId
+		return self._satellites.best
+
+
+	def discoverTelegram(self):
+		""" Background start up stage. Find the Telegram chat and send the one time welcome message """
+		started = time.monotonic()
 
 		# Check the status and settings of telegram
 		self.telegramStatusCheck()
 
 		# Display welcome message and IP address if MQTT is enabled. (Triggers only once)
-		if self.getConfig('enableMQTTmessages') and not self.getConfig('firstStartUp') and self._witiDatabaseValues[
+		if self._settings.enableMQTTmessages and not self._settings.firstStartUp and self._witiDatabaseValues[
 			"telegramID"]:
 			ipAddress = self.Commons.getLocalIp()
 			text = f"Welcome to WITI voice control. To recieve MQTT messages for your further personalised configuration, then " \
@@ -116,17 +494,132 @@ class Witi(AliceSkill):
 			# Update the config file to prevent seeing this message each start up
 			self.updateConfig(key='firstStartUp', value='true')
 
-		# delay reading GPIO pin states by 2 seconds
-		self.ThreadManager.doLater(
-			interval=2,
-			func=self.stateMonitor
+		self.logDebug(f'Telegram discovery took {(time.monotonic() - started) * 1000:.0f} ms')
+
+
+	def onStop(self):
+		super().onStop()
+		# No more ticks while the pins and sinks are torn down
+		if self._monitor:
+			self._monitor.stop()
+		if self._metricsTask:
+			self._metricsTask.stop()
+			self._metricsTask = None
+		if self._metricsServer:
+			self._metricsServer.stop()
+		self.disableEdgeDetection()
+		# Only the inputs are released, the switch outputs keep the alarm as it is while the skill is down
+		self._gpio.cleanup()
+		# The event sinks still queue Telegram messages and database writes, so they stop first
+		self._events.stop()
+		self._notifications.flushAll()
+		self._telegramQueue.stop()
+		self._log.flush()
+		self.flushDatabaseWrites()
+		self.flushConfigWrites()
+		self._history.flush()
+		self.saveRuntimeState()
+		self._runtimeSnapshot.close()
+
+
+	def onSkillUpdated(self, **kwargs):
+		super().onSkillUpdated(**kwargs)
+		self.reloadSettings()
+
+
+	def updateConfig(self, key: str, value: Any):
+		""" Write a setting and swap in a fresh settings snapshot """
+		with self._handlerProfiler.phase('config'):
+			super().updateConfig(key=key, value=value)
+			self.reloadSettings()
+
+
+	def reloadSettings(self):
+		""" Load a new settings snapshot and swap it in one go """
+		self._settings = WitiConfig.load(self.getConfig)
+		self._history.retentionDays = self._settings.historyRetentionDays
+		self.configureMonitorInterval()
+		self.scheduleMetrics()
+		try:
+			self._notifications.configure(parseRules(self._settings.notificationPolicy))
+		except ValueError as e:
+			self.logWarning(f'{e}, keeping the current notification rules')
+		with self._evaluationLock:
+			self._conditioner.configure(
+				mode=self._settings.inputConditioning,
+				samples=self._settings.conditioningSamples,
+				window=self._settings.conditioningWindowMs / 1000
+			)
+		self._handlerProfiler.configure(
+			enabled=self._settings.profileIntentHandlers,
+			thresholdMs=self._settings.slowIntentHandlerMs,
+			keepProfiles=self._settings.intentHandlerProfilesKept
+		)
+
+
+	def updateConfigLater(self, key: str, value: Any):
+		"""
+		Used by the voice commands. The snapshot is updated straight away but the config file
+		write is collected with any other change in the next _CONFIG_FLUSH_DELAY seconds
+		"""
+		with self._configLock:
+			self._pendingConfigWrites[key] = value
+			self._settings = self._settings.withValue(key, value)
+			if self._configFlushScheduled:
+				return
+			self._configFlushScheduled = True
+
+		self._scheduler.doLater(
+			interval=Witi._CONFIG_FLUSH_DELAY,
+			func=self.flushConfigWrites
+		)
+
+
+	def flushConfigWrites(self):
+		""" Write all pending setting changes, then reload the snapshot once """
+		with self._configLock:
+			pending = self._pendingConfigWrites
+			self._pendingConfigWrites = dict()
+			self._configFlushScheduled = False
+
+		if not pending:
+			return
+
+		with self._handlerProfiler.phase('config'):
+			for key, value in pending.items():
+				super().updateConfig(key=key, value=value)
+			self.reloadSettings()
+
+
+	# noinspection PyUnusedLocal
+	def onSettingUpdated(self, value: Any = None) -> bool:
+		"""
+		onUpdate of every setting in config.json.template. Alice's settings page writes the config without
+		going through updateConfig, so the snapshot is reloaded shortly after, once the write is done.
+		Changes in a burst share one reload
+		"""
+		with self._configLock:
+			if self._settingsReloadScheduled:
+				return True
+			self._settingsReloadScheduled = True
+
+		self._scheduler.doLater(
+			interval=Witi._SETTINGS_RELOAD_DELAY,
+			func=self.reloadChangedSettings
 		)
 		return True
 
 
+	def reloadChangedSettings(self):
+		with self._configLock:
+			self._settingsReloadScheduled = False
+		self.reloadSettings()
+
+
 	########### Intent Handlers (captures speech triggers) ###########
 
 	@IntentHandler('SwitchWitiState')
+	@profiledHandler
 	def determineRequestedState(self, session: DialogSession, **_kwargs):
 		"""
 		User has made a voice request....(created a dialog session)
@@ -138,15 +631,16 @@ class Witi(AliceSkill):
 		if self.IgnitionFeedBack(session=session) and session.slotValue('WitiState') == 'on':
 			return
 
-		# we set _voiceControlled to True, it overrides automatic Arming/disarming. It will be True during any
+		# we set voiceControlled to True, it overrides automatic Arming/disarming. It will be True during any
 		# intenthandler, as a intentHandler can't be triggered unless someone is at home and using their voice.
-		self._voiceControlled = True
+		unit = self.unitForSession(session)
+		unit.voiceControlled = True
 
 		# If user has requested the state of the alarm to be "on"....
 		if session.slotValue('WitiState') == 'on':
 			self.updatePresenceDictionary(userchecking=False, userHome=False)
 			self.endSession(sessionId=session.sessionId)
-			self.enableAlarm()
+			self.enableAlarm(unit, siteId=self.replySite(session))
 		else:
 			self.disableAlarm(session=session)
 
@@ -154,20 +648,23 @@ class Witi(AliceSkill):
 	# If user has specifically stated to turn the alarm "on" then do this as theres no need to check
 	# what state user is after
 	@IntentHandler('WitiOnState')
+	@profiledHandler
 	def requestedOnState(self, session: DialogSession, **_kwargs):
 		if self.IgnitionFeedBack(session=session):
 			return
 
-		self._voiceControlled = True
+		unit = self.unitForSession(session)
+		unit.voiceControlled = True
 		self.endSession(sessionId=session.sessionId)
 
 		# set userState to away ('out')
-		self.UserManager.leftHome()
+		self.markUsersOut()
 		self.updatePresenceDictionary(userchecking=False, userHome=False)
-		self.enableAlarm()
+		self.enableAlarm(unit, siteId=self.replySite(session))
 
 
 	@IntentHandler(intent='PinCode', requiredState='renewingPinCode')
+	@profiledHandler
 	def renewPincode(self, session: DialogSession):
 		""" User is updating their pinCode
 			- Listen only for digits
@@ -183,14 +680,14 @@ class Witi(AliceSkill):
 				self.endDialog(
 					sessionId=session.sessionId,
 					text=f'That pin number is not 4 digits, You\'ll have to ask me again sorry',
-					siteId=str(self._satelliteUID)
+					siteId=self.replySite(session)
 				)
 			else:
-				self.updateConfig(key='pinCode', value=pin)
+				self.updateConfigLater(key='pinCode', value=pin)
 				self.endDialog(
 					sessionId=session.sessionId,
 					text=f'pin code has been updated to {[digit for digit in pin]}',
-					siteId=str(self._satelliteUID)
+					siteId=self.replySite(session)
 				)
 		else:
 			self.continueDialog(
@@ -202,46 +699,69 @@ class Witi(AliceSkill):
 
 
 	@IntentHandler(intent='PinCode', requiredState='ListenForPinCode')
+	@profiledHandler
 	def confirmPinCode(self, session: DialogSession, **_kwargs):
 		""" If user has enabled forcePinCode setting for disarming the alarm then do this """
 
 		# If user provides the correct PinCode
-		if session.slotValue('Number') == self.getConfig('pinCode'):
+		if session.slotValue('Number') == self._settings.pinCode:
 			# Continue to disable the Alarm
-			self.disarmCode(session=session, sendTelegram=True, user=session.user)
+			self.disarmCode(session=session, sendTelegram=True, user=session.user, unit=self.unitForSession(session))
 		else:
 			# if incorrect pinCode. Abort and user will have to try again. Send a telgram message
 			self.endDialog(
 				sessionId=session.sessionId,
 				text='Sorry but you provided me the wrong pin code. Aborting',
-				siteId=str(self._satelliteUID)
+				siteId=self.replySite(session)
 			)
-			self.sendTelegramMessage(f'{session.user} just provided a incorrect pinCode')
+			self.sendTelegramMessage(f'{session.user} just provided a incorrect pinCode', kind=NotificationType.PIN_FAILURE, sender=session.user)
 
 
 	@IntentHandler(intent='AnswerYesOrNo', requiredState='askingToCancelAlarm')
+	@profiledHandler
 	def yesOrNoResponce(self, session: DialogSession):
 		""" Checking if a user is home. If there's a responce... cancel arming the alarm"""
 
 		# If a user responds with a yes to the question asked...
 		if self.Commons.isYes(session):
 			self.updatePresenceDictionary(userchecking=False, userHome=True)
-			self.UserManager.home()
-			self._voiceControlled = True
+			self.markUsersHome()
+			unit = self.unitForSession(session)
+			unit.voiceControlled = True
 			self.endDialog(
 				sessionId=session.sessionId,
 				text='ok, cancelled',
-				siteId=str(self._satelliteUID)
+				siteId=self.replySite(session)
 			)
-			self.sendTelegramMessage(f'Enabling the alarm was cancelled by someone at home')
+			self.sendTelegramMessage(f'Enabling the alarm was cancelled by someone at home', unit=unit)
 		else:
 			# set user states and let the dialog timeout. When it timesout it is assumed no one is
 			# home so alarm will get enabled.
 			self.updatePresenceDictionary(userchecking=False, userHome=False)
-			self.UserManager.leftHome()
+			self.markUsersOut()
+
+
+	@IntentHandler('WitiHistory')
+	@profiledHandler
+	def reportHistory(self, session: DialogSession, **_kwargs):
+		""" Tell the user how often the alarm was triggered in the last 24 hours """
+		total, latest = self._history.count(pin='triggeredState', value=1, since=time.time() - DAY)
+
+		if not total:
+			text = 'The alarm hasn\'t been triggered in the last 24 hours'
+		else:
+			text = f'The alarm was triggered {total} {"time" if total == 1 else "times"} in the last 24 hours, ' \
+				   f'the last time at {time.strftime("%H:%M", time.localtime(latest))}'
+
+		self.endDialog(
+			sessionId=session.sessionId,
+			text=text,
+			siteId=self.replySite(session)
+		)
 
 
 	@IntentHandler('WitiSettings')
+	@profiledHandler
 	def adjustWitiSettings(self, session: DialogSession):
 		""" Allows user to adjust WITI settings via voice """
 
@@ -259,7 +779,7 @@ class Witi(AliceSkill):
 				self.endDialog(
 					sessionId=session.sessionId,
 					text=f'Sorry but i don\'t know who you are. Please call me by my name and try again',
-					siteId=str(self._satelliteUID)
+					siteId=self.replySite(session)
 				)
 				self.sendTelegramMessage(
 					f'{session.user} just failed to turn {session.slotValue("WitiState")} the pincode setting')
@@ -287,7 +807,7 @@ class Witi(AliceSkill):
 					self.endDialog(
 						sessionId=session.sessionId,
 						text='Sorry but i don\'t recognise you. Please call me by my name',
-						siteId=str(self._satelliteUID)
+						siteId=self.replySite(session)
 					)
 
 			elif session.slotValue('notification') == 'enabled':
@@ -321,81 +841,123 @@ class Witi(AliceSkill):
 	@IntentHandler(intent='UserRandomAnswer', requiredState='changingTriggeredNotificationMessage')
 	@IntentHandler(intent='UserRandomAnswer', requiredState='changingEnabledNotificationMessage')
 	@IntentHandler(intent='UserRandomAnswer', requiredState='changingDisabledNotificationMessage')
+	@profiledHandler
 	def changingNotificationMessage(self, session: DialogSession):
 		""" Intents for changing notification messages"""
 
 		if 'changingTriggeredNotificationMessage' in session.currentState:
-			self.updateConfig(key='triggeredMessage', value=session.payload['input'])
+			self.updateConfigLater(key='triggeredMessage', value=session.payload['input'])
 
 		elif 'changingEnabledNotificationMessage' in session.currentState:
-			self.updateConfig(key='enabledNotification', value=session.payload['input'])
+			self.updateConfigLater(key='enabledNotification', value=session.payload['input'])
 
 		elif 'changingdisabledNotificationMessage' in session.currentState:
-			self.updateConfig(key='disabledNotification', value=session.payload['input'])
+			self.updateConfigLater(key='disabledNotification', value=session.payload['input'])
 
 		self.endDialog(
 			sessionId=session.sessionId,
 			text=f'Just changed that message to {session.payload["input"]}',
-			siteId=str(self._satelliteUID)
+			siteId=self.replySite(session)
 		)
 
 
 	def updateConfigFileSetting(self, session, key: str):
 		""" Method for updating config.json values from true to false and visa versa"""
 		if 'on' in session.slotValue('WitiState'):
-			self.updateConfig(key=key, value="true")
+			self.updateConfigLater(key=key, value="true")
 
 		elif 'off' in session.slotValue('WitiState'):
-			self.updateConfig(key=key, value="false")
+			self.updateConfigLater(key=key, value="false")
 
 		self.endDialog(
 			sessionId=session.sessionId,
 			text=f'No Problem, That setting is now {session.slotValue("WitiState")}',
-			siteId=str(self._satelliteUID)
+			siteId=self.replySite(session)
 		)
 
 
-	def sendTelegramMessage(self, message: str):
+	def sendTelegramMessage(self, message: str, unit: WitiUnit = None, kind: NotificationType = None, sender: str = None):
 		"""
 		:param message: a string of the message to send
-
-		- Creates a telegram instance if ChatID is configured
-		- Sends the message to the telegram bot
+		:param unit: the unit the message is about. Goes to that unit's chat if it has one, and
+			is prefixed with the unit name for any unit but the primary one
+		:param kind: what the message is about. Messages of a kind go through the notification policy,
+			which holds back repeats and merges bursts into one digest
+		:param sender: who the message names, so a digest of several people's messages lists them all
+
+		- Queues the message for the telegram bot if ChatID is configured
+		- Delivery happens in the background, so this returns straight away
 		"""
-		if self._witiDatabaseValues['telegramID']:
-			telegram = Telegram.Telegram()
-			telegram.sendMessage(chatId=self._witiDatabaseValues['telegramID'], message=message)
+		if kind and self._settings.throttleNotifications:
+			self._notifications.notify(kind, unit, message, sender=sender)
+		else:
+			self.queueTelegramMessage(unit, message, kind)
+
+
+	def queueTelegramMessage(self, unit: Optional[WitiUnit], message: str, kind: NotificationType = None):
+		""" Hand the message to the Telegram queue, in the chat of the unit. Trigger and disarm messages are never dropped by a full queue """
+		chatId = self._witiDatabaseValues['telegramID']
+		if unit and not unit.primary:
+			chatId = unit.telegramChatId or chatId
+			message = f'{unit.name}: {message}'
+
+		if chatId:
+			with self._handlerProfiler.phase('telegram'):
+				self._telegramQueue.enqueue(chatId=chatId, message=message, critical=kind in Witi._CRITICAL_NOTIFICATIONS)
+
+
+	def telegramClient(self) -> 'Telegram.Telegram':
+		""" The long lived Telegram instance, created on first use. The Telegram skill is only imported here """
+		if not self._telegram:
+			from skills.Telegram import Telegram
+
+			self._telegram = Telegram.Telegram()
+		return self._telegram
+
+
+	def deliverTelegramMessage(self, chatId: str, message: str):
+		""" Used by the Telegram queue worker to do the actual sending """
+		started = time.perf_counter()
+		try:
+			self.telegramClient().sendMessage(chatId=chatId, message=message)
+		except Exception:
+			self._metrics.increment('telegram_failures')
+			raise
+
+		self._metrics.increment('telegram_sent')
+		self._metrics.observe('telegram_send_seconds', time.perf_counter() - started)
 
 
 	### Enable the Alarm
-	def enableAlarm(self):
+	def enableAlarm(self, unit: WitiUnit = None, siteId: str = None):
+		"""
+		:param unit: the unit to arm, the primary one if not given
+		:param siteId: where to announce it, the best satellite if not given
+		"""
+		unit = unit or self._primaryUnit
+		siteId = siteId or self._satellites.best
 		self.logDebug(f'***** ENABLE ALARM *****')
 
 		# If these states are true, don't enable the alarm
-		if self.dontEnableAlarmStates():
+		if self.dontEnableAlarmStates(unit):
 			return
 
 		# Run this block of code if Alarm is able to be turned ON
-		if self.gpioState('AlarmState') == 'off':
+		if not unit.snapshot.alarmOn:
 			# No longer checking if a user is home so set to False
 			self._presenceObject['checkingForUser'] = False
-			# Print a debug message and inform user alarm is now set to on
 			self.logDebug(f'Turning "ON" the alarm')
-			self.say(
-				text='Ok turning the alarm on',
-				siteId=str(self._satelliteUID)
-			)
-			# Switch the actual GPIO pin on to enable alarm
-			GPIO.output(Witi._SWITCH_ALARM, True)
-			self.updateValueInDB(event='AlarmState', newState=1)
-			self.sendTelegramMessage(self.getConfig('enabledNotification'))
+			# Switch the actual GPIO pin on to enable alarm and store it, the announcement and notifications follow from the event
+			self.switchAlarm(unit, True)
+			self.persistAlarmState(unit)
+			self._events.publish(AlarmEvent.ARMED, unit, siteId=siteId)
 		else:
 			self.say(
-				text='The alarm was already on. No further change done.',
-				siteId=str(self._satelliteUID)
+				text=f'The {self.alarmName(unit)} was already on. No further change done.',
+				siteId=siteId
 			)
 			self._presenceObject['checkingForUser'] = False
-			self.logWarning(f'The Alarm was already "{self.gpioState("AlarmState")}"')
+			self.logWarning(f'The {self.alarmName(unit)} was already "{unit.snapshot.states["AlarmState"]}"')
 
 
 	def disableAlarm(self, session):
@@ -404,12 +966,14 @@ class Witi(AliceSkill):
 		1. User is a recognised admin or..
 		2. User has provided a pin number to disable the alarm
 		"""
+		unit = self.unitForSession(session)
+
 		# If alarm is already off, then abort and tell user
-		if self.gpioState('AlarmState') == 'off':
-			self.announceNoAction(session=session, state=self.gpioState('AlarmState'))
+		if not unit.snapshot.alarmOn:
+			self.announceNoAction(session=session, state=unit.snapshot.states['AlarmState'])
 			return
 
-		if self.getConfig('forcePinCode'):
+		if self._settings.forcePinCode:
 			self.continueDialog(
 				sessionId=session.sessionId,
 				text='Sure. However I\'ll need your pin code first please.',
@@ -422,22 +986,38 @@ class Witi(AliceSkill):
 		# If user is in the database and has admin rights. Then turn off the alarm
 		if not constants.UNKNOWN_USER in session.user and self.UserManager.hasAccessLevel(session.user,
 																						  AccessLevel.ADMIN):
-			self.disarmCode(session=session, sendTelegram=True, user=session.user)
+			self.disarmCode(session=session, sendTelegram=True, user=session.user, unit=unit)
 
 		else:
 			self.endDialog(
 				sessionId=session.sessionId,
 				text='Sorry but i don\'t recognise you. Please call me by my name and ask again',
-				siteId=str(self._satelliteUID)
+				siteId=self.replySite(session)
 			)
 
 
+	def switchAlarm(self, unit: WitiUnit, on: bool):
+		""" Drive the switch pin of a unit """
+		with self._handlerProfiler.phase('gpio'):
+			self._gpio.output(unit.pins.switch, on)
+		unit.switchOn = on
+		self.saveRuntimeState(sync=True)
+
+
+	def persistAlarmState(self, unit: WitiUnit):
+		"""
+		Store the unit's switch state in the database. Done by the caller right after switchAlarm rather
+		than by an event sink, whose bounded queue may drop events
+		"""
+		self.updateValueInDB(event=unit.dbEvent, newState=1 if unit.switchOn else 0)
+
+
 	def announceAction(self, session, state: str):
 		""" Announce the state of the alarm """
 		self.endDialog(
 			sessionId=session.sessionId,
 			text=f'Ok, turning the alarm *{state}* now',
-			siteId=str(self._satelliteUID)
+			siteId=self.replySite(session)
 		)
 
 
@@ -446,13 +1026,88 @@ class Witi(AliceSkill):
 		self.endDialog(
 			sessionId=session.sessionId,
 			text=f'The Alarm is already *{state}*, No further action taken',
-			siteId=str(self._satelliteUID)
+			siteId=self.replySite(session)
 		)
 
 
-	def stateMonitor(self):
+	def stateMonitor(self) -> float:
 		"""
-		This is the main loop, triggered by a timer.
+		This is the main loop, run over and over by the monitor task started in onBooted.
+		When edge detection is active the pin callbacks do the real work and this loop
+		only runs as a slow consistency sweep in case an edge was missed.
+		:return: seconds until the next run
+		"""
+		# Drift and interval are on the scheduler's clock, the time the tick takes is real time
+		now = self._scheduler.now()
+		if self._monitor and self._monitor.running:
+			self._metrics.observe('monitor_drift_seconds', max(0.0, now - self._monitor.due))
+		if self._lastTick is not None:
+			self._metrics.observe('monitor_interval_seconds', now - self._lastTick)
+		self._lastTick = now
+
+		started = time.monotonic()
+		changed = self.evaluateStates()
+		self._metrics.increment('monitor_ticks')
+		self._metrics.observe('monitor_tick_seconds', time.monotonic() - started)
+		self._monitorFailing = False
+
+		# recheck the states after x seconds, depending on how busy things are
+		return self.monitorInterval(changed)
+
+
+	def monitorFailed(self, error: Exception):
+		"""
+		A stateMonitor run raised, the loop carries on with its last interval. The first failure after a
+		good run is logged with its traceback, the repeats of it only as a rate limited line
+		"""
+		self._metrics.increment('monitor_errors')
+		if not self._monitorFailing:
+			self._monitorFailing = True
+			stack = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+			self.logError(f'stateMonitor run failed: {error}\n{stack}')
+		else:
+			self._log.warning('monitor', f'stateMonitor run failed again: {error}')
+
+
+	def wakeMonitor(self):
+		""" Something happened, so step the monitor loop up to its fast cadence straight away """
+		if self._monitor:
+			self._monitor.wake(self.monitorInterval(changed=True))
+
+
+	def monitorInterval(self, changed: bool = False) -> float:
+		"""
+		Seconds until the next run of the stateMonitor loop
+		:param changed: the last run saw a change
+		"""
+		if not self._settings.adaptiveScheduling:
+			if self._edgeDetection:
+				return self._settings.secondsBetweenConsistencySweeps
+			return self._settings.secondsBetweenUpdates
+
+		active = False
+		for unit in self._units:
+			if unit.alarmState in Witi._ACTIVE_STATES:
+				active = True
+				break
+		return self._monitorInterval.next(active=active, changed=changed)
+
+
+	def configureMonitorInterval(self):
+		"""
+		Bounds of the adaptive cadence. With edge detection the edges already give a fast reaction,
+		so the loop only needs the normal update cadence while active and the sweep cadence while idle
+		"""
+		if self._edgeDetection:
+			self._monitorInterval.configure(fast=self._settings.secondsBetweenUpdates, idle=self._settings.secondsBetweenConsistencySweeps)
+		else:
+			self._monitorInterval.configure(fast=self._settings.minSecondsBetweenUpdates, idle=self._settings.maxSecondsBetweenUpdates)
+
+
+	def evaluateStates(self) -> bool:
+		"""
+		Evaluate the current pin states of every unit. Called by the stateMonitor loop and by the GPIO edge callbacks
+		Returns True if a pin or the alarm state of any unit changed
 		* Purpose:
 		1. Update the GPIO values with current states
 		2. Monitor trailer unit pairing. If enabled:
@@ -466,86 +1121,381 @@ class Witi(AliceSkill):
 			- Alarm has been triggered
 			- Can't activate alarm if Iginition signal present
 		"""
-		self.updateGPIOvalues()
+		# Edge callbacks run on the GPIO thread, so don't let them interleave with the timer loop
+		with self._evaluationLock:
+			# Every consumer in this tick works from the same snapshots, so each pin is only read once
+			previous = [unit.snapshot for unit in self._units]
+			self.updateGPIOvalues()
+
+			changed = False
+			for unit, previousSnapshot in zip(self._units, previous):
+				changed = self.evaluateUnit(unit, previousSnapshot) or changed
+
+			# A pin change waiting for confirmation gets its next sample after the conditioning window
+			if self._conditioner.pending and not self._confirmationScheduled:
+				self._confirmationScheduled = True
+				self._scheduler.doLater(
+					interval=self._conditioner.window,
+					func=self.confirmInputs
+				)
+
+			# send MQTT message if enabled
+			self.mqttBrokerMessage()
+			self.saveRuntimeState()
+
+			return changed
+
+
+	def confirmInputs(self):
+		""" Evaluate again once a pending pin change has been stable for the conditioning window """
+		self._confirmationScheduled = False
+		if self.evaluateStates() and self._settings.adaptiveScheduling and self._monitorInterval.current > self._monitorInterval.fast:
+			self.wakeMonitor()
+
+
+	def evaluateUnit(self, unit: WitiUnit, previous: GpioSnapshot) -> bool:
+		"""
+		Run the state machine of one unit on its snapshot of this tick
+		:param previous: the unit's snapshot of the last tick
+		:return: True if a pin or the alarm state of the unit changed
+		"""
+		snapshot = unit.snapshot
+
+		# One table lookup decides the new alarm state and which side effects to run
+		previousState = unit.alarmState
+		unit.alarmState, actions = AlarmStateMachine.nextTransition(previousState, snapshot.bits | self.stateFlags(unit))
+		for action in actions:
+			self._stateActions[action](unit)
+
+		# The first read is the start up state, not a transition
+		if unit.pinsRead and snapshot.bits != previous.bits:
+			self.recordTransitions(unit, previous, snapshot)
+		unit.pinsRead = True
+
+		return snapshot.bits != previous.bits or unit.alarmState is not previousState
+
+
+	def stateFlags(self, unit: WitiUnit) -> int:
+		""" The non pin inputs of a unit's alarm state machine as bits """
+		flags = 0
+		if self._settings.turnOnAutoArming:
+			flags |= AlarmStateMachine.AUTO_ARMING_ENABLED
+		if unit.voiceControlled:
+			flags |= AlarmStateMachine.VOICE_CONTROLLED
+		if unit.autoArmingActive:
+			flags |= AlarmStateMachine.AUTO_ARMED
+		return flags
+
+
+	def unitForSession(self, session: DialogSession) -> WitiUnit:
+		""" The unit a dialog is about. Voice commands act on the primary unit unless the dialog was started for another one """
+		name = session.customData.get('unit') if session.customData else None
+		for unit in self._units:
+			if unit.name == name:
+				return unit
+		return self._primaryUnit
+
+
+	def alarmName(self, unit: WitiUnit) -> str:
+		""" How to call the unit's alarm when speaking """
+		return 'alarm' if unit.primary else f'{unit.name} alarm'
+
+
+	################################## State machine actions ################################
+	def alarmTriggered(self, unit: WitiUnit):
+		""" Send text messages via Telegram when the alarm is triggered """
+		# A security event, the state machine already fires this once per transition so it's never rate limited
+		self.logInfo(f'** ALARM OF UNIT {unit.name} HAS BEEN TRIGGERED ** ')
+		self._events.publish(AlarmEvent.TRIGGERED, unit)
+
+
+	def triggerCleared(self, unit: WitiUnit):
+		""" The triggered responce has timed out. Inform user the alarm has gone back to monitoring mode """
+		self.logDebug(f'Alarm trigger of unit {unit.name} is now off. Going back to monitoring mode')
+		self._events.publish(AlarmEvent.TRIGGER_CLEARED, unit)
+
+
+	def pairingLost(self, unit: WitiUnit):
+		"""
+		Vehicle was paired but now its not:
+		1. ask if anyones home
+		2. if session timesout, assume no ones home and turn on alarm
+		3. If user responds with yes - cancel alarm
+		"""
+		self.updatePresenceDictionary(userchecking=True, userHome=False)
 
-		# Send text messages via Telegram if Alarm is triggered and it's the first time it's been seen
-		if self.gpioState('AlarmState') == "on" and self.gpioState(
-				'triggeredState') == "on" and not self._alarmHasBeenTriggered:
-			# set this var to prevent repeat messages
-			self._alarmHasBeenTriggered = True
-			self.logInfo(f'** ALARM HAS BEEN TRIGGERED ** ')
+		# The question to the user is asked by the tts sink. No responce assumes no ones home and alarm will be enabled
+		# when the dialog session times out.
+		self._events.publish(AlarmEvent.PAIRING_LOST, unit)
 
-			# Send a telegram message
-			self.sendTelegramMessage(self.getConfig('triggeredMessage'))
 
+	################################## Event sinks ################################
+	# Run on the event bus workers after the GPIO work is done, so a slow sink doesn't hold up the alarm
+	def speakEvent(self, event: Event):
+		unit: WitiUnit = event.unit
+		if event.type is AlarmEvent.ARMED:
+			self.say(
+				text=f'Ok turning the {self.alarmName(unit)} on',
+				siteId=event.data['siteId']
+			)
+
+		elif event.type is AlarmEvent.TRIGGERED:
 			# If user has enabled sounds. Trigger some user defined speech. (novelty feature)
-			if self.getConfig('activateSoundOnTrigger'):
+			if self._settings.activateSoundOnTrigger:
 				self.say(
 					text='Uploading live camera footage to the cloud. Also alerting neighbourhood watch contacts',
-					siteId=str(self._satelliteUID)
+					siteId=self._satellites.best
 				)
 
-		# If alarm is on and triggered responce has timed out and trigger var is still True...
-		# Inform user the alarm has reset and gone back to monitoring mode
-		if self.gpioState('AlarmState') == "on" and self.gpioState(
-				'triggeredState') == "off" and self._alarmHasBeenTriggered:
-			self.logDebug(f"Alarm trigger is now {self.gpioState('AlarmState')}. Going back to monitoring mode")
-			self.sendTelegramMessage('Alarm has now stopped making noise, but is still active')
-
-			self._alarmHasBeenTriggered = False
-
-		# if we can't detect the vehicle unit, assume vehicle is away and arm the alarm
-		# providing some one hasn't manually disabled the alarm because they are home
-		if not self._voiceControlled:
-			self.autoArming()
-		elif self.resetAutoArming():
-			self._voiceControlled = False
-
-		# send MQTT message if enabled
-		self.mqttBrokerMessage()
-
-		# every x amount of seconds, recheck the states
-		self.ThreadManager.doLater(
-			interval=self.getConfig('secondsBetweenUpdates'),
-			func=self.stateMonitor
+		elif event.type is AlarmEvent.PAIRING_LOST:
+			self.ask(
+				text=f'I\'ve detected the vehicle has left. Reply with "yes" if you\'d like me to cancel turning on the {self.alarmName(unit)}',
+				intentFilter=['AnswerYesOrNo'],
+				currentDialogState='askingToCancelAlarm',
+				customData={'unit': unit.name},
+				siteId=self._satellites.best
+			)
+
+
+	def notifyEvent(self, event: Event):
+		unit: WitiUnit = event.unit
+		if event.type is AlarmEvent.ARMED:
+			self.sendTelegramMessage(self._settings.enabledNotification, unit=unit, kind=NotificationType.ARMED)
+
+		elif event.type is AlarmEvent.DISARMED:
+			if not event.data['notify']:
+				return
+			if event.data['user']:
+				self.sendTelegramMessage(f'{event.data["user"]} has just disabled the alarm', unit=unit, kind=NotificationType.DISARMED, sender=event.data['user'])
+			else:
+				self.sendTelegramMessage(f'The alarm has just been turned off by a unknown person', unit=unit, kind=NotificationType.DISARMED, sender='a unknown person')
+
+		elif event.type is AlarmEvent.TRIGGERED:
+			self.sendTelegramMessage(self._settings.triggeredMessage, unit=unit, kind=NotificationType.TRIGGERED)
+
+		elif event.type is AlarmEvent.TRIGGER_CLEARED:
+			self.sendTelegramMessage('Alarm has now stopped making noise, but is still active', unit=unit, kind=NotificationType.TRIGGER_CLEARED)
+
+
+	def publishEvent(self, event: Event):
+		""" Every alarm event on "<unit topic>/events", next to the state bitmask """
+		if not self._settings.enableMQTTmessages:
+			return
+
+		unit: WitiUnit = event.unit
+		self.publish(
+			f'{unit.mqtt.topic}/events',
+			payload={'event': event.type.value, 'unit': unit.name, 'timestamp': round(event.timestamp, 3)}
 		)
 
 
+	def vehicleReturned(self, unit: WitiUnit):
+		""" Vehicle is paired again after the alarm was auto armed, remind the user to turn the alarm off """
+		if self._presence.userHome:
+			return
+
+		self.logInfo(f'I have auto detected that the vehicle of unit {unit.name} has returned')
+		self.logDebug('Setting user state to home')
+		self.markUsersHome()
+		self.updatePresenceDictionary(userchecking=False, userHome=self._presence.userHome)
+
+		# Say a welcome home reminder after "secondsAfterReturningHome" seconds (configured in settings)
+		self._scheduler.doLater(
+			interval=self._settings.secondsAfterReturningHome,
+			func=self.welcomeHome,
+			args=[unit]
+		)
+
+
+	def resetVoiceControl(self, unit: WitiUnit):
+		"""
+		 If alarm was disabled while pairing was disconnected and vehicle is now connected again
+		 Reset vars so that autoarming will enable next time vehicle disconnects
+		"""
+		unit.voiceControlled = False
+
+
+	def recordTransitions(self, unit: WitiUnit, previous: GpioSnapshot, snapshot: GpioSnapshot):
+		""" Add every pin of the unit that changed between two snapshots to the transition history """
+		alarmState = unit.alarmState.name
+		full = False
+		for pin, previousState in previous.states.items():
+			if snapshot.states[pin] != previousState:
+				bit = GpioSnapshot.PIN_BITS[pin]
+				full = self._history.record(pin=pin, value=int(bool(snapshot.bits & bit)), alarmState=alarmState, unit=unit.name) or full
+
+		if full:
+			self.flushHistory()
+		elif not self._historyFlushScheduled:
+			self._historyFlushScheduled = True
+			self._scheduler.doLater(
+				interval=Witi._HISTORY_FLUSH_DELAY,
+				func=self.flushHistory
+			)
+
+
+	def flushHistory(self):
+		""" Write the buffered transitions to the database """
+		self._historyFlushScheduled = False
+		self._history.flush()
+
+
+	def createHistoryIndexes(self):
+		""" The history queries look up by time and by pin and time """
+		table = f'{self.name}_transitions'
+		self.databaseExecute(query=f'CREATE INDEX IF NOT EXISTS {table}_time ON :__table__ (timestamp)', tableName='transitions')
+		self.databaseExecute(query=f'CREATE INDEX IF NOT EXISTS {table}_pin_time ON :__table__ (pin, timestamp)', tableName='transitions')
+
+
+	def historyFetch(self, query: str, values: dict) -> List[dict]:
+		""" Query the transition history table """
+		return [dict(row) for row in self.databaseFetch(tableName='transitions', query=query, values=values, method='all')]
+
+
+	def enableEdgeDetection(self):
+		""" Register edge callbacks on the input pins of every unit so state changes get handled straight away """
+		try:
+			for unit in self._units:
+				for pin, bounceTime in zip(unit.pins.inputs, Witi._BOUNCE_TIME.inputs):
+					self._gpio.addEdgeCallback(pin, callback=self.onPinEdge, bounceTime=bounceTime)
+			self._edgeDetection = True
+			self.configureMonitorInterval()
+		except RuntimeError as e:
+			self.logWarning(f'Edge detection is not available, falling back to polling: {e}')
+			self.disableEdgeDetection()
+
+
+	def disableEdgeDetection(self):
+		""" Remove the edge callbacks from the input pins """
+		self._edgeDetection = False
+		self.configureMonitorInterval()
+		for pin in self._inputPins:
+			self._gpio.removeEdgeCallback(pin)
+
+
+	# noinspection PyUnusedLocal
+	def onPinEdge(self, channel: int):
+		""" GPIO callback for a rising or falling edge on one of the input pins """
+		if self.evaluateStates() and self._settings.adaptiveScheduling and self._monitorInterval.current > self._monitorInterval.fast:
+			self.wakeMonitor()
+
+
 	def mqttBrokerMessage(self):
 		"""
 		If enabled in the settings....
 
-		1. update GPIO values with current states
-		2. Set the MQTT payload values to human friendly states
-		3. publish the MQTT payload to the "WitiAlarm" topic
-		"""
-		self.updateGPIOvalues()
-
-		if self.getConfig('enableMQTTmessages'):
-
-			mqttPayload = {
-				"gpioStates": {
-					"AlarmState"     : self.gpioState('AlarmState'),
-					"triggeredState" : self.gpioState('triggeredState'),
-					"IgnitionActive" : self.gpioState('IgnitionActive'),
-					"PairedToVehicle": self.gpioState('PairedToVehicle'),
-					"UserPresence"   : {
-						'checkingUserPresence': self._presenceObject['checkingForUser'],
-						"userHome"            : self.UserManager.checkIfAllUser("home"),
-						"userOut"             : self.UserManager.checkIfAllUser("out"),
-						'activeAutoArming'    : self._autoArmingActive,
-						'VoiceControlled'     : self._voiceControlled
-					}
-				}
-			}
+		1. Pack each unit's pin snapshot of this tick and the presence / arming flags in one state bitmask
+		2. publish it to the unit's topic if it differs from the last published state. The primary unit
+		   publishes on "WitiAlarm", the others on "WitiAlarm/units/<name>"
+		"""
+		if not self._settings.enableMQTTmessages:
+			return
+
+		# Presence is the same for every unit, so it's only looked up once per tick
+		presence = 0
+		if self._presenceObject['checkingForUser']:
+			presence |= MqttStatePublisher.CHECKING_FOR_USER
+		if self._presence.userHome:
+			presence |= MqttStatePublisher.USER_HOME
+		if self._presence.userOut:
+			presence |= MqttStatePublisher.USER_OUT
+
+		delta = self._settings.mqttPublishMode == 'delta'
+		for unit in self._units:
+			bits = unit.snapshot.bits | presence
+			if unit.autoArmingActive:
+				bits |= MqttStatePublisher.AUTO_ARMED
+			if unit.voiceControlled:
+				bits |= MqttStatePublisher.VOICE_CONTROLLED
+
 			# Only publish MQTT message if a state changes
-			if not mqttPayload == self._previousMQTTMessage:
-				self.publish('WitiAlarm', payload=mqttPayload)
+			if unit.mqtt.update(bits, delta=delta, compact=self._settings.mqttCompactStatus):
+				self._log.debug(
+					f'mqttState.{unit.name}',
+					partial(unit.mqtt.payload, bits),
+					unit=unit.name,
+					version=unit.mqtt.version
+				)
+
+
+	def databaseFetch(self, *args, **kwargs):
+		with self._handlerProfiler.phase('db'):
+			return super().databaseFetch(*args, **kwargs)
+
+
+	def say(self, *args, **kwargs):
+		with self._handlerProfiler.phase('dialog'):
+			super().say(*args, **kwargs)
+
+
+	def ask(self, *args, **kwargs):
+		with self._handlerProfiler.phase('dialog'):
+			super().ask(*args, **kwargs)
+
+
+	def endDialog(self, *args, **kwargs):
+		with self._handlerProfiler.phase('dialog'):
+			super().endDialog(*args, **kwargs)
+
+
+	def continueDialog(self, *args, **kwargs):
+		with self._handlerProfiler.phase('dialog'):
+			super().continueDialog(*args, **kwargs)
+
+
+	def endSession(self, *args, **kwargs):
+		with self._handlerProfiler.phase('dialog'):
+			super().endSession(*args, **kwargs)
+
+
+	def publish(self, *args, **kwargs):
+		""" Every MQTT message of the skill goes through here, count it for the metrics """
+		self._metrics.increment('mqtt_publishes')
+		super().publish(*args, **kwargs)
+
+
+	def scheduleMetrics(self):
+		"""
+		Start or stop the periodic publish of the metrics on WitiAlarm/metrics to match the settings.
+		It needs both a metricsPublishInterval and the MQTT messages turned on
+		"""
+		wanted = bool(self._settings.metricsPublishInterval and self._settings.enableMQTTmessages)
+		if wanted and not self._metricsTask:
+			self._metricsTask = self._scheduler.startPeriodic(
+				name='WitiMetrics',
+				func=self.publishMetrics,
+				initialDelay=self._settings.metricsPublishInterval
+			)
+		elif not wanted and self._metricsTask:
+			self._metricsTask.stop()
+			self._metricsTask = None
+
+
+	def publishMetrics(self) -> float:
+		"""
+		Publish a json snapshot of the metrics
+		:return: seconds until the next publish
+		"""
+		if self._settings.metricsPublishInterval and self._settings.enableMQTTmessages:
+			metrics = self._metrics.snapshot()
+			if self._handlerProfiler.enabled:
+				metrics['intentHandlers'] = self._handlerProfiler.report()
+			self.publish('WitiAlarm/metrics', payload=metrics)
+		# Turning the publish off stops the task in scheduleMetrics, until then it idles at the sweep cadence
+		return self._settings.metricsPublishInterval or self._settings.secondsBetweenConsistencySweeps
+
 
-				self._previousMQTTMessage = mqttPayload
-				self.logDebug(f'* - * The WITI MQTT Payload * - * ')
-				self.logDebug(f'{mqttPayload}')
-				print("........")
+	def startMetricsServer(self, port: int):
+		""" Serve the metrics in the Prometheus text format on http://<pi>:<port>/metrics """
+		from skills.Witi.libraries.MetricsServer import MetricsServer
+
+		self._metricsServer = MetricsServer(render=self._metrics.prometheus, port=port)
+		try:
+			self._metricsServer.start()
+			self.logInfo(f'Serving metrics for Prometheus on port {port}')
+		except OSError as e:
+			self.logWarning(f'Could not start the Prometheus metrics endpoint on port {port}: {e}')
+			self._metricsServer = None
 
 
 	def onLeavingHome(self):
@@ -553,23 +1503,26 @@ class Witi(AliceSkill):
 		Triggers when a users state changes to leaving home ("out")
 		"""
 		super().onLeavingHome()
-		if not self.UserManager.checkIfAllUser('home'):
+		self._presence.invalidate()
+		if not self._presence.userHome:
 			# set userState to away ('out')
-			self.UserManager.leftHome()
+			self.markUsersOut()
 			self.updatePresenceDictionary(userchecking=False, userHome=False)
-			self.enableAlarm()
+			for unit in self._units:
+				self.enableAlarm(unit)
 
 
 	def onReturningHome(self):
 		"""
 		Triggers when a users state changes to "home"
 		"""
-		if self.UserManager.checkIfAllUser('out') and self.gpioState('AlarmState') == 'on':
+		self._presence.invalidate()
+		if self._presence.userOut and any(unit.snapshot.alarmOn for unit in self._units):
 			super().onReturningHome()
 			self.updatePresenceDictionary(userchecking=False, userHome=True)
 			self.say(
 				text='Welcome back. Please call me by my name and say, "Turn off the alarm ',
-				siteId=str(self._satelliteUID)
+				siteId=self._satellites.best
 			)
 
 
@@ -579,7 +1532,7 @@ class Witi(AliceSkill):
 		"""
 		super().onSessionStarted(session)
 		if 'askingToCancelAlarm' in session.currentState:
-			self._sessionID = session.sessionId
+			self.unitForSession(session).sessionId = session.sessionId
 
 
 	def onSessionTimeout(self, session):
@@ -588,151 +1541,108 @@ class Witi(AliceSkill):
 		"""
 		super().onSessionTimeout(session)
 
-		if session.sessionId == self._sessionID:
-			self.logDebug('A Session TimeOut occured. Triggering the enabling of the alarm.')
-			self._sessionID = ""
-			self._autoArmingActive = True
+		for unit in self._units:
+			if session.sessionId != unit.sessionId:
+				continue
+
+			self.logDebug(f'A Session TimeOut occured. Triggering the enabling of the {self.alarmName(unit)}.')
+			unit.sessionId = ''
+			unit.autoArmingActive = True
 			# set userState to away ('out')
-			self.UserManager.leftHome()
+			self.markUsersOut()
 			self.updatePresenceDictionary(userchecking=False, userHome=False)
-			self.enableAlarm()
+			self.enableAlarm(unit)
 
 
-	##################################   Auto Arming code  ################################
-	def autoArming(self):
-		"""
-		If vehicle was paired but now its not:
-		1. ask if anyones home
-		2. if session timesout, assume no ones home and turn on alarm
-		3. If user responds with yes - cancel alarm
-		"""
-		# if auto arming is not enabled by the user. return
-		if not self.getConfig('turnOnAutoArming'):
-			return
-
-		# If pairing is lost, start setting up the user states
-		if self.gpioState('PairedToVehicle') == "Disconnected" and self._presenceObject['checkingForUser'] == False \
-				and not self._voiceControlled:
-			self.updatePresenceDictionary(userchecking=True, userHome=False)
-
-			if self.gpioState('AlarmState') == 'on':
-				return
-
-			# Ask user for a responce. No responce assumes no ones home and alarm will be enabled
-			# when the dialog session times out.
-			self.ask(
-				text='I\'ve detected the vehicle has left. Reply with "yes" if you\'d like me to cancel turning on the alarm',
-				intentFilter=['AnswerYesOrNo'],
-				currentDialogState='askingToCancelAlarm',
-				siteId=str(self._satelliteUID)
-			)
-
-		# Check if vehicle is paired, if so trigger turning off the alarm automatically
-		if self.gpioState('PairedToVehicle') == "Connected" and self.gpioState(
-				'AlarmState') == 'on' and self._autoArmingActive and not self._presenceObject['userHome']:
-			self.logInfo('I have auto detected that the vehicle has returned')
-			self.logDebug('Setting user state to home')
-			self.UserManager.home()
-			self.updatePresenceDictionary(userchecking=False, userHome=self.UserManager.checkIfAllUser('home'))
-
-			# Say a welcome home reminder after "secondsAfterReturningHome" seconds (configured in settings)
-			self.ThreadManager.doLater(
-				interval=self.getConfig('secondsAfterReturningHome'),
-				func=self.welcomeHome
-			)
-
-
-	def welcomeHome(self):
+	def welcomeHome(self, unit: WitiUnit = None):
 		"""
 		Used in conjunction with a timer for:
 
 		1. Setting user as home
 		2. Informing user to turn off the alarm
 		"""
-		if self._autoArmingActive:
-			self._autoArmingActive = False
+		unit = unit or self._primaryUnit
+		if unit.autoArmingActive:
+			unit.autoArmingActive = False
 			self.say(
-				text='Welcome home, please call me by my name and ask me to, "Turn off the alarm" ',
-				siteId=str(self._satelliteUID)
+				text=f'Welcome home, please call me by my name and ask me to, "Turn off the {self.alarmName(unit)}" ',
+				siteId=self._satellites.best
 			)
 
 
-	# Todo remove the logwarnings below
+	def markUsersHome(self):
+		""" Set the users home and drop the cached presence """
+		self.UserManager.home()
+		self._presence.invalidate()
+
+
+	def markUsersOut(self):
+		""" Set the users out and drop the cached presence """
+		self.UserManager.leftHome()
+		self._presence.invalidate()
+
+
+	def onHomeAssistantParsed(self):
+		""" The Home Assistant state file changed, so the presence might have changed too """
+		self._metrics.increment('homeassistant_parses')
+		self._presence.invalidate()
+
+
 	def updatePresenceDictionary(self, userchecking: bool, userHome: bool):
 		"""
 		PresenceDictionary stores the values of a users home/away status.
 		It also stores "userchecking" which is used to determine if the current state of the code
 		is trying to determine if a user is home.
+		Whether all users are home or out isn't stored here, read it from self._presence
 		"""
-		if self.getConfig('useHomeAssistantPersonDetection'):
+		if self._settings.useHomeAssistantPersonDetection:
 			if self.homeassistantPresenceDetection():
-				self.logWarning('presenceDictionary has determined somes home via HA')
 				self._presenceObject = {
 					"checkingForUser": False,
-					"someonesHome"   : True,
-					"userHome"       : self.UserManager.checkIfAllUser("home"),
-					"userOut"        : self.UserManager.checkIfAllUser("out")
+					"someonesHome"   : True
 				}
 			else:
-				self.logWarning('presenceDictionary has determined no ones home via HA')
 				self._presenceObject = {
 					"checkingForUser": False,
-					"someonesHome"   : False,
-					"userHome"       : self.UserManager.checkIfAllUser("home"),
-					"userOut"        : self.UserManager.checkIfAllUser("out")
+					"someonesHome"   : False
 				}
 		else:
-			self.logWarning('presenceDictionary was run without HA support')
-
 			self._presenceObject = {
 				"checkingForUser": userchecking,
-				"someonesHome"   : userHome,
-				"userHome"       : self.UserManager.checkIfAllUser("home"),
-				"userOut"        : self.UserManager.checkIfAllUser("out")
+				"someonesHome"   : userHome
 			}
 
-
-	def gpioState(self, gpioString: str) -> str:
-		"""
-		Return a human friendly state of the pins for clarity in MQTT message and code reading
-		"""
-		state = self._gpioPin[gpioString]
-		# todo swap connected for disconnected and visa versa
-		if gpioString == 'PairedToVehicle':
-			if state == 1:
-				return 'Disconnected'
-			elif state == 0:
-				return 'Connected'
-		else:
-			if state == 1:
-				return 'on'
-			elif state == 0:
-				return 'off'
-			else:
-				return 'unknown'
+		self.saveRuntimeState()
+		self._log.debug(
+			'presence',
+			'Presence updated',
+			source='homeAssistant' if self._settings.useHomeAssistantPersonDetection else 'skill',
+			someonesHome=self._presenceObject['someonesHome'],
+			checkingForUser=self._presenceObject['checkingForUser']
+		)
 
 
-	def updateGPIOvalues(self):
+	def updateGPIOvalues(self) -> GpioSnapshot:
 		"""
-		Update the gpio values with current pin states
+		Read the input pins of all units in one batched pass and store each unit's snapshot for this tick.
+		The raw levels go through the signal conditioning first, so only confirmed changes get through
+		Returns the snapshot of the primary unit
 		"""
-		if GPIO.input(Witi._ALARM_STATE) == 0:
-			self._alarmHasBeenTriggered = False
-		self._gpioPin = {
-			"AlarmState"     : GPIO.input(Witi._ALARM_STATE),
-			"triggeredState" : GPIO.input(Witi._TRIGGERED_STATE),
-			"IgnitionActive" : GPIO.input(Witi._IGNITION_FEED),
-			"PairedToVehicle": GPIO.input(Witi._PAIRED_TO_VEHICLE)
-		}
+		levels = self._conditioner.update(self._gpio.inputs(self._inputPins), self._scheduler.now())
+		self._metrics.increment('gpio_reads', len(levels))
+		for unit in self._units:
+			offset = unit.offset
+			unit.snapshot = GpioSnapshot.fromPins(levels[offset], levels[offset + 1], levels[offset + 2], levels[offset + 3])
+		return self._primaryUnit.snapshot
 
 
 	def IgnitionFeedBack(self, session) -> bool:
 		""" If ignition is on, inform user alarm can't be enabled"""
-		if self.gpioState('IgnitionActive') == 'on':
+		if self.unitForSession(session).snapshot.ignitionOn:
 			self.endDialog(
 				sessionId=session.sessionId,
 				text="Sorry, I can't do that while the Ignition is turned on",
-				siteId=str(self._satelliteUID)
+				siteId=self.replySite(session)
 			)
 			return True
 		else:
@@ -744,110 +1654,138 @@ class Witi(AliceSkill):
 		if session:
 			self.announceAction(session=session, state="off")
 		self.updatePresenceDictionary(userchecking=False, userHome=True)
-		print(f'dev disable called')
-		GPIO.output(Witi._SWITCH_ALARM, False)
-		self.updateValueInDB(event='AlarmState', newState=0)
-		self.UserManager.home()
+		self.logDebug('Dev disable called')
+		self.switchAlarm(self._primaryUnit, False)
+		self.updateValueInDB(event=self._primaryUnit.dbEvent, newState=0)
+		self.markUsersHome()
 		if session:
 			self.sendTelegramMessage(f'Alarm was turned off by {session.user} via devCode')
 		else:
 			self.sendTelegramMessage(f'Alarm was turned off by devCode')
 
 
-	def checkPossibleTowingState(self) -> bool:
-		""" Check for possible towing states"""
-		if self.gpioState('PairedToVehicle') == 'Connected':
-			if self.gpioState('IgnitionActive') == 'on':
-				return True
-
-			elif self.gpioState('IgnitionActive') == 'off':
-				self._ignMessageSent = False
-				return False
-
-
-	def manuallyDisabled(self) -> bool:
-		if self._autoArmingActive and self._voiceControlled:
-			return True
-
-
-	def disarmCode(self, session=None, sendTelegram: bool = None, user: str = None):
+	def disarmCode(self, session=None, sendTelegram: bool = None, user: str = None, unit: WitiUnit = None):
 		""" If Alarm is being disarmed
+			- Switch the alarm off and store it
 			- Announce alarm is disabled
 			- Set user presence values
 			- Send telegram if enabled
+		:param unit: the unit to disarm, the primary one if not given
 		"""
+		unit = unit or self._primaryUnit
+		self.switchAlarm(unit, False)
+		self.persistAlarmState(unit)
 		if session:
 			self.announceAction(session=session, state="off")
-		self.logWarning('** ALARM IS BEING DISABLED **')
+		self.logWarning(f'** ALARM OF UNIT {unit.name} IS BEING DISABLED **')
 		self.updatePresenceDictionary(userchecking=False, userHome=True)
-		GPIO.output(Witi._SWITCH_ALARM, False)
-		self.updateValueInDB(event='AlarmState', newState=0)
-		self.UserManager.home()
-
-		if sendTelegram:
-			if user:
-				self.sendTelegramMessage(f'{user} has just disabled the alarm')
+		self._events.publish(AlarmEvent.DISARMED, unit, user=user, notify=bool(sendTelegram))
+		self.markUsersHome()
 
-			else:
-				self.sendTelegramMessage(f'The alarm has just been turned off by a unknown person')
-
-		if self._autoArmingActive and not self._voiceControlled:
-			self._voiceControlled = True
+		if unit.autoArmingActive and not unit.voiceControlled:
+			unit.voiceControlled = True
 
 
-	def dontEnableAlarmStates(self) -> bool:
+	def dontEnableAlarmStates(self, unit: WitiUnit) -> bool:
 		"""
 		If the ignition is on and vehicle "connected" or someone is at home. Don't enable the alarm
 		"""
-		if self.checkPossibleTowingState() or self._presenceObject[
-			'someonesHome'] == True and not self._voiceControlled:
-			self.logWarning(f'Either the Ignition is on or someone is Home, so not enabling alarm ')
-			self._ignMessageSent = True
+		if unit.alarmState is AlarmState.TOWING:
+			self.logWarning('The Ignition is on, so not enabling alarm')
+			self._events.publish(AlarmEvent.IGNITION_BLOCKED, unit)
 			return True
-
-		# Prevent re auto enabling the alarm if a user is home but the vehicle is away
-		# Also prevent arming if ignition is on
-		if self.manuallyDisabled() or self.gpioState("IgnitionActive") == 'on':
-			return False
-
-
-	def resetAutoArming(self):
-		"""
-		 If alarm was disabled while pairing was disconnected and vehicle is now connected again
-		 Reset vars so that autoarming will enable next time vehicle disconnects
-		"""
-		if self._voiceControlled and self.gpioState('PairedToVehicle') == 'Connected' and self.gpioState(
-				'AlarmState') == 'off':
-			self._voiceControlled = False
+		if self._presenceObject['someonesHome'] and not unit.voiceControlled:
+			self.logWarning('Someone is Home, so not enabling alarm')
+			return True
+		return False
 
 
 	def updateValueInDB(self, event: str, newState: int):
 		"""
 		update a value in the DataBase
+		_witiDatabaseValues is the authoritative copy and gets patched straight away. The write itself is
+		collected with any other change in the next _DB_FLUSH_DELAY seconds and flushed as one transaction
 		:param event: welcomeMessage', 'AlarmState', 'pinCode', 'mqttMessage', telegramID, telegramReminder
 		:param newState: integer, often either 1 or 0 depending on the event
 		:return: nothing
 		"""
-		self.DatabaseManager.update(
-			tableName='witi',
-			callerName=self.name,
-			values={
-				'active': newState
-			},
-			row=('event', event)
+		with self._dbLock:
+			if event in self._witiDatabaseValues and self._witiDatabaseValues[event] == newState:
+				return
+
+			self._witiDatabaseValues[event] = newState
+			self._pendingDBWrites[event] = newState
+			if self._dbFlushScheduled:
+				return
+			self._dbFlushScheduled = True
+
+		self._scheduler.doLater(
+			interval=Witi._DB_FLUSH_DELAY,
+			func=self.flushDatabaseWrites
 		)
-		self.readDatabase()
+
+
+	def flushDatabaseWrites(self):
+		""" Write all pending database changes in a single transaction """
+		with self._dbLock:
+			pending = self._pendingDBWrites
+			self._pendingDBWrites = dict()
+			self._dbFlushScheduled = False
+
+		if not pending:
+			return
+
+		self.databaseExecuteMany(
+			query='UPDATE :__table__ SET active = ? WHERE event = ?',
+			rows=[(value, event) for event, value in pending.items()]
+		)
+		self._metrics.increment('db_flushes')
+		self._metrics.increment('db_writes', len(pending))
+
+
+	def seedDatabase(self, events: Iterable[str] = _DEFAULT_DB_EVENTS):
+		""" Insert the default rows with one batched statement """
+		self.databaseExecuteMany(
+			query='INSERT OR IGNORE INTO :__table__ (event, active) VALUES (?, ?)',
+			rows=[(event, 0) for event in events]
+		)
+		with self._dbLock:
+			for event in events:
+				self._witiDatabaseValues.setdefault(event, 0)
+
+
+	def databaseExecuteMany(self, query: str, rows: list, tableName: str = 'witi'):
+		""" Run a statement for every row of values inside one transaction on one of the skill tables """
+		with self._handlerProfiler.phase('db'):
+			connection = self.DatabaseManager.getConnection()
+			try:
+				with connection:
+					connection.executemany(query.replace(':__table__', f'{self.name}_{tableName}'), rows)
+			finally:
+				connection.close()
+
+
+	def databaseExecute(self, query: str, tableName: str = 'witi'):
+		""" Run a single statement without values, like a schema change, on one of the skill tables """
+		with self._handlerProfiler.phase('db'):
+			connection = self.DatabaseManager.getConnection()
+			try:
+				with connection:
+					connection.execute(query.replace(':__table__', f'{self.name}_{tableName}'))
+			finally:
+				connection.close()
 
 
 	def readDatabase(self):
-		""" Read the database and store values in a dictionary"""
+		""" Read the database and store values in a dictionary. After start up the dictionary is kept up to date by updateValueInDB """
 		tempDict = self.databaseFetch(
 			tableName='witi',
 			query='SELECT * FROM :__table__', method='all'
 		)
 
-		for item in tempDict:
-			self._witiDatabaseValues[item["event"]] = item["active"]
+		with self._dbLock:
+			for item in tempDict:
+				self._witiDatabaseValues[item["event"]] = item["active"]
 
 
 	def telegramStatusCheck(self):
@@ -858,9 +1796,8 @@ class Witi(AliceSkill):
 		"""
 		if not self._witiDatabaseValues['telegramID']:
 			try:
-				telegramDB = Telegram.Telegram()
 				# noinspection SqlResolve
-				userID = telegramDB.databaseFetch(
+				userID = self.telegramClient().databaseFetch(
 					tableName='users',
 					query='SELECT userId FROM :__table__'
 				)
@@ -872,39 +1809,35 @@ class Witi(AliceSkill):
 		# If Telegram ID is not entered in settings. Advise the user
 		if not self._witiDatabaseValues['telegramID'] and self._witiDatabaseValues['telegramReminder'] == 0:
 			self.logWarning(f'No user telegram ID configured in the database')
+			# Runs next to the satellite lookup at start up, give it a moment so the reminder goes to the right device
+			self._satelliteReady.wait(timeout=Witi._SATELLITE_WAIT)
 			self.say(
 				text=f'To use Telegram. Please add your telegram ID number to the Telegram skill settings',
-				siteId=str(self._satelliteUID)
+				siteId=self._satellites.best
 			)
 			self.updateValueInDB(event='telegramReminder', newState=1)
 			return False
 
 
-	# todo clean up the logwarnings in the below block
 	def homeassistantPresenceDetection(self) -> bool:
 		""" Are people at home ?
 		true = Yes people are home
 		false = No ones home at the moment
+		The state file is only parsed again when Home Assistant has rewritten it
 		"""
-		haStates = Path(f'{str(Path.home())}/skills/HomeAssistant/currentStateOfDevices.json')
-		if self.HomeAssistantLoaded():
-			self.logWarning(f'haStates file is {haStates}')
-			data = json.loads(haStates.read_text())
-			booleanName = self.getConfig('homeAssistantBooleanName')
-			if data[booleanName] == 'off':
-				self.logWarning('no ones home according to Home Assistant')
-				return False
-			elif data[booleanName] == 'on':
-				self.logWarning('People are home according to Home Assistant')
-				return True
+		try:
+			state = self._haStates.entityState(self._settings.homeAssistantBooleanName)
+		except FileNotFoundError:
+			self.HomeAssistantNotLoaded()
+			return False
 
+		self._log.debug('homeAssistantPresence', 'Home Assistant presence', state=state, file=self._haStates.path)
+		# Anything but on, like unavailable, counts as nobody home
+		return state == 'on'
 
-	def HomeAssistantLoaded(self) -> bool:
-		haStates = f'{str(Path.home())}/skills/HomeAssistant/currentStateOfDevices.json'
 
-		if Path(haStates).exists():
-			return True
-		else:
-			self.logWarning(f'HomeAssistant not loaded, disabling this option')
-			self.updateConfig('useHomeAssistantPersonDetection', False)
-			return False
+	def HomeAssistantNotLoaded(self):
+		""" Home Assistant skill has no state file, so stop trying to use it for presence detection """
+		self.logWarning(f'HomeAssistant not loaded, disabling this option')
+		self.updateConfig(key='useHomeAssistantPersonDetection', value=False)
+		self._haStates.invalidate()
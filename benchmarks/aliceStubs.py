@@ -0,0 +1,338 @@
+"""
+Minimal stand ins for the parts of Project Alice the Witi skill uses, so the skill can be
+imported and driven outside of Alice. Every stub counts what gets called on it.
+"""
+import json
+import sqlite3
+import sys
+import types
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+REPO = Path(__file__).resolve().parent.parent
+
+# Settings applied on top of the config.json.template defaults when a skill is created
+configOverrides: dict = dict()
+
+
+class ThreadManagerStub:
+	""" doLater only queues the call, run it with runPending() """
+
+	def __init__(self):
+		self.pending: List[Tuple[float, Callable, tuple, dict]] = list()
+		self.scheduled = 0
+		self.threads: List[str] = list()
+
+
+	def doLater(self, interval: float, func: Callable, args: list = None, kwargs: dict = None, **_kwargs):
+		self.scheduled += 1
+		self.pending.append((interval, func, tuple(args or ()), kwargs or dict()))
+
+
+	def newThread(self, name: str, target: Callable, args: list = None, kwargs: dict = None, **_kwargs):
+		""" Runs the target straight away on the calling thread, so runs stay deterministic """
+		self.threads.append(name)
+		target(*(args or ()), **(kwargs or dict()))
+
+
+	def runPending(self, exclude: Tuple[str, ...] = ()) -> int:
+		""" Run the queued calls, except the excluded ones """
+		pending, self.pending = self.pending, list()
+		ran = 0
+		for interval, func, args, kwargs in pending:
+			if func.__name__ in exclude:
+				continue
+			func(*args, **kwargs)
+			ran += 1
+		return ran
+
+
+class UserManagerStub:
+
+	def __init__(self):
+		self.state = 'home'
+		self.calls = 0
+
+
+	def home(self):
+		self.state = 'home'
+
+
+	def leftHome(self):
+		self.state = 'out'
+
+
+	def checkIfAllUser(self, state: str) -> bool:
+		self.calls += 1
+		return self.state == state
+
+
+	def hasAccessLevel(self, user: str, accessLevel: int) -> bool:
+		return True
+
+
+class DatabaseManagerStub:
+	""" In memory sqlite database counting every statement executed against it """
+
+	def __init__(self):
+		self.statements = 0
+		self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+		self._connection.row_factory = sqlite3.Row
+		self._connection.set_trace_callback(self._trace)
+
+
+	def _trace(self, statement: str):
+		if not statement.startswith(('BEGIN', 'COMMIT', 'ROLLBACK')):
+			self.statements += 1
+
+
+	def createTable(self, name: str, columns: List[str]):
+		self._connection.execute(f'CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY, {", ".join(columns)})')
+
+
+	def getConnection(self) -> '_SharedConnection':
+		return _SharedConnection(self._connection)
+
+
+	def update(self, tableName: str, callerName: str, values: dict, row: tuple):
+		sets = ', '.join(f'{key} = ?' for key in values)
+		with self._connection:
+			self._connection.execute(f'UPDATE {callerName}_{tableName} SET {sets} WHERE {row[0]} = ?', (*values.values(), row[1]))
+
+
+class _SharedConnection:
+	""" Hands out the in memory connection without letting callers close it """
+
+	def __init__(self, connection: sqlite3.Connection):
+		self._connection = connection
+
+
+	def __getattr__(self, item):
+		return getattr(self._connection, item)
+
+
+	def __enter__(self):
+		return self._connection.__enter__()
+
+
+	def __exit__(self, *args):
+		return self._connection.__exit__(*args)
+
+
+	def close(self):
+		pass
+
+
+class DeviceStub:
+
+	def __init__(self, name: str = 'caravan', connected: bool = True, locationID: int = 1, uid: str = 'caravan-uid'):
+		self.name = name
+		self.uid = uid
+		self.connected = connected
+		self.locationID = locationID
+
+
+class DeviceManagerStub:
+
+	def __init__(self):
+		self.devices = [DeviceStub()]
+		self.calls = 0
+
+
+	def getAliceTypeDevices(self, includeMain: bool = False, connectedOnly: bool = False) -> list:
+		self.calls += 1
+		return [device for device in self.devices if device.connected or not connectedOnly]
+
+
+	def getDevice(self, deviceId: int = None, uid: str = None) -> Optional[DeviceStub]:
+		return next((device for device in self.devices if device.uid == uid), None)
+
+
+class CommonsStub:
+
+	@staticmethod
+	def getLocalIp() -> str:
+		return '127.0.0.1'
+
+
+	@staticmethod
+	def isYes(session) -> bool:
+		return True
+
+
+class AliceSkillStub:
+	""" Stand in for core.base.model.AliceSkill """
+
+	def __init__(self, databaseSchema: dict = None, **_kwargs):
+		self.name = type(self).__name__
+		template = json.loads((REPO / 'config.json.template').read_text())
+		self._config = {key: setting['defaultValue'] for key, setting in template.items()}
+		self._config.update(configOverrides)
+		self.ThreadManager = ThreadManagerStub()
+		self.UserManager = UserManagerStub()
+		self.DatabaseManager = DatabaseManagerStub()
+		self.DeviceManager = DeviceManagerStub()
+		self.Commons = CommonsStub()
+		self.published: List[Tuple[str, Any]] = list()
+		self.spoken: List[str] = list()
+		self.logs: List[Tuple[str, str]] = list()
+		for table, columns in (databaseSchema or dict()).items():
+			self.DatabaseManager.createTable(f'{self.name}_{table}', columns)
+
+
+	def getConfig(self, key: str) -> Any:
+		return self._config.get(key)
+
+
+	def updateConfig(self, key: str, value: Any):
+		self._config[key] = value
+
+
+	def logInfo(self, msg: str):
+		self.logs.append(('info', msg))
+
+
+	def logDebug(self, msg: str):
+		self.logs.append(('debug', msg))
+
+
+	def logWarning(self, msg: str, printStack: bool = False):
+		self.logs.append(('warning', msg))
+
+
+	def logError(self, msg: str):
+		self.logs.append(('error', msg))
+
+
+	def say(self, text: str, siteId: str = None, **_kwargs):
+		self.spoken.append(text)
+
+
+	def ask(self, text: str, siteId: str = None, **_kwargs):
+		self.spoken.append(text)
+
+
+	def endDialog(self, sessionId: str = '', text: str = '', siteId: str = None, **_kwargs):
+		self.spoken.append(text)
+
+
+	def continueDialog(self, sessionId: str, text: str = '', **_kwargs):
+		self.spoken.append(text)
+
+
+	def endSession(self, sessionId: str):
+		pass
+
+
+	def publish(self, topic: str, payload: Any = None, stringPayload: str = None, **_kwargs):
+		self.published.append((topic, payload if payload is not None else stringPayload))
+
+
+	def databaseFetch(self, tableName: str, query: str, values: dict = None, method: str = 'one'):
+		connection = self.DatabaseManager.getConnection()
+		rows = [dict(row) for row in connection.execute(query.replace(':__table__', f'{self.name}_{tableName}'), values or dict())]
+		if method == 'all':
+			return rows
+		return rows[0] if rows else None
+
+
+	def databaseInsert(self, tableName: str, values: dict, query: str = None):
+		columns = ', '.join(values)
+		connection = self.DatabaseManager.getConnection()
+		with connection:
+			connection.execute(
+				f'INSERT INTO {self.name}_{tableName} ({columns}) VALUES ({", ".join("?" for _ in values)})',
+				tuple(values.values())
+			)
+
+
+	def onBooted(self) -> bool:
+		return True
+
+
+	def onStop(self):
+		pass
+
+
+	def onSkillUpdated(self, **kwargs):
+		pass
+
+
+	def onLeavingHome(self):
+		pass
+
+
+	def onReturningHome(self):
+		pass
+
+
+	def onSessionStarted(self, session):
+		pass
+
+
+	def onDeviceConnecting(self, **kwargs):
+		pass
+
+
+	def onDeviceDisconnecting(self, **kwargs):
+		pass
+
+
+	def onSessionTimeout(self, session):
+		pass
+
+
+class TelegramStub:
+	""" Stand in for the Telegram skill, shared counters across instances """
+	instances = 0
+	sent: List[Tuple[str, str]] = list()
+
+
+	def __init__(self):
+		TelegramStub.instances += 1
+
+
+	def sendMessage(self, chatId: str, message: str):
+		TelegramStub.sent.append((chatId, message))
+
+
+	def databaseFetch(self, tableName: str, query: str, **_kwargs) -> dict:
+		return {'userId': 123456}
+
+
+def _module(name: str, **attributes) -> types.ModuleType:
+	module = types.ModuleType(name)
+	module.__dict__.update(attributes)
+	sys.modules[name] = module
+	return module
+
+
+def install():
+	""" Register the stubs in sys.modules and make the skill importable as skills.Witi """
+	if 'skills.Witi' in sys.modules:
+		return
+
+	def intentHandler(*_args, **_kwargs):
+		def wrapper(func):
+			return func
+		return wrapper
+
+	class AccessLevel:
+		ADMIN = 2
+		DEFAULT = 1
+
+	for package in ('core', 'core.base', 'core.base.model', 'core.device', 'core.device.model', 'core.dialog',
+					'core.dialog.model', 'core.util', 'core.user', 'core.user.model'):
+		_module(package, __path__=list())
+
+	_module('core.base.model.AliceSkill', AliceSkill=AliceSkillStub)
+	_module('core.device.model.Device', Device=DeviceStub)
+	_module('core.dialog.model.DialogSession', DialogSession=object)
+	_module('core.util.Decorators', IntentHandler=intentHandler)
+	_module('core.commons', __path__=list(), constants=_module('core.commons.constants', UNKNOWN_USER='unknown'))
+	_module('core.user.model.AccessLevels', AccessLevel=AccessLevel)
+
+	telegram = _module('skills.Telegram.Telegram', Telegram=TelegramStub)
+	_module('skills', __path__=list())
+	_module('skills.Telegram', __path__=list(), Telegram=telegram)
+	_module('skills.Witi', __path__=[str(REPO)])
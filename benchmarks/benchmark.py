@@ -0,0 +1,295 @@
+"""
+Benchmarks for the Witi monitor loop and the arming paths.
+
+Runs the skill against the stubs in aliceStubs and the simulated GPIO backend, so it works on any
+machine. Results are printed as json, use --output to write them to a file for comparing runs.
+
+	python benchmarks/benchmark.py --ticks 5000 --cycles 200 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import aliceStubs  # noqa: E402
+
+aliceStubs.install()
+
+from skills.Witi.Witi import Witi  # noqa: E402
+from skills.Witi.libraries.SimulatedGpioBackend import SimulatedGpioBackend  # noqa: E402
+
+
+def percentiles(samples: List[int]) -> Dict[str, float]:
+	""" Latency summary in microseconds from samples in nanoseconds """
+	ordered = sorted(samples)
+
+	def pick(fraction: float) -> float:
+		return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1000, 2)
+
+	return {
+		'mean': round(sum(ordered) / len(ordered) / 1000, 2),
+		'p50' : pick(0.50),
+		'p90' : pick(0.90),
+		'p99' : pick(0.99),
+		'max' : round(ordered[-1] / 1000, 2)
+	}
+
+
+def createSkill(units: int = 1, resume: bool = False) -> Witi:
+	"""
+	:param units: number of WITI units, the additional ones get pins from 100 upwards
+	:param resume: keep the runtime snapshot of the previous skill, every scenario starts fresh otherwise
+	"""
+	if not resume:
+		try:
+			(aliceStubs.REPO / 'runtimeState.snapshot').unlink()
+		except FileNotFoundError:
+			pass
+
+	aliceStubs.configOverrides['additionalUnits'] = json.dumps([
+		{'name': f'unit{index}', 'alarm': 100 + index * 5, 'triggered': 101 + index * 5, 'ignition': 102 + index * 5, 'paired': 103 + index * 5, 'switch': 104 + index * 5}
+		for index in range(1, units)
+	])
+	try:
+		gpio = SimulatedGpioBackend()
+		skill = Witi(gpio=gpio)
+	finally:
+		aliceStubs.configOverrides.pop('additionalUnits')
+
+	for unit in skill._units:
+		gpio.link(unit.pins.switch, unit.pins.alarm)
+	skill.onBooted()
+	# The scenarios run the stateMonitor ticks themselves
+	skill._monitor.stop()
+	skill.ThreadManager.runPending()
+	return skill
+
+
+def waitForTelegramQueue(skill: Witi, timeout: float = 2.0):
+	""" The Telegram messages are sent in the background, give the queue a moment to empty """
+	skill._events.wait(timeout)
+	deadline = time.monotonic() + timeout
+	while skill._telegramQueue.pending and time.monotonic() < deadline:
+		time.sleep(0.01)
+
+
+def allocationsPerCall(func: Callable, count: int) -> Dict[str, float]:
+	""" Net allocated blocks and peak traced memory per call """
+	tracemalloc.start()
+	try:
+		before = tracemalloc.take_snapshot()
+		for _ in range(count):
+			func()
+		after = tracemalloc.take_snapshot()
+		_, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+
+	blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+	return {
+		'netBlocksPerCall': round(blocks / count, 2),
+		'peakTracedBytes' : peak
+	}
+
+
+def benchmarkTicks(ticks: int, busy: bool) -> dict:
+	"""
+	Time stateMonitor ticks
+	:param busy: toggle the triggered pin on every tick instead of leaving the pins alone
+	"""
+	skill = createSkill()
+	gpio: SimulatedGpioBackend = skill._gpio
+	skill.updatePresenceDictionary(userchecking=False, userHome=False)
+	skill.enableAlarm()
+	skill.ThreadManager.runPending()
+
+	level = [False]
+
+	def tick():
+		if busy:
+			level[0] = not level[0]
+			gpio.setPin(Witi._TRIGGERED_STATE, level[0])
+		skill.stateMonitor()
+		skill.ThreadManager.runPending()
+
+	for _ in range(min(100, ticks)):
+		tick()
+
+	reads = gpio.reads
+	published = len(skill.published)
+	presenceChecks = skill.UserManager.calls
+	logs = len(skill.logs)
+	samples = list()
+	for _ in range(ticks):
+		start = time.perf_counter_ns()
+		tick()
+		samples.append(time.perf_counter_ns() - start)
+
+	result = {
+		'ticks'                : ticks,
+		'latencyMicroseconds'  : percentiles(samples),
+		'gpioReadsPerTick'     : round((gpio.reads - reads) / ticks, 2),
+		'publishPerTick'       : round((len(skill.published) - published) / ticks, 2),
+		'presenceChecksPerTick': round((skill.UserManager.calls - presenceChecks) / ticks, 2),
+		'logsPerTick'          : round((len(skill.logs) - logs) / ticks, 2),
+		'allocations'          : allocationsPerCall(tick, min(ticks, 1000))
+	}
+	skill.onStop()
+	return result
+
+
+def benchmarkArmingCycles(cycles: int) -> dict:
+	""" Time enableAlarm followed by disarmCode, including the deferred database flush """
+	skill = createSkill()
+	gpio: SimulatedGpioBackend = skill._gpio
+	database = skill.DatabaseManager
+	statements = database.statements
+	published = len(skill.published)
+	telegramSent = len(aliceStubs.TelegramStub.sent)
+	armSamples = list()
+	disarmSamples = list()
+
+	for _ in range(cycles):
+		skill.updatePresenceDictionary(userchecking=False, userHome=False)
+		start = time.perf_counter_ns()
+		skill.enableAlarm()
+		armSamples.append(time.perf_counter_ns() - start)
+		# The announcement, database write and notifications are done by the event workers
+		skill._events.wait()
+		skill.ThreadManager.runPending()
+		# Let the simulated clock pass the bounce time of the alarm state pin
+		gpio.advance(1)
+
+		start = time.perf_counter_ns()
+		skill.disarmCode(sendTelegram=True, user='benchmark')
+		disarmSamples.append(time.perf_counter_ns() - start)
+		# The announcement, database write and notifications are done by the event workers
+		skill._events.wait()
+		skill.ThreadManager.runPending()
+		gpio.advance(1)
+
+	waitForTelegramQueue(skill)
+	skill.onStop()
+	return {
+		'cycles'                 : cycles,
+		'enableAlarmMicroseconds': percentiles(armSamples),
+		'disarmCodeMicroseconds' : percentiles(disarmSamples),
+		'dbStatementsPerCycle'   : round((database.statements - statements) / cycles, 2),
+		'publishPerCycle'        : round((len(skill.published) - published) / cycles, 2),
+		'telegramSendsPerCycle'  : round((len(aliceStubs.TelegramStub.sent) - telegramSent) / cycles, 2)
+	}
+
+
+def benchmarkUnitScaling(ticks: int, counts: List[int]) -> dict:
+	""" Idle stateMonitor tick with more and more units, the cost per unit should stay flat """
+	results = dict()
+	for units in counts:
+		skill = createSkill(units)
+		gpio: SimulatedGpioBackend = skill._gpio
+
+		def tick():
+			skill.stateMonitor()
+			skill.ThreadManager.runPending()
+
+		for _ in range(min(100, ticks)):
+			tick()
+
+		reads = gpio.reads
+		samples = list()
+		for _ in range(ticks):
+			start = time.perf_counter_ns()
+			tick()
+			samples.append(time.perf_counter_ns() - start)
+
+		latency = percentiles(samples)
+		results[str(units)] = {
+			'latencyMicroseconds'    : latency,
+			'p50MicrosecondsPerUnit' : round(latency['p50'] / units, 2),
+			'gpioReadsPerTick'       : round((gpio.reads - reads) / ticks, 2)
+		}
+		skill.onStop()
+	return results
+
+
+def benchmarkMqtt(calls: int) -> dict:
+	""" Time mqttBrokerMessage with the states flipping so every call publishes """
+	skill = createSkill()
+	gpio: SimulatedGpioBackend = skill._gpio
+	samples = list()
+	for _ in range(calls):
+		gpio.setPin(Witi._IGNITION_FEED, not gpio.input(Witi._IGNITION_FEED))
+		skill.updateGPIOvalues()
+		start = time.perf_counter_ns()
+		skill.mqttBrokerMessage()
+		samples.append(time.perf_counter_ns() - start)
+
+	skill.onStop()
+	return {
+		'calls'              : calls,
+		'latencyMicroseconds': percentiles(samples)
+	}
+
+
+def benchmarkWarmRestart() -> dict:
+	""" Restart an armed skill, once from the database only and once resuming its runtime snapshot """
+	results = dict()
+	for resume in (False, True):
+		skill = createSkill()
+		skill.updatePresenceDictionary(userchecking=False, userHome=False)
+		skill.enableAlarm()
+		skill._events.wait()
+		skill.ThreadManager.runPending()
+		skill._gpio.advance(1)
+		skill.stateMonitor()
+		skill.onStop()
+
+		restarted = createSkill(resume=resume)
+		results['snapshot' if resume else 'database'] = {
+			'bootToArmedMilliseconds': round(restarted._bootToArmed * 1000, 3),
+			'alarmState'             : restarted._primaryUnit.alarmState.name,
+			'snapshotWrites'         : skill._runtimeSnapshot.writes
+		}
+		restarted.onStop()
+	return results
+
+
+def main(argv: List[str] = None) -> dict:
+	parser = argparse.ArgumentParser(description='Benchmark the Witi skill')
+	parser.add_argument('--ticks', type=int, default=2000, help='stateMonitor ticks per scenario')
+	parser.add_argument('--cycles', type=int, default=200, help='arm / disarm cycles')
+	parser.add_argument('--output', type=Path, help='also write the json results to this file')
+	args = parser.parse_args(argv)
+
+	# Keep anything the skill prints out of the json
+	with contextlib.redirect_stdout(io.StringIO()):
+		results = {
+			'meta'             : {
+				'python'   : platform.python_version(),
+				'machine'  : platform.machine(),
+				'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+			},
+			'idleTick'         : benchmarkTicks(args.ticks, busy=False),
+			'busyTick'         : benchmarkTicks(args.ticks, busy=True),
+			'armingCycle'      : benchmarkArmingCycles(args.cycles),
+			'mqttBrokerMessage': benchmarkMqtt(args.ticks),
+			'unitScaling'      : benchmarkUnitScaling(args.ticks, [1, 2, 4, 8]),
+			'warmRestart'      : benchmarkWarmRestart()
+		}
+
+	text = json.dumps(results, indent=4)
+	print(text)
+	if args.output:
+		args.output.write_text(text)
+	return results
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,256 @@
+"""
+Replay arming scenarios on a virtual clock.
+
+Every scenario runs the skill against the stubs in aliceStubs with the simulated GPIO backend and a
+VirtualScheduler driving both the timers and the pin waveforms, so minutes of dialog timeouts and
+reminders take a few milliseconds. The dialog side is simulated as well: an arming question is
+either answered or left to time out.
+
+The scripted scenarios check the timing dependent arming rules, the generated ones throw random
+pin changes and answers at the skill and check that the switch pin, the alarm pin and the skill's
+own idea of the alarm always agree once things settled.
+
+	python benchmarks/scenarios.py --generated 2000 --seed 7
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import aliceStubs  # noqa: E402
+
+aliceStubs.install()
+
+from skills.Witi.Witi import Witi  # noqa: E402
+from skills.Witi.libraries.Scheduler import VirtualScheduler  # noqa: E402
+from skills.Witi.libraries.SimulatedGpioBackend import SimulatedGpioBackend  # noqa: E402
+
+# Seconds Alice waits for an answer before the session times out
+SESSION_TIMEOUT = 15
+PAIRED = Witi._PRIMARY_PINS.paired
+IGNITION = Witi._PRIMARY_PINS.ignition
+TRIGGERED = Witi._PRIMARY_PINS.triggered
+
+
+class Session:
+	""" The parts of a DialogSession the skill looks at """
+
+	def __init__(self, sessionId: str, currentState: str, customData: Optional[dict], siteId: Optional[str]):
+		self.sessionId = sessionId
+		self.currentState = currentState
+		self.customData = customData or dict()
+		self.siteId = siteId
+		self.user = 'scenario'
+		self.payload: Dict[str, Any] = dict()
+
+
+class ScenarioWiti(Witi):
+	""" Hands the questions the skill asks to the scenario, which answers them or lets them time out """
+
+	answer: Optional[Callable[[Session], Optional[float]]] = None
+
+
+	def ask(self, text: str, siteId: str = None, currentDialogState: str = '', customData: dict = None, **kwargs):
+		super().ask(text=text, siteId=siteId, currentDialogState=currentDialogState, customData=customData, **kwargs)
+		session = Session(f'session{len(self.spoken)}', currentDialogState, customData, siteId)
+		self.onSessionStarted(session)
+
+		delay = self.answer(session) if self.answer else None
+		if delay is None:
+			self._scheduler.doLater(interval=SESSION_TIMEOUT, func=self.onSessionTimeout, args=[session])
+		else:
+			self._scheduler.doLater(interval=delay, func=self.yesOrNoResponce, args=[session])
+
+
+class Scenario:
+
+	def __init__(self):
+		aliceStubs.configOverrides['gpioBackend'] = 'simulated'
+		try:
+			(aliceStubs.REPO / 'runtimeState.snapshot').unlink()
+		except FileNotFoundError:
+			pass
+
+		self.gpio = SimulatedGpioBackend()
+		self.scheduler = VirtualScheduler(onAdvance=self.gpio.advanceTo)
+		self.skill = ScenarioWiti(gpio=self.gpio, scheduler=self.scheduler)
+		for unit in self.skill._units:
+			self.gpio.link(unit.pins.switch, unit.pins.alarm)
+		self.skill.onBooted()
+		self.scheduler.advance(5)
+
+
+	@property
+	def unit(self):
+		return self.skill._primaryUnit
+
+
+	def spokenSince(self, count: int, text: str) -> bool:
+		return any(text in spoken for spoken in self.skill.spoken[count:])
+
+
+	def settled(self) -> List[str]:
+		""" What disagrees once the monitor had a few ticks to catch up """
+		self.scheduler.advance(30)
+		problems = list()
+		switch = self.gpio.input(self.unit.pins.switch)
+		alarm = self.gpio.input(self.unit.pins.alarm)
+		if switch != alarm:
+			problems.append(f'switch pin {switch} but alarm pin {alarm}')
+		if bool(switch) != self.unit.switchOn:
+			problems.append(f'switch pin {switch} but the skill thinks {self.unit.switchOn}')
+		if self.unit.snapshot.alarmOn != bool(alarm):
+			problems.append(f'alarm pin {alarm} but the snapshot says {self.unit.snapshot.alarmOn}')
+		return problems
+
+
+	def close(self):
+		self.skill.onStop()
+
+
+def unansweredPairingLostArms() -> List[str]:
+	""" Vehicle leaves, nobody answers the question, the alarm is on once the session timed out """
+	scenario = Scenario()
+	try:
+		scenario.skill.markUsersOut()
+		scenario.gpio.setPin(PAIRED, True)
+		scenario.scheduler.advance(5)
+		if scenario.unit.switchOn:
+			return ['armed before the question timed out']
+		scenario.scheduler.advance(SESSION_TIMEOUT + 5)
+		if not scenario.unit.switchOn:
+			return ['not armed after the question timed out']
+		return scenario.settled()
+	finally:
+		scenario.close()
+
+
+def answeredPairingLostStaysOff() -> List[str]:
+	""" Vehicle leaves, someone answers yes, the alarm stays off """
+	scenario = Scenario()
+	try:
+		scenario.skill.answer = lambda session: 3.0
+		scenario.gpio.setPin(PAIRED, True)
+		scenario.scheduler.advance(SESSION_TIMEOUT * 2)
+		if scenario.unit.switchOn:
+			return ['armed although the question was answered']
+		return scenario.settled()
+	finally:
+		scenario.close()
+
+
+def returningVehicleGetsWelcomed() -> List[str]:
+	""" After auto arming, the welcome home reminder follows secondsAfterReturningHome after the vehicle is back """
+	scenario = Scenario()
+	try:
+		scenario.skill.markUsersOut()
+		scenario.gpio.setPin(PAIRED, True)
+		scenario.scheduler.advance(SESSION_TIMEOUT + 10)
+		spoken = len(scenario.skill.spoken)
+		scenario.skill.markUsersOut()
+		scenario.gpio.setPin(PAIRED, False)
+		delay = scenario.skill._settings.secondsAfterReturningHome
+		scenario.scheduler.advance(delay - 5)
+		if scenario.spokenSince(spoken, 'Welcome home'):
+			return ['welcomed before secondsAfterReturningHome']
+		scenario.scheduler.advance(15)
+		if not scenario.spokenSince(spoken, 'Welcome home'):
+			return ['not welcomed after secondsAfterReturningHome']
+		return scenario.settled()
+	finally:
+		scenario.close()
+
+
+def towingNeverArms() -> List[str]:
+	""" Ignition on while paired means towing, leaving home must not arm the alarm """
+	scenario = Scenario()
+	try:
+		scenario.gpio.setPin(IGNITION, True)
+		scenario.scheduler.advance(5)
+		scenario.skill.onLeavingHome()
+		scenario.scheduler.advance(SESSION_TIMEOUT * 2)
+		if scenario.unit.switchOn:
+			return ['armed while towing']
+		return scenario.settled()
+	finally:
+		scenario.close()
+
+
+SCRIPTED: Dict[str, Callable[[], List[str]]] = {
+	'unansweredPairingLostArms'   : unansweredPairingLostArms,
+	'answeredPairingLostStaysOff' : answeredPairingLostStaysOff,
+	'returningVehicleGetsWelcomed': returningVehicleGetsWelcomed,
+	'towingNeverArms'             : towingNeverArms
+}
+
+
+def generated(rng: random.Random, steps: int = 12) -> List[str]:
+	""" Random pin changes, trigger pulses, answers and waits """
+	scenario = Scenario()
+	try:
+		scenario.skill.answer = lambda session: rng.choice((None, rng.uniform(1, SESSION_TIMEOUT - 1)))
+		for _ in range(steps):
+			step = rng.random()
+			if step < 0.3:
+				scenario.gpio.setPin(PAIRED, rng.random() < 0.5)
+			elif step < 0.45:
+				scenario.gpio.setPin(IGNITION, rng.random() < 0.3)
+			elif step < 0.6:
+				scenario.gpio.pulse(TRIGGERED, width=rng.uniform(0.5, 20), at=rng.uniform(0, 5))
+			elif step < 0.7:
+				scenario.skill.onLeavingHome()
+			elif step < 0.8:
+				scenario.skill.markUsersOut()
+			scenario.scheduler.advance(rng.uniform(0.5, 40))
+		return scenario.settled()
+	finally:
+		scenario.close()
+
+
+def run(generatedCount: int, seed: int) -> dict:
+	failures: Dict[str, List[str]] = dict()
+	started = time.perf_counter()
+	for name, scenario in SCRIPTED.items():
+		problems = scenario()
+		if problems:
+			failures[name] = problems
+
+	rng = random.Random(seed)
+	for index in range(generatedCount):
+		problems = generated(rng)
+		if problems:
+			failures[f'generated{index}'] = problems
+	elapsed = time.perf_counter() - started
+
+	total = len(SCRIPTED) + generatedCount
+	return {
+		'scenarios'         : total,
+		'seed'              : seed,
+		'seconds'           : round(elapsed, 3),
+		'scenariosPerSecond': round(total / elapsed, 1),
+		'failures'          : failures
+	}
+
+
+def main(argv: List[str] = None) -> dict:
+	parser = argparse.ArgumentParser(description='Replay Witi arming scenarios on a virtual clock')
+	parser.add_argument('--generated', type=int, default=500, help='number of random scenarios')
+	parser.add_argument('--seed', type=int, default=1, help='seed of the random scenarios')
+	args = parser.parse_args(argv)
+
+	with contextlib.redirect_stdout(io.StringIO()):
+		results = run(args.generated, args.seed)
+
+	print(json.dumps(results, indent=4))
+	return results
+
+
+if __name__ == '__main__':
+	sys.exit(1 if main()['failures'] else 0)
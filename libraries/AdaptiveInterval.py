@@ -0,0 +1,37 @@
+class AdaptiveInterval:
+	"""
+	Works out the delay until the next stateMonitor run.
+
+	While the alarm needs watching, or straight after a change, the fast cadence is used. Every quiet
+	run after that doubles the delay until the idle cadence is reached.
+	"""
+
+	def __init__(self, fast: float, idle: float, factor: float = 2.0):
+		"""
+		:param fast: seconds between runs while active or after a change
+		:param idle: upper limit for the seconds between runs while nothing happens
+		:param factor: growth of the delay per quiet run
+		"""
+		self._factor = factor
+		self.fast = fast
+		self.idle = idle
+		self.current = fast
+
+
+	def configure(self, fast: float, idle: float):
+		self.fast = fast
+		self.idle = max(fast, idle)
+		self.current = min(max(self.current, self.fast), self.idle)
+
+
+	def next(self, active: bool, changed: bool) -> float:
+		"""
+		:param active: the alarm is armed, triggered or about to be armed
+		:param changed: something changed since the last run
+		:return: seconds until the next run
+		"""
+		if active or changed:
+			self.current = self.fast
+		else:
+			self.current = min(self.current * self._factor, self.idle)
+		return self.current
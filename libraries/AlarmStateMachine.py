@@ -0,0 +1,85 @@
+from enum import Enum
+from typing import Dict, Tuple
+
+from skills.Witi.libraries.GpioSnapshot import GpioSnapshot
+
+
+class AlarmState(Enum):
+	DISARMED = 0
+	ARMING_PENDING = 1
+	ARMED = 2
+	TRIGGERED = 3
+	TOWING = 4
+
+
+class Action(Enum):
+	""" Side effects the skill runs when a transition asks for them """
+	TRIGGERED = 'alarmTriggered'
+	TRIGGER_CLEARED = 'triggerCleared'
+	PAIRING_LOST = 'pairingLost'
+	VEHICLE_RETURNED = 'vehicleReturned'
+	RESET_VOICE_CONTROL = 'resetVoiceControl'
+
+
+# Input bits on top of the four GpioSnapshot pin bits
+AUTO_ARMING_ENABLED = 16
+VOICE_CONTROLLED = 32
+AUTO_ARMED = 64
+
+INPUT_MASK = GpioSnapshot.MASK | AUTO_ARMING_ENABLED | VOICE_CONTROLLED | AUTO_ARMED
+
+Transition = Tuple[AlarmState, Tuple[Action, ...]]
+
+
+def _transition(state: AlarmState, inputs: int) -> Transition:
+	"""
+	The arming rules, only ever run while building the table
+	- Alarm pin on: armed, or triggered while the trigger pin is on
+	- Alarm pin off: towing while paired with the ignition on, arming pending once pairing is lost
+	  with auto arming enabled and nobody having taken over by voice, else disarmed
+	"""
+	alarmOn = inputs & GpioSnapshot.ALARM
+	paired = not inputs & GpioSnapshot.UNPAIRED
+	actions = list()
+
+	if alarmOn:
+		if inputs & GpioSnapshot.TRIGGERED:
+			nextState = AlarmState.TRIGGERED
+			if state is not AlarmState.TRIGGERED:
+				actions.append(Action.TRIGGERED)
+		else:
+			nextState = AlarmState.ARMED
+			if state is AlarmState.TRIGGERED:
+				actions.append(Action.TRIGGER_CLEARED)
+			if paired and inputs & AUTO_ARMED and not inputs & VOICE_CONTROLLED:
+				actions.append(Action.VEHICLE_RETURNED)
+	else:
+		if paired and inputs & GpioSnapshot.IGNITION:
+			nextState = AlarmState.TOWING
+		elif not paired and inputs & AUTO_ARMING_ENABLED and not inputs & VOICE_CONTROLLED:
+			nextState = AlarmState.ARMING_PENDING
+			if state is not AlarmState.ARMING_PENDING:
+				actions.append(Action.PAIRING_LOST)
+		else:
+			nextState = AlarmState.DISARMED
+
+		# Vehicle is back after the alarm was handled by voice, so auto arming can take over again
+		if paired and inputs & VOICE_CONTROLLED:
+			actions.append(Action.RESET_VOICE_CONTROL)
+
+	return nextState, tuple(actions)
+
+
+TRANSITIONS: Dict[AlarmState, Tuple[Transition, ...]] = {
+	state: tuple(_transition(state, inputs) for inputs in range(INPUT_MASK + 1))
+	for state in AlarmState
+}
+
+
+def nextTransition(state: AlarmState, inputs: int) -> Transition:
+	"""
+	:param state: the current alarm state
+	:param inputs: pin bits of the tick's GpioSnapshot combined with the flag bits above
+	:return: the next state and the actions to run, straight from the precomputed table
+	"""
+	return TRANSITIONS[state][inputs & INPUT_MASK]
@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+
+class AlarmEvent(Enum):
+	ARMED = 'armed'
+	DISARMED = 'disarmed'
+	TRIGGERED = 'triggered'
+	TRIGGER_CLEARED = 'triggerCleared'
+	PAIRING_LOST = 'pairingLost'
+	IGNITION_BLOCKED = 'ignitionBlocked'
+
+
+class Event(NamedTuple):
+	type: AlarmEvent
+	unit: Any
+	data: dict
+	timestamp: float
+
+
+EventHandler = Callable[[Event], None]
+
+
+class _Subscription(NamedTuple):
+	sink: str
+	handler: EventHandler
+	lane: int
+
+
+class EventBus:
+	"""
+	In process fan out of the alarm state changes to the notification sinks.
+
+	The code changing a state does its safety relevant work itself and then publishes an event. Every
+	subscriber gets the event on one of a few worker threads, so a slow sink doesn't hold up the
+	caller. Each sink is pinned to one worker, which keeps its events in order and means it only
+	delays the sinks sharing its worker. The queue of every worker is bounded, when it's full the
+	oldest event waiting there is dropped.
+
+	Lossless sinks, like the alarm notifications, get a worker of their own whose queue is never
+	trimmed. A warning is logged while such a sink is more than maxSize events behind.
+
+	Without workers the handlers run on the publishing thread, which keeps simulations deterministic.
+	"""
+
+	def __init__(self, workers: int = 4, maxSize: int = 50, logger: Optional[Callable[[str], None]] = None,
+				 onDrop: Optional[Callable[[str, Event], None]] = None):
+		"""
+		:param workers: number of shared worker threads, 0 to run the handlers on the publishing thread
+		:param maxSize: maximum number of events waiting per shared worker
+		:param logger: optional callable for warnings
+		:param onDrop: optional onDrop(sink, event), called for every event dropped by a full queue
+		"""
+		self._logger = logger
+		self._onDrop = onDrop
+		self._maxSize = maxSize
+		self._workers = workers
+		self._lanes: List[queue.Queue] = [queue.Queue(maxsize=maxSize) for _ in range(workers)]
+		self._subscriptions: Dict[AlarmEvent, List[_Subscription]] = {event: list() for event in AlarmEvent}
+		self._sinks: Dict[str, int] = dict()
+		# Sinks placed on the shared workers so far
+		self._shared = 0
+		self._threads: List[threading.Thread] = list()
+		self._stopEvent = threading.Event()
+		self.dropped = 0
+
+
+	def subscribe(self, sink: str, handler: EventHandler, events: Iterable[AlarmEvent] = tuple(AlarmEvent), lossless: bool = False):
+		"""
+		Subscribe before start(), a lossless sink's worker is only started there
+		:param sink: name of the sink, every handler of one sink runs on the same worker
+		:param handler: called with the event on a worker thread
+		:param events: the events the handler wants
+		:param lossless: never drop events for this sink, it gets a worker and an unbounded queue of its own
+		"""
+		lane = self._sinks.get(sink)
+		if lane is None:
+			if not self._lanes:
+				lane = 0
+			elif lossless:
+				self._lanes.append(queue.Queue())
+				lane = len(self._lanes) - 1
+			else:
+				lane = self._shared % self._workers
+				self._shared += 1
+			self._sinks[sink] = lane
+
+		for event in events:
+			self._subscriptions[event].append(_Subscription(sink, handler, lane))
+
+
+	def publish(self, eventType: AlarmEvent, unit: Any = None, **data):
+		""" Hand the event to its subscribers, this returns straight away """
+		event = Event(eventType, unit, data, time.time())
+		for subscription in self._subscriptions[eventType]:
+			if self._lanes:
+				self._put(self._lanes[subscription.lane], (subscription, event))
+			else:
+				self._deliver(subscription, event)
+
+
+	def start(self):
+		if self._threads:
+			return
+
+		self._stopEvent.clear()
+		for index, lane in enumerate(self._lanes):
+			thread = threading.Thread(name=f'WitiEvents{index}', target=self._worker, args=(lane,), daemon=True)
+			thread.start()
+			self._threads.append(thread)
+
+
+	def stop(self, timeout: float = 2.0):
+		""" Deliver what is waiting, then stop the workers """
+		if not self._threads:
+			return
+
+		self._stopEvent.set()
+		for lane in self._lanes:
+			self._put(lane, None)
+		deadline = time.monotonic() + timeout
+		for thread in self._threads:
+			thread.join(max(0.0, deadline - time.monotonic()))
+		self._threads = list()
+
+
+	def wait(self, timeout: float = 2.0) -> bool:
+		"""
+		Block until every event published so far was handled
+		:return: False if that took longer than timeout
+		"""
+		deadline = time.monotonic() + timeout
+		for lane in self._lanes:
+			while lane.unfinished_tasks:
+				if time.monotonic() > deadline:
+					return False
+				time.sleep(0.001)
+		return True
+
+
+	@property
+	def pending(self) -> int:
+		return sum(lane.qsize() for lane in self._lanes)
+
+
+	def _put(self, lane: queue.Queue, item):
+		while True:
+			try:
+				lane.put_nowait(item)
+				if item and not lane.maxsize and lane.qsize() > self._maxSize and self._logger:
+					self._logger(f'{item[0].sink} is {lane.qsize()} events behind')
+				return
+			except queue.Full:
+				try:
+					dropped = lane.get_nowait()
+					lane.task_done()
+				except queue.Empty:
+					continue
+
+				self.dropped += 1
+				if dropped:
+					subscription, event = dropped
+					if self._logger:
+						self._logger(f'Event queue full, dropped the {event.type.value} event for {subscription.sink}')
+					if self._onDrop:
+						self._onDrop(subscription.sink, event)
+
+
+	def _worker(self, lane: queue.Queue):
+		while True:
+			item = lane.get()
+			try:
+				if item is None:
+					if self._stopEvent.is_set():
+						return
+					continue
+
+				self._deliver(*item)
+			finally:
+				lane.task_done()
+
+
+	def _deliver(self, subscription: _Subscription, event: Event):
+		try:
+			subscription.handler(event)
+		except Exception as e:
+			if self._logger:
+				self._logger(f'The {subscription.sink} handler of the {event.type.value} event failed: {e}')
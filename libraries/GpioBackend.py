@@ -0,0 +1,111 @@
+from abc import ABC, abstractmethod
+from typing import Callable, List, Sequence
+
+EdgeCallback = Callable[[int], None]
+
+
+class GpioBackend(ABC):
+	"""
+	Interface for the pin access Witi needs. Pin numbers are BCM numbers.
+
+	RPiGpioBackend drives the real pins, SimulatedGpioBackend runs in process so the skill
+	can be loaded, profiled and load tested away from a Pi.
+	"""
+
+	@abstractmethod
+	def setupInput(self, pin: int):
+		""" Configure a pin as input with a pull down resistor """
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def setupOutput(self, pin: int):
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def input(self, pin: int) -> int:
+		""" :return: 1 if the pin is high, else 0 """
+		raise NotImplementedError
+
+
+	def inputs(self, pins: Sequence[int]) -> List[int]:
+		""" Read several pins in one pass, in the given order """
+		read = self.input
+		return [read(pin) for pin in pins]
+
+
+	@abstractmethod
+	def output(self, pin: int, value: bool):
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def addEdgeCallback(self, pin: int, callback: EdgeCallback, bounceTime: int):
+		"""
+		Call callback(pin) on every rising and falling edge of the pin
+		:param bounceTime: milliseconds in which further edges are ignored
+		:raises RuntimeError: if the backend can't watch that pin
+		"""
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def removeEdgeCallback(self, pin: int):
+		raise NotImplementedError
+
+
+	def cleanup(self):
+		"""
+		Release the input pins. The outputs are never released, a released switch pin floats and
+		would turn the alarm off until the skill is back
+		"""
+		pass
+
+
+class RPiGpioBackend(GpioBackend):
+	""" The real pins of a Raspberry Pi, through RPi.GPIO """
+
+	def __init__(self):
+		import RPi.GPIO as GPIO
+
+		self._gpio = GPIO
+		self._inputPins = list()
+		GPIO.setmode(GPIO.BCM)
+		GPIO.setwarnings(False)
+
+
+	def setupInput(self, pin: int):
+		self._gpio.setup(pin, self._gpio.IN, pull_up_down=self._gpio.PUD_DOWN)
+		self._inputPins.append(pin)
+
+
+	def setupOutput(self, pin: int):
+		self._gpio.setup(pin, self._gpio.OUT)
+
+
+	def input(self, pin: int) -> int:
+		return self._gpio.input(pin)
+
+
+	def inputs(self, pins: Sequence[int]) -> List[int]:
+		read = self._gpio.input
+		return [read(pin) for pin in pins]
+
+
+	def output(self, pin: int, value: bool):
+		self._gpio.output(pin, value)
+
+
+	def addEdgeCallback(self, pin: int, callback: EdgeCallback, bounceTime: int):
+		self._gpio.add_event_detect(pin, self._gpio.BOTH, callback=callback, bouncetime=bounceTime)
+
+
+	def removeEdgeCallback(self, pin: int):
+		self._gpio.remove_event_detect(pin)
+
+
+	def cleanup(self):
+		if self._inputPins:
+			self._gpio.cleanup(self._inputPins)
+			self._inputPins = list()
@@ -0,0 +1,86 @@
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+
+class _Pins(NamedTuple):
+	""" The fields of a GpioSnapshot """
+
+	bits: int
+	alarmOn: bool
+	triggered: bool
+	ignitionOn: bool
+	paired: bool
+	states: Mapping[str, str]
+
+
+class GpioSnapshot(_Pins):
+	"""
+	Immutable view of the WITI input pins for one stateMonitor tick.
+
+	The four inputs only have 16 possible combinations, so every snapshot is built once when the
+	module loads. A tick reads each pin once and picks the matching instance, nothing gets
+	allocated and the human friendly states are already worked out. Being a tuple it can't be changed.
+	"""
+
+	__slots__ = ()
+
+	ALARM = 1
+	TRIGGERED = 2
+	IGNITION = 4
+	# The pairing pin reads high when the vehicle is NOT paired
+	UNPAIRED = 8
+
+	MASK = ALARM | TRIGGERED | IGNITION | UNPAIRED
+
+	# Bit of each pin, keyed like the human friendly states
+	PIN_BITS = MappingProxyType({
+		'AlarmState'     : ALARM,
+		'triggeredState' : TRIGGERED,
+		'IgnitionActive' : IGNITION,
+		'PairedToVehicle': UNPAIRED
+	})
+
+
+	@staticmethod
+	def build(bits: int) -> 'GpioSnapshot':
+		""" Work out the snapshot of a pin combination, only used to fill the shared instances """
+		onOff = ('off', 'on')
+		alarmOn = bool(bits & GpioSnapshot.ALARM)
+		triggered = bool(bits & GpioSnapshot.TRIGGERED)
+		ignitionOn = bool(bits & GpioSnapshot.IGNITION)
+		paired = not bits & GpioSnapshot.UNPAIRED
+		return GpioSnapshot(bits, alarmOn, triggered, ignitionOn, paired, MappingProxyType({
+			'AlarmState'     : onOff[alarmOn],
+			'triggeredState' : onOff[triggered],
+			'IgnitionActive' : onOff[ignitionOn],
+			'PairedToVehicle': 'Connected' if paired else 'Disconnected'
+		}))
+
+
+	def __repr__(self) -> str:
+		return f'GpioSnapshot({dict(self.states)})'
+
+
+	@staticmethod
+	def fromBits(bits: int) -> 'GpioSnapshot':
+		return _SNAPSHOTS[bits & GpioSnapshot.MASK]
+
+
+	@staticmethod
+	def fromPins(alarm: int, triggered: int, ignition: int, unpaired: int) -> 'GpioSnapshot':
+		"""
+		:param alarm: raw value of the alarm state pin
+		:param triggered: raw value of the triggered state pin
+		:param ignition: raw value of the ignition feed pin
+		:param unpaired: raw value of the paired to vehicle pin
+		:return: the shared snapshot for that pin combination
+		"""
+		return _SNAPSHOTS[
+			(GpioSnapshot.ALARM if alarm else 0)
+			| (GpioSnapshot.TRIGGERED if triggered else 0)
+			| (GpioSnapshot.IGNITION if ignition else 0)
+			| (GpioSnapshot.UNPAIRED if unpaired else 0)
+		]
+
+
+_SNAPSHOTS = tuple(GpioSnapshot.build(bits) for bits in range(GpioSnapshot.MASK + 1))
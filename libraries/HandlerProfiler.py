@@ -0,0 +1,214 @@
+import functools
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+	# Only for the type hints, cProfile is imported once a profile is actually kept
+	import cProfile
+
+# Phases a handler's wall time is split into, everything else counts as 'other'
+PHASES = ('gpio', 'db', 'telegram', 'config', 'dialog')
+
+
+class _Frame:
+	""" A phase running in a handler call """
+
+	__slots__ = ('name', 'started', 'childTime')
+
+
+	def __init__(self, name: str, started: float):
+		self.name = name
+		self.started = started
+		# Time spent in the phases nested in this one
+		self.childTime = 0.0
+
+
+class _Call:
+	""" Book keeping of the handler call running on a thread """
+
+	__slots__ = ('handler', 'phases', 'stack')
+
+
+	def __init__(self, handler: str):
+		self.handler = handler
+		self.phases = dict.fromkeys(PHASES, 0.0)
+		self.stack: List[_Frame] = list()
+
+
+class _HandlerStats:
+	__slots__ = ('calls', 'slow', 'total', 'max', 'phases')
+
+
+	def __init__(self):
+		self.calls = 0
+		self.slow = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.phases = dict.fromkeys(PHASES + ('other',), 0.0)
+
+
+class HandlerProfiler:
+	"""
+	Opt-in latency profiling of the intent handlers.
+
+	Handlers decorated with profiledHandler are timed while the profiler is enabled. The skill marks
+	the slow parts of the dialog path with phase(), so every call is split into gpio, db, telegram,
+	config and dialog time. Nested phases only count once, for the innermost phase. Calls above the
+	threshold are reported to the logger, and if keepProfiles is set every call runs under cProfile
+	and the dumps of the slowest ones are kept in profileDirectory.
+	"""
+
+	def __init__(self, profileDirectory: Path, logger: Optional[Callable[[str], None]] = None):
+		"""
+		:param profileDirectory: where the cProfile dumps are written
+		:param logger: called with a message for every slow call
+		"""
+		self.enabled = False
+		self.threshold = 0.25
+		self.keepProfiles = 0
+		self._profileDirectory = profileDirectory
+		self._logger = logger
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._stats: Dict[str, _HandlerStats] = dict()
+		# Min heap of (duration, sequence, handler, dump file), so the fastest kept dump is replaced first
+		self._slowest: List[Tuple[float, int, str, Optional[Path]]] = list()
+		self._sequence = 0
+
+
+	def configure(self, enabled: bool, thresholdMs: int, keepProfiles: int):
+		"""
+		:param enabled: time the handlers at all
+		:param thresholdMs: calls slower than this are reported
+		:param keepProfiles: number of cProfile dumps of the slowest calls to keep, 0 for none
+		"""
+		self.enabled = enabled
+		self.threshold = thresholdMs / 1000
+		self.keepProfiles = max(0, keepProfiles)
+
+
+	@contextmanager
+	def phase(self, name: str) -> Iterator[None]:
+		""" Count the time spent in the block to a phase of the handler call running on this thread """
+		call: Optional[_Call] = getattr(self._local, 'call', None)
+		if call is None:
+			yield
+			return
+
+		frame = _Frame(name, time.perf_counter())
+		call.stack.append(frame)
+		try:
+			yield
+		finally:
+			call.stack.pop()
+			elapsed = time.perf_counter() - frame.started
+			call.phases[name] += elapsed - frame.childTime
+			if call.stack:
+				call.stack[-1].childTime += elapsed
+
+
+	def run(self, handler: str, func: Callable, *args, **kwargs):
+		""" Call a handler and record its timing """
+		if not self.enabled or getattr(self._local, 'call', None) is not None:
+			return func(*args, **kwargs)
+
+		call = _Call(handler)
+		self._local.call = call
+		profile = None
+		if self.keepProfiles:
+			import cProfile
+
+			profile = cProfile.Profile()
+		start = time.perf_counter()
+		try:
+			if profile:
+				return profile.runcall(func, *args, **kwargs)
+			return func(*args, **kwargs)
+		finally:
+			duration = time.perf_counter() - start
+			self._local.call = None
+			self._record(call, duration, profile)
+
+
+	def report(self) -> Dict[str, dict]:
+		""" Per handler call count, slow calls, mean and max milliseconds and the mean milliseconds per phase """
+		with self._lock:
+			return {
+				handler: {
+					'calls'   : stats.calls,
+					'slow'    : stats.slow,
+					'meanMs'  : round(stats.total / stats.calls * 1000, 2),
+					'maxMs'   : round(stats.max * 1000, 2),
+					'phasesMs': {phase: round(value / stats.calls * 1000, 2) for phase, value in stats.phases.items()}
+				}
+				for handler, stats in self._stats.items() if stats.calls
+			}
+
+
+	def slowest(self) -> List[Tuple[str, float, Optional[Path]]]:
+		""" The kept slowest calls as (handler, milliseconds, cProfile dump), slowest first """
+		with self._lock:
+			return [(handler, round(duration * 1000, 2), dump) for duration, _, handler, dump in sorted(self._slowest, reverse=True)]
+
+
+	def _record(self, call: _Call, duration: float, profile: Optional['cProfile.Profile']):
+		other = duration - sum(call.phases.values())
+		with self._lock:
+			stats = self._stats.setdefault(call.handler, _HandlerStats())
+			stats.calls += 1
+			stats.total += duration
+			stats.max = max(stats.max, duration)
+			for phase, value in call.phases.items():
+				stats.phases[phase] += value
+			stats.phases['other'] += other
+			slow = duration > self.threshold
+			if slow:
+				stats.slow += 1
+
+		if slow and self._logger:
+			phases = ', '.join(f'{phase} {value * 1000:.1f}' for phase, value in call.phases.items() if value)
+			self._logger(f'Intent handler {call.handler} took {duration * 1000:.1f} ms ({phases or "no phases"}, other {other * 1000:.1f})')
+
+		if profile:
+			self._keepProfile(call.handler, duration, profile)
+
+
+	def _keepProfile(self, handler: str, duration: float, profile: 'cProfile.Profile'):
+		""" Write the dump if the call is one of the slowest keepProfiles calls, removing the one it replaces """
+		with self._lock:
+			self._sequence += 1
+			if len(self._slowest) >= self.keepProfiles and self._slowest and duration <= self._slowest[0][0]:
+				return
+			dump = self._profileDirectory / f'{handler}_{int(duration * 1000)}ms_{self._sequence}.prof'
+			entry = (duration, self._sequence, handler, dump)
+			dropped: Optional[Tuple[float, int, str, Optional[Path]]]
+			if len(self._slowest) >= self.keepProfiles:
+				dropped = heapq.heappushpop(self._slowest, entry)
+			else:
+				heapq.heappush(self._slowest, entry)
+				dropped = None
+
+		try:
+			self._profileDirectory.mkdir(parents=True, exist_ok=True)
+			profile.dump_stats(str(dump))
+			if dropped and dropped[3]:
+				dropped[3].unlink()
+		except OSError as e:
+			if self._logger:
+				self._logger(f'Could not write the profile of {handler}: {e}')
+
+
+def profiledHandler(func: Callable) -> Callable:
+	"""
+	Time an intent handler with the skill's HandlerProfiler. Put it below @IntentHandler
+	"""
+
+	@functools.wraps(func)
+	def wrapper(self, *args, **kwargs):
+		return self._handlerProfiler.run(func.__name__, func, self, *args, **kwargs)
+
+	return wrapper
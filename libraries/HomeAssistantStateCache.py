@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class HomeAssistantStateCache:
+	"""
+	Cached reader for the Home Assistant skill's currentStateOfDevices.json.
+
+	The file holds every HA entity but Witi only ever needs one or two of them. The file is only read
+	again when its modification time or size changed, and instead of loading the whole json document
+	just the value of the requested entity is decoded.
+	"""
+
+	def __init__(self, path: Path, onParse: Optional[Callable[[], None]] = None):
+		"""
+		:param path: the Home Assistant state file
+		:param onParse: called every time the file actually gets read
+		"""
+		self._path = path
+		self._onParse = onParse
+		self._decoder = json.JSONDecoder()
+		self._signature: Optional[Tuple[int, int]] = None
+		self._values: Dict[str, Any] = dict()
+
+
+	@property
+	def path(self) -> Path:
+		return self._path
+
+
+	def entityState(self, entityId: str) -> Any:
+		"""
+		:param entityId: the HA entity, for example input_boolean.persons_home
+		:return: the stored state of that entity or None if the file doesn't hold it
+		:raises FileNotFoundError: if the Home Assistant skill hasn't written its state file
+		"""
+		stat = self._path.stat()
+		signature = (stat.st_mtime_ns, stat.st_size)
+		if signature != self._signature:
+			self._signature = signature
+			self._values = dict()
+		elif entityId in self._values:
+			return self._values[entityId]
+
+		value = self._extract(self._path.read_text(), entityId)
+		if self._onParse:
+			self._onParse()
+		self._values[entityId] = value
+		return value
+
+
+	def invalidate(self):
+		""" Force the next lookup to read the file again """
+		self._signature = None
+		self._values = dict()
+
+
+	def _extract(self, text: str, entityId: str) -> Any:
+		key = json.dumps(entityId)
+		index = text.find(key)
+		while index != -1:
+			position = self._skipWhitespace(text, index + len(key))
+			# Only a key is followed by a colon, the same string used as a value is skipped
+			if position < len(text) and text[position] == ':':
+				value, _ = self._decoder.raw_decode(text, self._skipWhitespace(text, position + 1))
+				return value
+			index = text.find(key, index + len(key))
+		return None
+
+
+	@staticmethod
+	def _skipWhitespace(text: str, position: int) -> int:
+		while position < len(text) and text[position] in ' \t\r\n':
+			position += 1
+		return position
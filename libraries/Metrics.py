@@ -0,0 +1,130 @@
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds in seconds. Ticks and drift are usually well below a millisecond on a Pi 3, Telegram
+# sends take a few hundred milliseconds
+TICK_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+DRIFT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+INTERVAL_BUCKETS = (1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SEND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+	""" Fixed bucket histogram, the memory used doesn't grow with the number of observations """
+
+	__slots__ = ('buckets', 'counts', 'count', 'sum')
+
+
+	def __init__(self, buckets: Iterable[float]):
+		"""
+		:param buckets: sorted upper bounds, an implicit +Inf bucket is added
+		"""
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+
+	def observe(self, value: float):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+
+	def cumulative(self) -> List[Tuple[str, int]]:
+		""" (upper bound, observations at or below it) pairs in Prometheus order, ending with +Inf """
+		result = list()
+		total = 0
+		for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+			total += count
+			result.append(('+Inf' if bound == float('inf') else repr(bound), total))
+		return result
+
+
+class Metrics:
+	"""
+	Counters and histograms of the skill's runtime, kept in memory.
+
+	All names are declared up front, so the registry has a fixed size. Values can be published as a
+	json snapshot on MQTT or rendered in the Prometheus text format. Gauges are read from their
+	owners when a snapshot is taken instead of being pushed on every change.
+	"""
+
+	def __init__(self, counters: Dict[str, str], histograms: Dict[str, Tuple[str, Iterable[float]]],
+				 gauges: Optional[Dict[str, Tuple[str, Callable[[], float]]]] = None, prefix: str = 'witi'):
+		"""
+		:param counters: name -> help text
+		:param histograms: name -> (help text, bucket upper bounds)
+		:param gauges: name -> (help text, callable returning the current value)
+		:param prefix: prepended to every name in the Prometheus output
+		"""
+		self._prefix = prefix
+		self._lock = threading.Lock()
+		self._help = {name: text for name, text in counters.items()}
+		self._help.update({name: text for name, (text, _) in histograms.items()})
+		self._counters = {name: 0 for name in counters}
+		self._histograms = {name: Histogram(buckets) for name, (_, buckets) in histograms.items()}
+		self._gauges = dict()
+		for name, (text, getter) in (gauges or dict()).items():
+			self._help[name] = text
+			self._gauges[name] = getter
+
+
+	def increment(self, name: str, value: int = 1):
+		with self._lock:
+			self._counters[name] += value
+
+
+	def observe(self, name: str, value: float):
+		with self._lock:
+			self._histograms[name].observe(value)
+
+
+	def snapshot(self) -> dict:
+		""" Current values as plain json types. Histograms are summarised by count, sum, mean and buckets """
+		with self._lock:
+			counters = dict(self._counters)
+			histograms = {
+				name: {
+					'count'  : histogram.count,
+					'sum'    : round(histogram.sum, 6),
+					'mean'   : round(histogram.sum / histogram.count, 6) if histogram.count else 0,
+					'buckets': dict(histogram.cumulative())
+				}
+				for name, histogram in self._histograms.items()
+			}
+
+		return {
+			'counters'  : counters,
+			'gauges'    : {name: getter() for name, getter in self._gauges.items()},
+			'histograms': histograms
+		}
+
+
+	def prometheus(self) -> str:
+		""" All values in the Prometheus text exposition format """
+		lines = list()
+		with self._lock:
+			for name, value in self._counters.items():
+				metric = f'{self._prefix}_{name}_total'
+				lines.append(f'# HELP {metric} {self._help[name]}')
+				lines.append(f'# TYPE {metric} counter')
+				lines.append(f'{metric} {value}')
+
+			for name, histogram in self._histograms.items():
+				metric = f'{self._prefix}_{name}'
+				lines.append(f'# HELP {metric} {self._help[name]}')
+				lines.append(f'# TYPE {metric} histogram')
+				for bound, count in histogram.cumulative():
+					lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+				lines.append(f'{metric}_sum {histogram.sum}')
+				lines.append(f'{metric}_count {histogram.count}')
+
+		for name, getter in self._gauges.items():
+			metric = f'{self._prefix}_{name}'
+			lines.append(f'# HELP {metric} {self._help[name]}')
+			lines.append(f'# TYPE {metric} gauge')
+			lines.append(f'{metric} {getter()}')
+
+		return '\n'.join(lines) + '\n'
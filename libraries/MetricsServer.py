@@ -0,0 +1,76 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+class MetricsServer:
+	"""
+	Minimal HTTP endpoint serving the metrics in the Prometheus text format on /metrics.
+
+	Runs on its own daemon thread and only renders the text when it gets scraped.
+	"""
+
+	def __init__(self, render: Callable[[], str], port: int, host: str = ''):
+		"""
+		:param render: returns the Prometheus text
+		:param port: tcp port to listen on
+		:param host: interface to bind to, all of them by default so Prometheus can scrape from another machine
+		"""
+		self._render = render
+		self._port = port
+		self._host = host
+		self._server: Optional[ThreadingHTTPServer] = None
+		self._thread: Optional[threading.Thread] = None
+
+
+	@property
+	def running(self) -> bool:
+		return self._server is not None
+
+
+	def start(self):
+		"""
+		:raises OSError: if the port can't be bound
+		"""
+		if self._server:
+			return
+
+		render = self._render
+
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def do_GET(self):
+				if self.path.split('?', 1)[0] != '/metrics':
+					self.send_error(404)
+					return
+
+				body = render().encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+
+			def log_message(self, *_args):
+				# Scrapes every few seconds would flood the log
+				pass
+
+
+		self._server = ThreadingHTTPServer((self._host, self._port), Handler)
+		self._server.daemon_threads = True
+		self._thread = threading.Thread(name='WitiMetricsServer', target=self._server.serve_forever, daemon=True)
+		self._thread.start()
+
+
+	def stop(self):
+		if not self._server:
+			return
+
+		self._server.shutdown()
+		self._server.server_close()
+		self._server = None
+		if self._thread:
+			self._thread.join(2)
+			self._thread = None
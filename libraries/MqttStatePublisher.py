@@ -0,0 +1,118 @@
+from typing import Callable, Dict
+
+from skills.Witi.libraries.GpioSnapshot import GpioSnapshot
+
+# State bits on top of the four GpioSnapshot pin bits
+CHECKING_FOR_USER = 16
+USER_HOME = 32
+AUTO_ARMED = 64
+VOICE_CONTROLLED = 128
+USER_OUT = 256
+
+# (field, bit, value when set, value when clear). PairedToVehicle is stored inverted as UNPAIRED
+FIELDS = (
+	('AlarmState', GpioSnapshot.ALARM, 'on', 'off'),
+	('triggeredState', GpioSnapshot.TRIGGERED, 'on', 'off'),
+	('IgnitionActive', GpioSnapshot.IGNITION, 'on', 'off'),
+	('PairedToVehicle', GpioSnapshot.UNPAIRED, 'Disconnected', 'Connected'),
+	('checkingUserPresence', CHECKING_FOR_USER, True, False),
+	('userHome', USER_HOME, True, False),
+	('userOut', USER_OUT, True, False),
+	('activeAutoArming', AUTO_ARMED, True, False),
+	('VoiceControlled', VOICE_CONTROLLED, True, False)
+)
+
+
+class MqttStatePublisher:
+	"""
+	Publishes the Witi state on the WitiAlarm topic only when it changed.
+
+	The state is kept as a bitmask, so an unchanged tick costs one integer compare. Every change bumps
+	the version. Modes:
+	- full: the whole payload on WitiAlarm, like it always was
+	- delta: only the changed fields, each on its own retained subtopic such as WitiAlarm/AlarmState,
+	  with a retained full snapshot on WitiAlarm/snapshot on the first publish and every snapshotEvery changes
+	Optionally the low byte of the state is also published as a number on WitiAlarm/status
+	"""
+
+	def __init__(self, publish: Callable[..., None], topic: str = 'WitiAlarm', snapshotEvery: int = 20):
+		"""
+		:param publish: the skill's publish method
+		:param topic: base topic
+		:param snapshotEvery: changes between retained snapshots in delta mode
+		"""
+		self._publish = publish
+		self._topic = topic
+		self._snapshotEvery = snapshotEvery
+		self._bits = -1
+		self.version = 0
+
+
+	@property
+	def bits(self) -> int:
+		return self._bits
+
+
+	@property
+	def topic(self) -> str:
+		return self._topic
+
+
+	def update(self, bits: int, delta: bool = False, compact: bool = False) -> bool:
+		"""
+		:param bits: current state, pin bits of the tick's GpioSnapshot plus the bits above
+		:param delta: publish only the changed fields to their subtopics
+		:param compact: also publish the compact status byte
+		:return: True if something was published
+		"""
+		if bits == self._bits:
+			return False
+
+		changed = bits ^ self._bits if self._bits >= 0 else -1
+		self._bits = bits
+		self.version += 1
+
+		if not delta:
+			self._publish(self._topic, payload=self.payload(bits))
+		else:
+			for field, bit, setValue, clearValue in FIELDS:
+				if changed & bit:
+					self._publish(f'{self._topic}/{field}', stringPayload=str(setValue if bits & bit else clearValue), retain=True)
+			if changed == -1 or self.version % self._snapshotEvery == 0:
+				self._publish(f'{self._topic}/snapshot', payload=self.payload(bits), retain=True)
+
+		if compact:
+			self._publish(f'{self._topic}/status', stringPayload=str(bits & 0xFF), retain=True)
+		return True
+
+
+	def reset(self):
+		""" Publish everything again on the next update """
+		self._bits = -1
+
+
+	def restore(self, bits: int, version: int):
+		""" Continue from the state published before a restart, the retained messages still hold it """
+		self._bits = bits
+		self.version = version
+
+
+	def payload(self, bits: int) -> Dict:
+		""" The full WitiAlarm payload for a state """
+		values = {field: setValue if bits & bit else clearValue for field, bit, setValue, clearValue in FIELDS}
+		return {
+			'version'   : self.version,
+			'gpioStates': {
+				'AlarmState'     : values['AlarmState'],
+				'triggeredState' : values['triggeredState'],
+				'IgnitionActive' : values['IgnitionActive'],
+				'PairedToVehicle': values['PairedToVehicle'],
+				'UserPresence'   : {
+					'checkingUserPresence': values['checkingUserPresence'],
+					'userHome'            : values['userHome'],
+					'userOut'             : values['userOut'],
+					'activeAutoArming'    : values['activeAutoArming'],
+					'VoiceControlled'     : values['VoiceControlled']
+				}
+			}
+		}
@@ -0,0 +1,229 @@
+import json
+import threading
+from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class NotificationType(Enum):
+	ARMED = 'armed'
+	DISARMED = 'disarmed'
+	TRIGGERED = 'triggered'
+	TRIGGER_CLEARED = 'triggerCleared'
+	PIN_FAILURE = 'pinFailure'
+
+
+class NotificationRule(NamedTuple):
+	# Seconds between two messages of this type
+	minInterval: float
+	# Seconds a burst is collected before its digest goes out
+	window: float
+	# The first message after a quiet period goes out straight away instead of waiting for the window
+	priority: bool
+
+
+DEFAULT_RULES: Dict[NotificationType, NotificationRule] = {
+	NotificationType.ARMED          : NotificationRule(minInterval=30, window=60, priority=True),
+	NotificationType.DISARMED       : NotificationRule(minInterval=30, window=60, priority=True),
+	NotificationType.TRIGGERED      : NotificationRule(minInterval=60, window=180, priority=True),
+	NotificationType.TRIGGER_CLEARED: NotificationRule(minInterval=60, window=30, priority=False),
+	NotificationType.PIN_FAILURE    : NotificationRule(minInterval=60, window=300, priority=True)
+}
+
+
+# Digest text of the types whose messages name who did it, for bursts from more than one person
+DIGEST_TEXTS: Dict[NotificationType, str] = {
+	NotificationType.DISARMED   : 'The alarm was disabled',
+	NotificationType.PIN_FAILURE: 'A incorrect pinCode was provided'
+}
+
+
+def parseRules(text: str) -> Dict[NotificationType, NotificationRule]:
+	"""
+	The default rules with the overrides of the notificationPolicy setting, for example
+	{"triggered": {"minInterval": 120, "window": 600}, "triggerCleared": {"priority": true}}
+	:raises ValueError: if the text isn't valid or names an unknown type or field
+	"""
+	rules = dict(DEFAULT_RULES)
+	if not text or not text.strip():
+		return rules
+
+	try:
+		overrides = json.loads(text)
+	except ValueError as e:
+		raise ValueError(f'notificationPolicy is not valid json: {e}')
+	if not isinstance(overrides, dict):
+		raise ValueError('notificationPolicy has to be a json object')
+
+	for name, fields in overrides.items():
+		try:
+			notificationType = NotificationType(name)
+		except ValueError:
+			raise ValueError(f'Unknown notification type "{name}" in notificationPolicy')
+		if not isinstance(fields, dict) or set(fields) - set(NotificationRule._fields):
+			raise ValueError(f'The "{name}" rule of notificationPolicy only takes {", ".join(NotificationRule._fields)}')
+		rule = rules[notificationType]._replace(**fields)
+		rules[notificationType] = NotificationRule(float(rule.minInterval), float(rule.window), bool(rule.priority))
+	return rules
+
+
+def describeSpan(seconds: float) -> str:
+	if seconds < 90:
+		return f'{max(1, round(seconds))} s'
+	if seconds < 5400:
+		return f'{round(seconds / 60)} min'
+	return f'{round(seconds / 3600)} h'
+
+
+class _Burst:
+	__slots__ = ('started', 'latest', 'count', 'pending', 'message', 'senders', 'lastSent', 'flushScheduled')
+
+
+	def __init__(self):
+		# When the burst started, only meaningful while count is above 0
+		self.started = 0.0
+		self.latest = 0.0
+		self.count = 0
+		self.pending = 0
+		self.message = ''
+		self.senders: List[str] = list()
+		self.lastSent = float('-inf')
+		self.flushScheduled = False
+
+
+class NotificationPolicy:
+	"""
+	Throttling of the outgoing notifications, so a flapping input doesn't flood the chat.
+
+	Messages are tracked per type and target, the target usually being the unit. Per rule:
+	- no two messages go out closer than `minInterval`
+	- messages coming in meanwhile are collected and go out as one digest once the burst is `window`
+	  seconds old, "Your Alarm has just been triggered (7 times in 3 min)". A burst of one message
+	  goes out as it is
+	- with `priority` the first message after a quiet period goes out straight away and only the
+	  ones following it are collected, otherwise the first message waits for the window as well
+
+	A digest repeats the last message of its burst. Messages naming who did it pass a sender, a burst
+	from several senders gets the generic text of its type and lists them instead, so it isn't
+	reported as the doing of whoever came last.
+
+	Types without a rule are sent straight away.
+	"""
+
+	def __init__(self, send: Callable[[Any, str, NotificationType], None], doLater: Callable[..., None], clock: Callable[[], float],
+				 rules: Optional[Dict[NotificationType, NotificationRule]] = None):
+		"""
+		:param send: send(target, message, notificationType) does the actual sending
+		:param doLater: doLater(interval=, func=, args=) of the skill's scheduler
+		:param clock: monotonic seconds, on the same clock as doLater
+		:param rules: the rule per type, DEFAULT_RULES if not given
+		"""
+		self._send = send
+		self._doLater = doLater
+		self._clock = clock
+		self._rules = dict(DEFAULT_RULES if rules is None else rules)
+		self._lock = threading.Lock()
+		self._bursts: Dict[Tuple[NotificationType, Any], _Burst] = dict()
+		self.coalesced = 0
+
+
+	def configure(self, rules: Dict[NotificationType, NotificationRule]):
+		""" Swap in new rules, bursts already collected go out on their current schedule """
+		self._rules = dict(rules)
+
+
+	def notify(self, notificationType: NotificationType, target: Any, message: str, sender: Optional[str] = None):
+		"""
+		Send the message now, or hold it for the digest of its burst
+		:param sender: who the message names, if anyone
+		"""
+		rule = self._rules.get(notificationType)
+		if rule is None:
+			self._send(target, message, notificationType)
+			return
+
+		key = (notificationType, target)
+		now = self._clock()
+		with self._lock:
+			burst = self._bursts.get(key)
+			if burst is None:
+				burst = self._bursts[key] = _Burst()
+
+			quiet = not burst.pending and now - burst.lastSent >= rule.minInterval
+			if quiet or not burst.count:
+				burst.started = now
+				burst.count = 0
+				burst.senders = list()
+			burst.count += 1
+			burst.latest = now
+			if sender and sender not in burst.senders:
+				burst.senders.append(sender)
+
+			if quiet and rule.priority:
+				burst.lastSent = now
+				sendNow = True
+			else:
+				sendNow = False
+				burst.pending += 1
+				burst.message = message
+				if burst.pending > 1:
+					self.coalesced += 1
+				delay = self._flushDelay(burst, rule, now)
+				if not burst.flushScheduled:
+					burst.flushScheduled = True
+					self._doLater(interval=delay, func=self.flush, args=[key])
+
+		if sendNow:
+			self._send(target, message, notificationType)
+
+
+	def flush(self, key: Tuple[NotificationType, Any], force: bool = False):
+		""" Send the digest of a burst once it's due """
+		notificationType, target = key
+		now = self._clock()
+		with self._lock:
+			burst = self._bursts.get(key)
+			if burst is None:
+				return
+			burst.flushScheduled = False
+			if not burst.pending:
+				return
+
+			rule = self._rules.get(notificationType) or NotificationRule(0, 0, True)
+			delay = self._flushDelay(burst, rule, now)
+			if delay > 0 and not force:
+				# The rules changed since the flush was scheduled
+				burst.flushScheduled = True
+				self._doLater(interval=delay, func=self.flush, args=[key])
+				return
+
+			span = describeSpan(burst.latest - burst.started)
+			if burst.count == 1:
+				message = burst.message
+			elif len(burst.senders) > 1:
+				text = DIGEST_TEXTS.get(notificationType, burst.message)
+				message = f'{text} ({burst.count} times in {span}, by {", ".join(burst.senders)})'
+			else:
+				message = f'{burst.message} ({burst.count} times in {span})'
+			burst.pending = 0
+			burst.count = 0
+			burst.lastSent = now
+
+		self._send(target, message, notificationType)
+
+
+	def flushAll(self):
+		""" Send every collected digest straight away, used when stopping """
+		with self._lock:
+			keys = [key for key, burst in self._bursts.items() if burst.pending]
+		for key in keys:
+			self.flush(key, force=True)
+
+
+	@property
+	def pending(self) -> int:
+		return sum(burst.pending for burst in self._bursts.values())
+
+
+	@staticmethod
+	def _flushDelay(burst: _Burst, rule: NotificationRule, now: float) -> float:
+		return max(burst.started + rule.window, burst.lastSent + rule.minInterval) - now
@@ -0,0 +1,59 @@
+import threading
+from typing import Callable, Optional, Tuple
+
+
+class PresenceAggregate:
+	"""
+	Cached answer to "are all users home" and "are all users out".
+
+	Asking the UserManager scans every user, so the answer is worked out once and kept until
+	invalidate() is called. The skill does that whenever the presence can actually change: its own
+	home() / leftHome() calls, the onLeavingHome / onReturningHome events and a changed Home Assistant
+	state file.
+	"""
+
+	def __init__(self, checkIfAllUser: Callable[[str], bool]):
+		"""
+		:param checkIfAllUser: the UserManager lookup, checkIfAllUser(state) with 'home' or 'out'
+		"""
+		self._checkIfAllUser = checkIfAllUser
+		self._lock = threading.Lock()
+		self._values: Optional[Tuple[bool, bool]] = None
+		self._generation = 0
+
+
+	@property
+	def userHome(self) -> bool:
+		""" All users are home """
+		return self._current()[0]
+
+
+	@property
+	def userOut(self) -> bool:
+		""" All users are out """
+		return self._current()[1]
+
+
+	def invalidate(self):
+		""" The presence might have changed, ask the UserManager again on the next read """
+		with self._lock:
+			self._values = None
+			self._generation += 1
+
+
+	def _current(self) -> Tuple[bool, bool]:
+		values = self._values
+		if values is not None:
+			return values
+
+		with self._lock:
+			generation = self._generation
+
+		values = (self._checkIfAllUser('home'), self._checkIfAllUser('out'))
+
+		# An invalidation while the users were checked means the values might already be out of date,
+		# they are returned but not kept
+		with self._lock:
+			if generation == self._generation:
+				self._values = values
+		return values
@@ -0,0 +1,107 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
+
+Message = Union[str, Callable[[], str]]
+
+
+class _KeyState:
+	__slots__ = ('emitted', 'identity', 'suppressed', 'level')
+
+
+	def __init__(self):
+		self.emitted = float('-inf')
+		self.identity: Optional[tuple] = None
+		self.suppressed = 0
+		self.level = ''
+
+
+class RateLimitedLog:
+	"""
+	Logging for the code that runs on every tick or every presence check.
+
+	Every message has a key. Per key:
+	- at most one message is written per `interval` seconds, the others are counted
+	- a message identical to the last written one (same level, text and fields) is only counted until
+	  `repeatInterval` seconds have passed, so a steady state is logged once and then stays quiet
+	- the next message that does get written says how many were left out, "(repeated 240 times)"
+
+	The message can be a callable, it only gets formatted when the message is actually written.
+	Keyword fields are added to the message as key=value pairs.
+	"""
+
+	def __init__(self, sinks: Dict[str, Callable[[str], None]], interval: float = 10.0, repeatInterval: float = 3600.0,
+				 clock: Callable[[], float] = time.monotonic):
+		"""
+		:param sinks: level -> callable writing the message, for example {'debug': skill.logDebug}
+		:param interval: minimum seconds between two messages of the same key
+		:param repeatInterval: seconds before an unchanged message is written again
+		:param clock: monotonic seconds
+		"""
+		self._sinks = sinks
+		self.interval = interval
+		self.repeatInterval = repeatInterval
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._keys: Dict[str, _KeyState] = dict()
+
+
+	def debug(self, key: str, message: Message, **fields):
+		self.log('debug', key, message, **fields)
+
+
+	def info(self, key: str, message: Message, **fields):
+		self.log('info', key, message, **fields)
+
+
+	def warning(self, key: str, message: Message, **fields):
+		self.log('warning', key, message, **fields)
+
+
+	def log(self, level: str, key: str, message: Message, **fields):
+		"""
+		:param level: one of the sink levels
+		:param key: what the message is about, the rate limit and the deduplication are per key
+		:param message: the text or a callable returning it
+		:param fields: structured values, also used to tell whether a message repeats
+		"""
+		# A lazy message is identified by its fields, the text is derived from them
+		identity = (level, message if isinstance(message, str) else None, tuple(sorted(fields.items())))
+		now = self._clock()
+		with self._lock:
+			state = self._keys.get(key)
+			if state is None:
+				state = self._keys[key] = _KeyState()
+
+			elapsed = now - state.emitted
+			if elapsed < self.interval or (identity == state.identity and elapsed < self.repeatInterval):
+				state.suppressed += 1
+				return
+
+			suppressed = state.suppressed
+			state.emitted = now
+			state.identity = identity
+			state.suppressed = 0
+			state.level = level
+
+		self._write(level, message, fields, suppressed)
+
+
+	def flush(self):
+		""" Write how often each key was left out since its last message, used when stopping """
+		with self._lock:
+			pending: Dict[str, Tuple[str, int]] = {key: (state.level, state.suppressed) for key, state in self._keys.items() if state.suppressed}
+			for key in pending:
+				self._keys[key].suppressed = 0
+
+		for key, (level, suppressed) in pending.items():
+			self._sinks[level](f'{key}: last message repeated {suppressed} times')
+
+
+	def _write(self, level: str, message: Message, fields: dict, suppressed: int):
+		text = message if isinstance(message, str) else str(message())
+		if fields:
+			text += ' [' + ' '.join(f'{name}={value}' for name, value in fields.items()) + ']'
+		if suppressed:
+			text += f' (repeated {suppressed} times)'
+		self._sinks[level](text)
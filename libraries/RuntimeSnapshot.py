@@ -0,0 +1,154 @@
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, TYPE_CHECKING, Tuple
+
+if TYPE_CHECKING:
+	# Only for the type hints, mmap is imported when the file is first opened
+	import mmap
+
+MAGIC = b'WITI'
+VERSION = 1
+
+# magic, version, unit count, layout, sequence, crc32 of the rest of the slot
+_HEADER = struct.Struct('<4sHHIQI')
+# presence flags
+_GLOBALS = struct.Struct('<B')
+# alarm state, pin bits, flags, last published MQTT bits, MQTT version
+_UNIT = struct.Struct('<BBBiI')
+
+# Unit flags
+AUTO_ARMED = 1
+VOICE_CONTROLLED = 2
+PINS_READ = 4
+SWITCH_ON = 8
+
+# Presence flags
+CHECKING_FOR_USER = 1
+SOMEONES_HOME = 2
+
+
+class UnitState(NamedTuple):
+	alarmState: int
+	bits: int
+	flags: int
+	mqttBits: int
+	mqttVersion: int
+
+
+class RuntimeSnapshot:
+	"""
+	Binary snapshot of the skill's runtime state, so a restart resumes where the skill was.
+
+	The file is memory mapped and holds two slots. A save writes the slot not holding the newest
+	state, with a sequence number and a crc32, so a crash in the middle of a write leaves the other
+	slot intact. A load takes the valid slot with the highest sequence. Saves that wouldn't change
+	anything are skipped, so the file is only written when the state changes.
+
+	A written slot is in the page cache straight away, so it survives the skill crashing. Only saves
+	with sync set wait for it to reach the disk as well, which is what a power cut needs.
+
+	`layout` identifies the unit set the snapshot was taken with, a snapshot of another set of units
+	or another format version is ignored.
+	"""
+
+	def __init__(self, path: Path, units: int, layout: int):
+		"""
+		:param path: the snapshot file
+		:param units: number of unit records
+		:param layout: fingerprint of the units, for example a crc32 of their names and pins
+		"""
+		self._path = path
+		self._units = units
+		self._layout = layout
+		self._slotSize = _HEADER.size + _GLOBALS.size + _UNIT.size * units
+		self._lock = threading.Lock()
+		self._mmap: Optional['mmap.mmap'] = None
+		self._sequence = 0
+		self._last: Optional[Tuple[int, tuple]] = None
+		self.writes = 0
+
+
+	def load(self) -> Optional[Tuple[int, List[UnitState]]]:
+		"""
+		:return: the presence flags and the unit states of the newest valid slot, None if there is none
+		:raises OSError: if the file can't be opened
+		"""
+		with self._lock:
+			memory = self._open()
+			newest = None
+			for slot in range(2):
+				offset = slot * self._slotSize
+				magic, version, units, layout, sequence, crc = _HEADER.unpack_from(memory, offset)
+				body = memory[offset + _HEADER.size:offset + self._slotSize]
+				if (magic, version, units, layout) != (MAGIC, VERSION, self._units, self._layout):
+					continue
+				if zlib.crc32(body, sequence & 0xFFFFFFFF) != crc:
+					continue
+				if newest is None or sequence > newest[0]:
+					newest = (sequence, body)
+
+			if newest is None:
+				return None
+
+			self._sequence, body = newest
+			presence, = _GLOBALS.unpack_from(body, 0)
+			states = [UnitState(*_UNIT.unpack_from(body, _GLOBALS.size + index * _UNIT.size)) for index in range(self._units)]
+			self._last = (presence, tuple(states))
+			return presence, states
+
+
+	def save(self, presence: int, states: Sequence[UnitState], sync: bool = False) -> bool:
+		"""
+		:param sync: wait until the snapshot is on the disk
+		:return: True if the state changed and got written
+		:raises OSError: if the file can't be opened
+		"""
+		current = (presence, tuple(states))
+		with self._lock:
+			if current == self._last:
+				return False
+
+			body = bytearray(self._slotSize - _HEADER.size)
+			_GLOBALS.pack_into(body, 0, presence)
+			for index, state in enumerate(states):
+				_UNIT.pack_into(body, _GLOBALS.size + index * _UNIT.size, *state)
+
+			memory = self._open()
+			self._sequence += 1
+			offset = (self._sequence % 2) * self._slotSize
+			memory[offset + _HEADER.size:offset + self._slotSize] = body
+			_HEADER.pack_into(memory, offset, MAGIC, VERSION, self._units, self._layout, self._sequence,
+							  zlib.crc32(body, self._sequence & 0xFFFFFFFF))
+			if sync:
+				memory.flush()
+			self._last = current
+			self.writes += 1
+			return True
+
+
+	def close(self):
+		with self._lock:
+			if self._mmap:
+				self._mmap.flush()
+				self._mmap.close()
+				self._mmap = None
+
+
+	def _open(self) -> 'mmap.mmap':
+		if self._mmap:
+			return self._mmap
+
+		import mmap
+
+		size = self._slotSize * 2
+		self._path.parent.mkdir(parents=True, exist_ok=True)
+		with open(self._path, 'a+b') as file:
+			# A file of another size was written for another set of units, it gets replaced
+			if file.seek(0, 2) != size:
+				file.truncate(0)
+				file.write(bytes(size))
+				file.flush()
+			self._mmap = mmap.mmap(file.fileno(), size)
+		return self._mmap
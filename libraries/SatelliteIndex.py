@@ -0,0 +1,101 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# (name, location, connected) of a satellite
+SatelliteEntry = Tuple[str, Any, bool]
+
+
+class SatelliteIndex:
+	"""
+	Where to speak: the satellites by name, by location and by connection state.
+
+	The index is built once from the DeviceManager and then kept up to date by the device connect and
+	disconnect events, so picking a satellite never scans the devices. The satellite to use for
+	announcements nobody asked for is worked out whenever the index changes:
+	- the preferred satellite (the first one found, as before) while it's connected
+	- otherwise the first connected satellite, preferring one in the same location as the preferred one
+	- otherwise the preferred satellite anyway, or None to speak on the default device
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._satellites: Dict[str, SatelliteEntry] = dict()
+		# location -> names of the connected satellites there, in discovery order
+		self._connected: Dict[Any, Dict[str, None]] = dict()
+		self._preferred: Optional[str] = None
+		self._best: Optional[str] = None
+
+
+	def rebuild(self, satellites: Iterable[SatelliteEntry]):
+		""" Replace the index, the first satellite becomes the preferred one """
+		with self._lock:
+			self._satellites = dict()
+			self._connected = dict()
+			self._preferred = None
+			for name, location, connected in satellites:
+				self._add(name, location, connected)
+			self._pickBest()
+
+
+	def update(self, name: str, connected: bool, location: Any = None) -> bool:
+		"""
+		A satellite connected or disconnected
+		:param location: only needed for a satellite the index doesn't know yet
+		:return: False if the satellite is unknown and no location was given, so the index should be rebuilt
+		"""
+		with self._lock:
+			entry = self._satellites.get(name)
+			if entry is None and location is None:
+				return False
+
+			if entry is not None:
+				self._connected.get(entry[1], dict()).pop(name, None)
+				location = entry[1] if location is None else location
+			self._add(name, location, connected)
+			self._pickBest()
+			return True
+
+
+	def __contains__(self, name: str) -> bool:
+		return name in self._satellites
+
+
+	@property
+	def best(self) -> Optional[str]:
+		""" The satellite for proactive announcements """
+		return self._best
+
+
+	def connectedIn(self, location: Any) -> List[str]:
+		return list(self._connected.get(location, ()))
+
+
+	def _add(self, name: str, location: Any, connected: bool):
+		self._satellites[name] = (name, location, connected)
+		if self._preferred is None:
+			self._preferred = name
+		if connected:
+			self._connected.setdefault(location, dict())[name] = None
+
+
+	def _pickBest(self):
+		preferred = self._satellites.get(self._preferred)
+		if preferred is None:
+			self._best = None
+			return
+
+		if preferred[2]:
+			self._best = preferred[0]
+			return
+
+		sameLocation = self._connected.get(preferred[1])
+		if sameLocation:
+			self._best = next(iter(sameLocation))
+			return
+
+		for names in self._connected.values():
+			if names:
+				self._best = next(iter(names))
+				return
+
+		self._best = preferred[0]
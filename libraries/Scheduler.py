@@ -0,0 +1,321 @@
+import heapq
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class Scheduler(ABC):
+	"""
+	Where the skill's timers run and which clock they use.
+
+	ThreadManagerScheduler hands everything to Alice's ThreadManager and uses the real clock.
+	VirtualScheduler keeps its own clock and runs the queued calls in timestamp order as fast as the
+	code allows, so scenarios spanning minutes of timers can be replayed in milliseconds.
+
+	Loops like the stateMonitor run as a PeriodicTask from startPeriodic instead of scheduling
+	themselves again on every run.
+	"""
+
+	# Background work may run on other threads. Without it the skill keeps everything on the calling thread
+	threaded = True
+
+	@abstractmethod
+	def now(self) -> float:
+		""" Monotonic seconds """
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def doLater(self, interval: float, func: Callable, args: list = None, kwargs: dict = None):
+		""" Call func(*args, **kwargs) interval seconds from now """
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def newThread(self, name: str, target: Callable, args: list = None, kwargs: dict = None):
+		""" Run target in the background """
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def startPeriodic(self, name: str, func: Callable[[], float], initialDelay: float,
+					  onError: Optional[Callable[[Exception], None]] = None) -> 'PeriodicTask':
+		"""
+		Run func over and over until the task is stopped
+		:param name: name of the task, and of its thread if it gets one
+		:param func: returns the seconds until its next run
+		:param initialDelay: seconds until the first run
+		:param onError: called with the exception when a run raises, the loop carries on with the last interval
+		"""
+		raise NotImplementedError
+
+
+class PeriodicTask(ABC):
+	"""
+	A function run over and over on a scheduler, each run returns the delay until the next one.
+
+	The next run is planned from when the last one was due rather than from when it finished, so the
+	time a run takes doesn't add up into drift. A task that fell behind runs once straight away
+	instead of catching up with a burst of runs. An exception only fails its own run.
+	"""
+
+	def __init__(self, func: Callable[[], float], initialDelay: float, now: float, onError: Optional[Callable[[Exception], None]]):
+		self._func = func
+		self._onError = onError
+		self._interval = initialDelay
+		self._stopped = False
+		# When the current run was, or the next run is, due
+		self.due = now + initialDelay
+		self.runs = 0
+		self.errors = 0
+
+
+	@property
+	def running(self) -> bool:
+		return not self._stopped
+
+
+	@abstractmethod
+	def wake(self, delay: float):
+		""" Run again within delay seconds, if the next run isn't due before that anyway """
+		raise NotImplementedError
+
+
+	@abstractmethod
+	def stop(self, timeout: float = 2.0):
+		""" No more runs. Waits up to timeout for a run in progress to finish """
+		raise NotImplementedError
+
+
+	def _runOnce(self, planned: float, now: Callable[[], float]) -> float:
+		""" One run, returns when the next one is due """
+		try:
+			self._interval = self._func()
+		except Exception as e:
+			self.errors += 1
+			if self._onError:
+				try:
+					self._onError(e)
+				except Exception:
+					pass
+		self.runs += 1
+		return max(planned + self._interval, now())
+
+
+class _ThreadedPeriodicTask(PeriodicTask):
+	""" A task on its own long lived daemon thread, sleeping until the next run is due or it gets woken """
+
+	def __init__(self, name: str, func: Callable[[], float], initialDelay: float, onError: Optional[Callable[[Exception], None]]):
+		super().__init__(func, initialDelay, time.monotonic(), onError)
+		self._condition = threading.Condition()
+		self._woken: Optional[float] = None
+		self._thread = threading.Thread(name=name, target=self._loop, daemon=True)
+		self._thread.start()
+
+
+	def wake(self, delay: float):
+		with self._condition:
+			target = time.monotonic() + delay
+			self._woken = target if self._woken is None else min(self._woken, target)
+			if target < self.due:
+				self.due = target
+				self._condition.notify()
+
+
+	def stop(self, timeout: float = 2.0):
+		with self._condition:
+			self._stopped = True
+			self._condition.notify()
+		if self._thread is not threading.current_thread():
+			self._thread.join(timeout)
+
+
+	def _loop(self):
+		while True:
+			with self._condition:
+				while not self._stopped:
+					remaining = self.due - time.monotonic()
+					if remaining <= 0:
+						break
+					self._condition.wait(remaining)
+				if self._stopped:
+					return
+				planned = self.due
+				self._woken = None
+
+			nextDue = self._runOnce(planned, time.monotonic)
+
+			with self._condition:
+				# A wake during the run still counts
+				if self._woken is not None:
+					nextDue = min(nextDue, self._woken)
+					self._woken = None
+				self.due = nextDue
+
+
+class ThreadManagerScheduler(Scheduler):
+	""" Alice's ThreadManager on the real clock """
+
+	def __init__(self, owner: Any):
+		"""
+		:param owner: the skill, its ThreadManager is looked up on every call as it's only available once the skill is loaded
+		"""
+		self._owner = owner
+
+
+	def now(self) -> float:
+		return time.monotonic()
+
+
+	def doLater(self, interval: float, func: Callable, args: list = None, kwargs: dict = None):
+		self._owner.ThreadManager.doLater(interval=interval, func=func, args=args, kwargs=kwargs)
+
+
+	def newThread(self, name: str, target: Callable, args: list = None, kwargs: dict = None):
+		self._owner.ThreadManager.newThread(name=name, target=target, args=args, kwargs=kwargs)
+
+
+	def startPeriodic(self, name: str, func: Callable[[], float], initialDelay: float,
+					  onError: Optional[Callable[[Exception], None]] = None) -> PeriodicTask:
+		return _ThreadedPeriodicTask(name, func, initialDelay, onError)
+
+
+class _VirtualPeriodicTask(PeriodicTask):
+	""" A task on a VirtualScheduler, every run queues the next one """
+
+	def __init__(self, scheduler: 'VirtualScheduler', func: Callable[[], float], initialDelay: float,
+				 onError: Optional[Callable[[Exception], None]]):
+		super().__init__(func, initialDelay, scheduler.now(), onError)
+		self._scheduler = scheduler
+		# Queued runs carry the token they were queued with, a wake or stop makes the older ones stale
+		self._token = 0
+		self._queue(initialDelay)
+
+
+	def wake(self, delay: float):
+		target = self._scheduler.now() + delay
+		if not self._stopped and target < self.due:
+			self.due = target
+			self._queue(delay)
+
+
+	def stop(self, timeout: float = 2.0):
+		self._stopped = True
+		self._token += 1
+
+
+	def _queue(self, delay: float):
+		self._token += 1
+		self._scheduler.doLater(interval=delay, func=self._run, args=[self._token])
+
+
+	def _run(self, token: int):
+		if self._stopped or token != self._token:
+			return
+		self.due = self._runOnce(self.due, self._scheduler.now)
+		self._queue(self.due - self._scheduler.now())
+
+
+class VirtualScheduler(Scheduler):
+	"""
+	Scheduler on a simulated clock.
+
+	doLater only queues the call. advance() moves the clock forward and runs every call that becomes
+	due on the way, in timestamp order and on the calling thread, including the calls those schedule
+	themselves. Calls due at the same time run in the order they were scheduled. newThread runs the
+	target straight away, so a run is fully deterministic.
+	"""
+
+	threaded = False
+
+	def __init__(self, start: float = 0.0, onAdvance: Optional[Callable[[float], Any]] = None):
+		"""
+		:param start: the clock's start value
+		:param onAdvance: called with the new time before each call runs, for example a
+			SimulatedGpioBackend.advanceTo so pin waveforms play back on the same clock
+		"""
+		self._now = start
+		self._onAdvance = onAdvance
+		self._queue: List[Tuple[float, int, Callable, tuple, dict]] = list()
+		self._sequence = 0
+		self._lock = threading.Lock()
+		self.ran = 0
+
+
+	def now(self) -> float:
+		return self._now
+
+
+	def doLater(self, interval: float, func: Callable, args: list = None, kwargs: dict = None):
+		with self._lock:
+			self._sequence += 1
+			heapq.heappush(self._queue, (self._now + max(0.0, interval), self._sequence, func, tuple(args or ()), kwargs or dict()))
+
+
+	def newThread(self, name: str, target: Callable, args: list = None, kwargs: dict = None):
+		target(*(args or ()), **(kwargs or dict()))
+
+
+	def startPeriodic(self, name: str, func: Callable[[], float], initialDelay: float,
+					  onError: Optional[Callable[[Exception], None]] = None) -> PeriodicTask:
+		return _VirtualPeriodicTask(self, func, initialDelay, onError)
+
+
+	@property
+	def pending(self) -> int:
+		return len(self._queue)
+
+
+	@property
+	def nextDue(self) -> Optional[float]:
+		""" When the next queued call is due, None if nothing is queued """
+		with self._lock:
+			return self._queue[0][0] if self._queue else None
+
+
+	def advance(self, seconds: float, limit: int = 100000) -> int:
+		""" Move the clock forward by seconds. :return: number of calls run """
+		return self.advanceTo(self._now + seconds, limit)
+
+
+	def advanceTo(self, timestamp: float, limit: int = 100000) -> int:
+		"""
+		Move the clock to timestamp, running every call due until then
+		:param limit: stop after this many calls, against loops scheduling themselves with no delay
+		:return: number of calls run
+		"""
+		ran = 0
+		while ran < limit:
+			with self._lock:
+				if not self._queue or self._queue[0][0] > timestamp:
+					break
+				due, _, func, args, kwargs = heapq.heappop(self._queue)
+				self._now = max(self._now, due)
+			if self._onAdvance:
+				self._onAdvance(self._now)
+			func(*args, **kwargs)
+			ran += 1
+
+		self._now = max(self._now, timestamp)
+		if self._onAdvance:
+			self._onAdvance(self._now)
+		self.ran += ran
+		return ran
+
+
+	def runUntilIdle(self, horizon: float = 3600.0, exclude: Tuple[str, ...] = (), limit: int = 100000) -> int:
+		"""
+		Run the queued calls until nothing but the excluded ones is due within horizon seconds. The
+		excluded calls, usually loops that always reschedule themselves, still run when their time comes
+		:return: number of calls run
+		"""
+		end = self._now + horizon
+		ran = 0
+		while ran < limit:
+			with self._lock:
+				due = min((entry[0] for entry in self._queue if entry[2].__name__ not in exclude), default=None)
+			if due is None or due > end:
+				break
+			ran += self.advanceTo(due, limit - ran)
+		return ran
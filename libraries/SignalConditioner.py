@@ -0,0 +1,138 @@
+from typing import List, Sequence
+
+OFF = 'off'
+MAJORITY = 'majority'
+WINDOW = 'window'
+
+
+class SignalConditioner:
+	"""
+	Filters the raw input pin levels before they reach the alarm logic, so a single noisy read
+	doesn't start an arming dialog or send a trigger notification.
+
+	- majority: every pass adds one read of each pin to its ring buffer of the last `samples` passes, a
+	  pin changes when most of them agree on the new level. The vote is across passes rather than
+	  across back to back reads, which would see the same noise
+	- window: a pin changes once the new level was seen for at least `window` seconds
+	- off: the raw levels are passed through
+
+	While a change waits for confirmation `pending` is True, so the caller can come back after `window`
+	seconds for the next sample instead of waiting for its next tick.
+
+	In majority mode each pin has a fixed size ring buffer of its last samples plus a running count of
+	high samples, in window mode just the candidate level and when it was first seen. Either way a pass
+	reads each pin once and costs the same however long the skill runs. The price is latency, a change
+	goes through a pass or a window later than without conditioning.
+	"""
+
+	def __init__(self, pins: int):
+		"""
+		:param pins: number of input pins, levels are always passed in the same order
+		"""
+		self._pins = pins
+		self.mode = OFF
+		self.samples = 1
+		self.window = 0.0
+		self._ring: List[int] = list()
+		self._highs: List[int] = list()
+		self._position = 0
+		self._confirmed: List[int] = list()
+		self._candidates: List[int] = list()
+		self._since: List[float] = list()
+		self._primed = False
+
+
+	def configure(self, mode: str, samples: int, window: float):
+		"""
+		:param mode: off, majority or window
+		:param samples: passes the majority is taken over, an odd number avoids ties
+		:param window: seconds a new level has to hold in window mode, and the spacing of the samples
+			of a pending change in majority mode
+		"""
+		mode = mode if mode in (MAJORITY, WINDOW) else OFF
+		samples = max(1, samples) if mode == MAJORITY else 1
+		window = max(0.0, window)
+		if (mode, samples, window) == (self.mode, self.samples, self.window) and self._primed:
+			# Any other setting was changed, keep the buffers so the next pass isn't treated as the first
+			return
+
+		self.mode = mode
+		self.samples = samples
+		self.window = window
+		self._ring = [0] * (self._pins * self.samples)
+		self._highs = [0] * self._pins
+		self._position = 0
+		self._candidates = [0] * self._pins
+		self._since = [0.0] * self._pins
+		self._primed = False
+
+
+	@property
+	def pending(self) -> bool:
+		""" The newest level of a pin differs from its confirmed one, so a change waits for confirmation """
+		return self.mode != OFF and self._candidates != self._confirmed
+
+
+	def update(self, levels: Sequence[int], now: float) -> List[int]:
+		"""
+		:param levels: one read of every pin
+		:param now: monotonic seconds, used by the window mode
+		:return: the confirmed level of every pin
+		"""
+		if self.mode == OFF:
+			return list(levels)
+
+		if not self._primed:
+			# The first levels are the start up state, there is nothing to confirm them against
+			self._prime(levels, now)
+
+		if self.mode == MAJORITY:
+			return self._vote(levels)
+		return self._debounce(levels, now)
+
+
+	def _prime(self, levels: Sequence[int], now: float):
+		self._primed = True
+		self._confirmed = [1 if level else 0 for level in levels]
+		self._candidates = list(self._confirmed)
+		self._since = [now] * self._pins
+		for pin, level in enumerate(self._confirmed):
+			for slot in range(self.samples):
+				self._ring[pin * self.samples + slot] = level
+			self._highs[pin] = level * self.samples
+
+
+	def _vote(self, levels: Sequence[int]) -> List[int]:
+		ring = self._ring
+		highs = self._highs
+		candidates = self._candidates
+		samples = self.samples
+		position = self._position
+		for pin, level in enumerate(levels):
+			level = 1 if level else 0
+			index = pin * samples + position
+			highs[pin] += level - ring[index]
+			ring[index] = level
+			candidates[pin] = level
+		self._position = (position + 1) % samples
+
+		confirmed = self._confirmed
+		for pin, high in enumerate(highs):
+			if high * 2 > samples:
+				confirmed[pin] = 1
+			elif high * 2 < samples:
+				confirmed[pin] = 0
+		return list(confirmed)
+
+
+	def _debounce(self, levels: Sequence[int], now: float) -> List[int]:
+		confirmed = self._confirmed
+		candidates = self._candidates
+		for pin, level in enumerate(levels):
+			level = 1 if level else 0
+			if level != candidates[pin]:
+				candidates[pin] = level
+				self._since[pin] = now
+			if level != confirmed[pin] and now - self._since[pin] >= self.window:
+				confirmed[pin] = level
+		return list(confirmed)
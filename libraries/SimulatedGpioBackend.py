@@ -0,0 +1,148 @@
+import heapq
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from skills.Witi.libraries.GpioBackend import EdgeCallback, GpioBackend
+
+
+class SimulatedGpioBackend(GpioBackend):
+	"""
+	Pure python pins for running Witi away from a Pi.
+
+	Inputs are driven with setPin() or by scripting waveforms that play back against a simulated
+	clock with advance(). Edge callbacks fire synchronously on the thread changing the pin, so runs
+	are deterministic and go as fast as the code allows. An output can be linked to an input to
+	mimic the WITI unit, e.g. the switch pin driving the alarm state pin.
+	"""
+
+	def __init__(self):
+		self._levels: Dict[int, int] = dict()
+		self._inputs: set = set()
+		self._outputs: set = set()
+		self._links: Dict[int, int] = dict()
+		self._callbacks: Dict[int, Tuple[EdgeCallback, float]] = dict()
+		self._lastEdge: Dict[int, float] = dict()
+		self._events: List[Tuple[float, int, int, int]] = list()
+		self._sequence = 0
+		self._now = 0.0
+		self._lock = threading.RLock()
+		self.reads = 0
+		self.writes = 0
+
+
+	@property
+	def now(self) -> float:
+		""" Simulated seconds since the backend was created """
+		return self._now
+
+
+	def setupInput(self, pin: int):
+		self._inputs.add(pin)
+		self._levels.setdefault(pin, 0)
+
+
+	def setupOutput(self, pin: int):
+		self._outputs.add(pin)
+		self._levels.setdefault(pin, 0)
+
+
+	def input(self, pin: int) -> int:
+		self.reads += 1
+		return self._levels.get(pin, 0)
+
+
+	def inputs(self, pins: Sequence[int]) -> List[int]:
+		self.reads += len(pins)
+		levels = self._levels
+		return [levels.get(pin, 0) for pin in pins]
+
+
+	def output(self, pin: int, value: bool):
+		self.writes += 1
+		self._levels[pin] = int(bool(value))
+		if pin in self._links:
+			self.setPin(self._links[pin], value)
+
+
+	def addEdgeCallback(self, pin: int, callback: EdgeCallback, bounceTime: int):
+		if pin not in self._inputs:
+			raise RuntimeError(f'Pin {pin} is not set up as an input')
+		self._callbacks[pin] = (callback, bounceTime / 1000)
+
+
+	def removeEdgeCallback(self, pin: int):
+		self._callbacks.pop(pin, None)
+
+
+	def cleanup(self):
+		self._callbacks = dict()
+
+
+	def link(self, outputPin: int, inputPin: int):
+		""" Mirror every write on outputPin to inputPin """
+		self._links[outputPin] = inputPin
+
+
+	def setPin(self, pin: int, value: int):
+		""" Drive an input pin, firing its edge callback if the level changed """
+		level = 1 if value else 0
+		with self._lock:
+			if self._levels.get(pin, 0) == level:
+				return
+			self._levels[pin] = level
+
+			if pin not in self._callbacks:
+				return
+			callback, bounceTime = self._callbacks[pin]
+			last = self._lastEdge.get(pin)
+			if last is not None and self._now - last < bounceTime:
+				return
+			self._lastEdge[pin] = self._now
+
+		callback(pin)
+
+
+	def schedule(self, pin: int, waveform: Iterable[Tuple[float, bool]], start: Optional[float] = None):
+		"""
+		Queue a waveform for a pin
+		:param waveform: (seconds after start, level) pairs
+		:param start: simulated time the waveform starts at, defaults to now
+		"""
+		start = self._now if start is None else start
+		with self._lock:
+			for offset, value in waveform:
+				self._sequence += 1
+				heapq.heappush(self._events, (start + offset, self._sequence, pin, int(bool(value))))
+
+
+	def pulse(self, pin: int, width: float, at: float = 0):
+		""" Schedule a single high pulse of width seconds, at seconds from now """
+		self.schedule(pin, ((at, True), (at + width, False)))
+
+
+	def advance(self, seconds: float) -> int:
+		"""
+		Move the simulated clock forward, applying every scheduled level change on the way
+		:return: number of level changes applied
+		"""
+		return self.advanceTo(self._now + seconds)
+
+
+	def advanceTo(self, timestamp: float) -> int:
+		applied = 0
+		while True:
+			with self._lock:
+				if not self._events or self._events[0][0] > timestamp:
+					break
+				at, _, pin, value = heapq.heappop(self._events)
+				self._now = max(self._now, at)
+			self.setPin(pin, value)
+			applied += 1
+
+		self._now = max(self._now, timestamp)
+		return applied
+
+
+	@property
+	def pendingEvents(self) -> int:
+		return len(self._events)
@@ -0,0 +1,201 @@
+import json
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, List, NamedTuple, Optional, Union
+
+
+class TelegramMessage(NamedTuple):
+	chatId: str
+	message: str
+	# Trigger and disarm messages, these are never dropped to make room
+	critical: bool = False
+
+
+class TelegramQueue:
+	"""
+	Bounded background delivery queue for Telegram notifications.
+
+	- Callers only enqueue, the delivery happens on a single worker thread
+	- Failed sends are retried with an exponential backoff
+	- Messages that could not be delivered are written to disk and retried on the next start
+	- When full the oldest message that isn't critical makes room. Critical messages are kept even
+	  past the limit, with an error logged for every one that doesn't fit
+	"""
+
+	def __init__(self, sender: Callable[[str, str], None], storage: Path, maxSize: int = 50, maxRetries: int = 6,
+				 baseDelay: float = 1.0, maxDelay: float = 300.0, logger: Optional[Callable[[str], None]] = None,
+				 errorLogger: Optional[Callable[[str], None]] = None):
+		"""
+		:param sender: callable doing the actual delivery, sender(chatId, message). Raises on failure
+		:param storage: json file used to keep undelivered messages across restarts
+		:param maxSize: maximum number of pending messages, the oldest one that isn't critical gets dropped when full
+		:param maxRetries: attempts per message before it is parked on disk
+		:param baseDelay: seconds to wait after the first failure, doubled on every retry
+		:param maxDelay: upper limit of the retry delay
+		:param logger: optional callable for warnings
+		:param errorLogger: optional callable for errors, the logger if not given
+		"""
+		self._sender = sender
+		self._storage = storage
+		self._maxRetries = maxRetries
+		self._baseDelay = baseDelay
+		self._maxDelay = maxDelay
+		self._logger = logger
+		self._errorLogger = errorLogger or logger
+		self._maxSize = maxSize
+		self._queue: Deque[TelegramMessage] = deque()
+		self._ready = threading.Condition()
+		self._stopEvent = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		self._current: Optional[TelegramMessage] = None
+		self._parked: List[TelegramMessage] = list()
+		self._journaled = False
+		self.dropped = 0
+
+
+	def start(self):
+		""" Reload undelivered messages from disk and start the worker thread """
+		if self._thread and self._thread.is_alive():
+			return
+
+		for item in self._load():
+			self.enqueue(*item)
+
+		self._stopEvent.clear()
+		self._thread = threading.Thread(name='WitiTelegramQueue', target=self._run, daemon=True)
+		self._thread.start()
+
+
+	def stop(self, timeout: float = 2.0):
+		""" Stop the worker and write anything still pending to disk """
+		self._stopEvent.set()
+		if self._thread:
+			# Wake the worker up instead of waiting for its poll to time out
+			with self._ready:
+				self._ready.notify()
+			self._thread.join(timeout)
+			self._thread = None
+		self._persist()
+
+
+	def enqueue(self, chatId: str, message: str, critical: bool = False) -> bool:
+		"""
+		Queue a message for delivery. Never blocks.
+		:param critical: a trigger or disarm message, never dropped to make room
+		:return: False if an older message had to be dropped to make room
+		"""
+		with self._ready:
+			self._queue.append(TelegramMessage(chatId, message, critical))
+			dropped = self._trim(self._queue)
+			self._ready.notify()
+
+		for item in dropped:
+			self._warn(f'Telegram queue is full, dropping the message "{item.message}"')
+		if critical and len(self._queue) > self._maxSize:
+			self._error(f'Telegram queue is full of trigger and disarm messages, keeping "{message}" anyway ({len(self._queue)} pending)')
+		return not dropped
+
+
+	@property
+	def pending(self) -> int:
+		return len(self._queue) + (1 if self._current else 0)
+
+
+	def _run(self):
+		while not self._stopEvent.is_set():
+			with self._ready:
+				if not self._queue:
+					self._ready.wait(0.5)
+				if not self._queue or self._stopEvent.is_set():
+					continue
+				self._current = self._queue.popleft()
+
+			if self._deliver(self._current.chatId, self._current.message):
+				self._current = None
+				if self._parked:
+					# The api is reachable again, give the parked messages another go
+					parked, self._parked = self._parked, list()
+					for item in parked:
+						self.enqueue(*item)
+				if self._journaled:
+					# Keep the file in step so a restart doesn't send this message twice
+					self._persist()
+			elif not self._stopEvent.is_set():
+				self._parked.append(self._current)
+				for item in self._trim(self._parked):
+					self._warn(f'Too many undelivered Telegram messages, dropping the message "{item.message}"')
+				self._current = None
+				self._persist()
+
+
+	def _deliver(self, chatId: str, message: str) -> bool:
+		for attempt in range(self._maxRetries):
+			try:
+				self._sender(chatId, message)
+				return True
+			except Exception as e:
+				delay = min(self._baseDelay * 2 ** attempt, self._maxDelay)
+				self._warn(f'Sending Telegram message failed ({e}), retrying in {delay} seconds')
+				if attempt == 0:
+					# Make sure a crash during the backoff doesn't lose the message
+					self._persist()
+				if self._stopEvent.wait(delay):
+					return False
+		self._warn(f'Giving up on Telegram message after {self._maxRetries} attempts, keeping it for later')
+		return False
+
+
+	def _trim(self, items: Union[Deque[TelegramMessage], List[TelegramMessage]]) -> List[TelegramMessage]:
+		""" Drop the oldest messages that aren't critical until the limit is met, or none are left """
+		dropped = list()
+		while len(items) > self._maxSize:
+			item = next((item for item in items if not item.critical), None)
+			if item is None:
+				break
+			items.remove(item)
+			dropped.append(item)
+		self.dropped += len(dropped)
+		return dropped
+
+
+	def _load(self) -> List[TelegramMessage]:
+		if not self._storage.exists():
+			return list()
+		try:
+			items = [TelegramMessage(item['chatId'], item['message'], bool(item.get('critical', False))) for item in json.loads(self._storage.read_text())]
+			self._storage.unlink()
+			return items
+		except (ValueError, KeyError, TypeError, OSError) as e:
+			self._warn(f'Could not read undelivered Telegram messages: {e}')
+			return list()
+
+
+	def _persist(self):
+		items = list(self._parked)
+		if self._current:
+			items.append(self._current)
+		with self._ready:
+			items.extend(self._queue)
+
+		try:
+			self._journaled = bool(items)
+			if not items:
+				if self._storage.exists():
+					self._storage.unlink()
+				return
+			tmp = self._storage.with_suffix('.tmp')
+			tmp.write_text(json.dumps([item._asdict() for item in items]))
+			tmp.replace(self._storage)
+		except OSError as e:
+			self._warn(f'Could not store undelivered Telegram messages: {e}')
+
+
+	def _warn(self, message: str):
+		if self._logger:
+			self._logger(message)
+
+
+	def _error(self, message: str):
+		if self._errorLogger:
+			self._errorLogger(message)
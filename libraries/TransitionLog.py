@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+# Seconds in a day, used for the retention
+DAY = 86400
+
+
+class TransitionLog:
+	"""
+	Buffered history of the input pin changes.
+
+	Every change is kept in memory with a wall clock and a monotonic timestamp, the unit it happened on
+	and that unit's alarm state at the moment. The buffer is written as one batched insert, so the SD card isn't hit on every
+	edge. Rows older than the retention are pruned at most once a day, and the table is capped at
+	maxRows. Queries use the (pin, timestamp) index instead of scanning the table.
+	"""
+
+	COLUMNS = ('timestamp', 'monotonic', 'pin', 'value', 'alarmState', 'unit')
+
+
+	def __init__(self, executeMany: Callable[[str, list], None], fetch: Callable[[str, dict], list],
+				 batchSize: int = 50, retentionDays: int = 30, maxRows: int = 50000):
+		"""
+		:param executeMany: runs a statement for many rows in one transaction, ':__table__' is the history table
+		:param fetch: runs a query with named values and returns all rows as dicts
+		:param batchSize: number of buffered transitions that forces a write
+		:param retentionDays: days to keep transitions for
+		:param maxRows: the oldest rows are removed above this many rows
+		"""
+		self._executeMany = executeMany
+		self._fetch = fetch
+		self._batchSize = batchSize
+		self.retentionDays = retentionDays
+		self._maxRows = maxRows
+		self._buffer: List[Tuple[float, float, str, int, str, str]] = list()
+		self._lock = threading.Lock()
+		self._lastPrune = 0.0
+
+
+	@property
+	def pending(self) -> int:
+		return len(self._buffer)
+
+
+	def record(self, pin: str, value: int, alarmState: str, unit: str = '') -> bool:
+		"""
+		Buffer a pin change
+		:param unit: name of the WITI unit the pin belongs to
+		:return: True if the buffer is full and should be flushed
+		"""
+		with self._lock:
+			self._buffer.append((time.time(), time.monotonic(), pin, value, alarmState, unit))
+			return len(self._buffer) >= self._batchSize
+
+
+	def flush(self):
+		""" Write the buffered transitions in one batch and prune old rows once a day """
+		with self._lock:
+			rows, self._buffer = self._buffer, list()
+
+		if rows:
+			self._executeMany(f'INSERT INTO :__table__ ({", ".join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+		if time.time() - self._lastPrune > DAY:
+			self.prune()
+
+
+	def prune(self):
+		""" Apply the retention and the row cap """
+		self._lastPrune = time.time()
+		self._executeMany('DELETE FROM :__table__ WHERE timestamp < ?', [(self._lastPrune - self.retentionDays * DAY,)])
+		self._executeMany(
+			'DELETE FROM :__table__ WHERE id <= (SELECT id FROM :__table__ ORDER BY id DESC LIMIT 1 OFFSET ?)',
+			[(self._maxRows,)]
+		)
+
+
+	def count(self, pin: str, value: int, since: float) -> Tuple[int, Optional[float]]:
+		"""
+		:param pin: pin name, for example triggeredState
+		:param value: pin level to count
+		:param since: epoch seconds
+		:return: how often the pin went to that level since then, and when it last did
+		"""
+		self.flush()
+		rows = self._fetch(
+			'SELECT COUNT(*) AS total, MAX(timestamp) AS latest FROM :__table__ WHERE pin = :pin AND timestamp >= :since AND value = :value',
+			{'pin': pin, 'since': since, 'value': value}
+		)
+		if not rows:
+			return 0, None
+		return rows[0]['total'], rows[0]['latest']
+
+
+	def transitions(self, since: float, pin: str = None) -> List[dict]:
+		""" All transitions since a time, optionally for one pin only, oldest first """
+		self.flush()
+		if pin:
+			return self._fetch(
+				'SELECT * FROM :__table__ WHERE pin = :pin AND timestamp >= :since ORDER BY timestamp',
+				{'pin': pin, 'since': since}
+			)
+		return self._fetch('SELECT * FROM :__table__ WHERE timestamp >= :since ORDER BY timestamp', {'since': since})
@@ -0,0 +1,80 @@
+from typing import Any, Callable, NamedTuple
+
+
+class WitiConfig(NamedTuple):
+	"""
+	Typed, immutable snapshot of the skill settings.
+
+	Loaded once and swapped as a whole when a setting changes, so the monitor loop reads plain
+	attributes instead of going through getConfig on every tick. Values are coerced to the declared
+	type, the voice commands store booleans as "true" / "false" strings.
+	"""
+
+	triggeredMessage: str = 'Your Alarm has just been triggered'
+	enabledNotification: str = 'Alarm has just been turn on. Enjoy your trip'
+	disabledNotification: str = 'Alarm has just been turn off. Welcome Home'
+	turnOnAutoArming: bool = True
+	forcePinCode: bool = False
+	pinCode: int = 2020
+	activateSoundOnTrigger: bool = False
+	enableMQTTmessages: bool = True
+	mqttPublishMode: str = 'full'
+	mqttCompactStatus: bool = False
+	firstStartUp: bool = False
+	secondsBetweenUpdates: int = 10
+	useEdgeDetection: bool = True
+	secondsBetweenConsistencySweeps: int = 60
+	adaptiveScheduling: bool = True
+	minSecondsBetweenUpdates: int = 2
+	maxSecondsBetweenUpdates: int = 60
+	secondsAfterReturningHome: int = 60
+	useHomeAssistantPersonDetection: bool = False
+	homeAssistantBooleanName: str = 'input_boolean.persons_home'
+	historyRetentionDays: int = 30
+	inputConditioning: str = 'off'
+	conditioningSamples: int = 3
+	conditioningWindowMs: int = 200
+	metricsPublishInterval: int = 0
+	prometheusPort: int = 0
+	profileIntentHandlers: bool = False
+	slowIntentHandlerMs: int = 250
+	intentHandlerProfilesKept: int = 0
+	throttleNotifications: bool = True
+	notificationPolicy: str = ''
+
+
+	@classmethod
+	def load(cls, getter: Callable[[str], Any]) -> 'WitiConfig':
+		"""
+		:param getter: usually the skill's getConfig
+		:return: a new snapshot, settings the getter doesn't know keep their default
+		"""
+		values = dict()
+		for field in cls._fields:
+			value = getter(field)
+			if value is not None:
+				values[field] = cls.coerce(field, value)
+		return cls(**values)
+
+
+	@classmethod
+	def coerce(cls, field: str, value: Any) -> Any:
+		""" Convert a raw config value to the type declared for that setting """
+		fieldType = cls.__annotations__[field]
+		if fieldType is bool:
+			if isinstance(value, str):
+				return value.strip().lower() in ('true', '1', 'yes', 'on')
+			return bool(value)
+		if fieldType is int:
+			try:
+				return int(value)
+			except (TypeError, ValueError):
+				return cls._field_defaults[field]
+		return fieldType(value)
+
+
+	def withValue(self, field: str, value: Any) -> 'WitiConfig':
+		""" A copy of this snapshot with one setting changed """
+		if field not in self._fields:
+			return self
+		return self._replace(**{field: self.coerce(field, value)})
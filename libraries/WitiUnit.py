@@ -0,0 +1,114 @@
+import json
+from typing import Callable, List, NamedTuple
+
+from skills.Witi.libraries.AlarmStateMachine import AlarmState
+from skills.Witi.libraries.GpioSnapshot import GpioSnapshot
+from skills.Witi.libraries.MqttStatePublisher import MqttStatePublisher
+
+
+class UnitPins(NamedTuple):
+	""" BCM pin numbers of one WITI unit """
+
+	alarm: int
+	triggered: int
+	ignition: int
+	paired: int
+	switch: int
+
+
+	@property
+	def inputs(self) -> tuple:
+		""" The input pins in GpioSnapshot.fromPins order """
+		return self.alarm, self.triggered, self.ignition, self.paired
+
+
+class WitiUnit:
+	"""
+	Pins and state of one WITI alarm.
+
+	The skill keeps one record per unit and samples the inputs of all units in one batched read per
+	tick. The first unit is the one wired to the original pins, it keeps the WitiAlarm topic and the
+	AlarmState database row so single unit installs see no change. Every other unit publishes on
+	WitiAlarm/units/<name> and stores its alarm state in the AlarmState_<name> row.
+	"""
+
+	__slots__ = ('name', 'pins', 'primary', 'telegramChatId', 'dbEvent', 'mqtt', 'offset',
+				 'snapshot', 'alarmState', 'pinsRead', 'autoArmingActive', 'voiceControlled', 'sessionId', 'switchOn')
+
+
+	def __init__(self, name: str, pins: UnitPins, publish: Callable[..., None], primary: bool = False, telegramChatId: str = ''):
+		"""
+		:param name: unit name, used in topics, database rows and messages
+		:param pins: the unit's pin map
+		:param publish: the skill's publish method
+		:param primary: the unit on the original pins
+		:param telegramChatId: chat to send this unit's messages to instead of the default one
+		"""
+		self.name = name
+		self.pins = pins
+		self.primary = primary
+		self.telegramChatId = telegramChatId
+		self.dbEvent = 'AlarmState' if primary else f'AlarmState_{name}'
+		self.mqtt = MqttStatePublisher(publish=publish, topic='WitiAlarm' if primary else f'WitiAlarm/units/{name}')
+		# Position of the unit's first input in the batched pin read
+		self.offset = 0
+		self.snapshot = GpioSnapshot.fromBits(0)
+		self.alarmState = AlarmState.DISARMED
+		self.pinsRead = False
+		self.autoArmingActive = False
+		self.voiceControlled = False
+		self.sessionId = ''
+		# Level the switch pin was last driven to
+		self.switchOn = False
+
+
+	def __repr__(self) -> str:
+		return f'WitiUnit({self.name}, {self.alarmState.name})'
+
+
+def loadUnits(primaryPins: UnitPins, additionalUnits: str, publish: Callable[..., None]) -> List[WitiUnit]:
+	"""
+	:param primaryPins: pin map of the unit on the original pins
+	:param additionalUnits: json list of the other units, for example
+		[{"name": "trailer", "alarm": 5, "triggered": 12, "ignition": 26, "paired": 24, "switch": 16, "telegramId": ""}]
+	:param publish: the skill's publish method
+	:return: the primary unit followed by the additional ones, with their offsets set
+	:raises ValueError: if the json is invalid, a name is used twice or a pin is used by two units
+	"""
+	units = [WitiUnit(name='main', pins=primaryPins, publish=publish, primary=True)]
+
+	if additionalUnits and additionalUnits.strip():
+		try:
+			definitions = json.loads(additionalUnits)
+		except json.JSONDecodeError as e:
+			raise ValueError(f'additionalUnits is not valid json: {e}')
+
+		if not isinstance(definitions, list):
+			raise ValueError('additionalUnits must be a list of units')
+
+		for definition in definitions:
+			try:
+				name = str(definition['name']).strip()
+				pins = UnitPins(**{field: int(definition[field]) for field in UnitPins._fields})
+			except (KeyError, TypeError, ValueError) as e:
+				raise ValueError(f'Unit definition {definition} is missing or has an invalid value: {e}')
+
+			if not name or '/' in name:
+				raise ValueError(f'Invalid unit name "{name}"')
+			units.append(WitiUnit(name=name, pins=pins, publish=publish, telegramChatId=str(definition.get('telegramId') or '')))
+
+	names = set()
+	usedPins = set()
+	for index, unit in enumerate(units):
+		if unit.name in names:
+			raise ValueError(f'Unit name "{unit.name}" is used twice')
+		names.add(unit.name)
+
+		for pin in unit.pins:
+			if pin in usedPins:
+				raise ValueError(f'Pin {pin} of unit "{unit.name}" is already used by another unit')
+			usedPins.add(pin)
+
+		unit.offset = index * len(unit.pins.inputs)
+
+	return units
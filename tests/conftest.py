@@ -0,0 +1,11 @@
+"""
+The skill is tested outside of Alice, on the stubs the benchmarks use
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+import aliceStubs  # noqa: E402
+
+aliceStubs.install()
@@ -0,0 +1,57 @@
+import itertools
+
+import pytest
+
+from skills.Witi.libraries.AlarmStateMachine import AUTO_ARMED, AUTO_ARMING_ENABLED, Action, AlarmState, INPUT_MASK, TRANSITIONS, VOICE_CONTROLLED, nextTransition
+from skills.Witi.libraries.GpioSnapshot import GpioSnapshot
+
+ALARM = GpioSnapshot.ALARM
+TRIGGERED = GpioSnapshot.TRIGGERED
+IGNITION = GpioSnapshot.IGNITION
+UNPAIRED = GpioSnapshot.UNPAIRED
+
+
+def test_tableCoversEveryStateAndInput():
+	assert set(TRANSITIONS) == set(AlarmState)
+	assert all(len(row) == INPUT_MASK + 1 for row in TRANSITIONS.values())
+
+
+def test_bitsOutsideTheMaskAreIgnored():
+	assert nextTransition(AlarmState.DISARMED, ALARM | 128) == nextTransition(AlarmState.DISARMED, ALARM)
+
+
+@pytest.mark.parametrize('state, inputs, expected', [
+	# Alarm pin on
+	(AlarmState.DISARMED, ALARM, (AlarmState.ARMED, ())),
+	(AlarmState.ARMED, ALARM | TRIGGERED, (AlarmState.TRIGGERED, (Action.TRIGGERED,))),
+	(AlarmState.TRIGGERED, ALARM | TRIGGERED, (AlarmState.TRIGGERED, ())),
+	(AlarmState.TRIGGERED, ALARM, (AlarmState.ARMED, (Action.TRIGGER_CLEARED,))),
+	(AlarmState.ARMED, ALARM | AUTO_ARMED, (AlarmState.ARMED, (Action.VEHICLE_RETURNED,))),
+	(AlarmState.ARMED, ALARM | AUTO_ARMED | UNPAIRED, (AlarmState.ARMED, ())),
+	(AlarmState.ARMED, ALARM | AUTO_ARMED | VOICE_CONTROLLED, (AlarmState.ARMED, ())),
+	# Alarm pin off
+	(AlarmState.ARMED, 0, (AlarmState.DISARMED, ())),
+	(AlarmState.DISARMED, IGNITION, (AlarmState.TOWING, ())),
+	(AlarmState.DISARMED, UNPAIRED | AUTO_ARMING_ENABLED, (AlarmState.ARMING_PENDING, (Action.PAIRING_LOST,))),
+	(AlarmState.ARMING_PENDING, UNPAIRED | AUTO_ARMING_ENABLED, (AlarmState.ARMING_PENDING, ())),
+	(AlarmState.DISARMED, UNPAIRED, (AlarmState.DISARMED, ())),
+	(AlarmState.DISARMED, UNPAIRED | AUTO_ARMING_ENABLED | VOICE_CONTROLLED, (AlarmState.DISARMED, ())),
+	(AlarmState.DISARMED, AUTO_ARMING_ENABLED | VOICE_CONTROLLED, (AlarmState.DISARMED, (Action.RESET_VOICE_CONTROL,))),
+	(AlarmState.DISARMED, IGNITION | VOICE_CONTROLLED, (AlarmState.TOWING, (Action.RESET_VOICE_CONTROL,)))
+])
+def test_transition(state: AlarmState, inputs: int, expected):
+	assert nextTransition(state, inputs) == expected
+
+
+@pytest.mark.parametrize('state', list(AlarmState))
+def test_towingNeverStartsArming(state: AlarmState):
+	for flags in itertools.product((0, AUTO_ARMING_ENABLED), (0, VOICE_CONTROLLED), (0, AUTO_ARMED), (0, TRIGGERED)):
+		nextState, actions = nextTransition(state, IGNITION | sum(flags))
+		assert nextState is AlarmState.TOWING
+		assert Action.PAIRING_LOST not in actions
+
+
+@pytest.mark.parametrize('state', list(AlarmState))
+def test_triggerActionOnlyOnEnteringTriggered(state: AlarmState):
+	_nextState, actions = nextTransition(state, ALARM | TRIGGERED)
+	assert (Action.TRIGGERED in actions) == (state is not AlarmState.TRIGGERED)
@@ -0,0 +1,52 @@
+import threading
+from typing import List, Tuple
+
+from skills.Witi.libraries.EventBus import AlarmEvent, Event, EventBus
+
+
+class BlockedSink:
+	""" Holds up its worker until released, so the events pile up in the queue """
+
+	def __init__(self):
+		self.release = threading.Event()
+		self.events: List[AlarmEvent] = list()
+
+
+	def __call__(self, event: Event):
+		self.release.wait(2.0)
+		self.events.append(event.type)
+
+
+def test_losslessSinksGetEveryEventWhileSharedOnesDrop():
+	drops: List[Tuple[str, AlarmEvent]] = list()
+	warnings: List[str] = list()
+	bus = EventBus(workers=1, maxSize=2, logger=warnings.append, onDrop=lambda sink, event: drops.append((sink, event.type)))
+	mqtt, telegram = BlockedSink(), BlockedSink()
+	bus.subscribe(sink='mqtt', handler=mqtt)
+	bus.subscribe(sink='telegram', handler=telegram, events=(AlarmEvent.TRIGGERED, AlarmEvent.TRIGGER_CLEARED), lossless=True)
+	bus.start()
+	try:
+		published = [AlarmEvent.TRIGGERED, AlarmEvent.TRIGGER_CLEARED] * 4
+		for eventType in published:
+			bus.publish(eventType)
+		mqtt.release.set()
+		telegram.release.set()
+		assert bus.wait()
+	finally:
+		bus.stop()
+
+	assert telegram.events == published
+	assert len(mqtt.events) < len(published)
+	assert bus.dropped == len(drops) > 0
+	assert {sink for sink, _ in drops} == {'mqtt'}
+	assert any(warning.startswith('telegram is') for warning in warnings)
+
+
+def test_handlersRunOnThePublishingThreadWithoutWorkers():
+	bus = EventBus(workers=0)
+	received: List[Event] = list()
+	bus.subscribe(sink='telegram', handler=received.append, events=(AlarmEvent.ARMED,), lossless=True)
+	bus.publish(AlarmEvent.ARMED, unit='caravan', user='alice')
+	bus.publish(AlarmEvent.DISARMED, unit='caravan')
+
+	assert [(event.type, event.unit, event.data) for event in received] == [(AlarmEvent.ARMED, 'caravan', {'user': 'alice'})]
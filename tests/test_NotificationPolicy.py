@@ -0,0 +1,115 @@
+from typing import Any, List, Tuple
+
+import pytest
+
+from skills.Witi.libraries.NotificationPolicy import DEFAULT_RULES, NotificationPolicy, NotificationRule, NotificationType, parseRules
+from skills.Witi.libraries.Scheduler import VirtualScheduler
+
+
+class Outbox:
+
+	def __init__(self):
+		self.sent: List[Tuple[Any, str, NotificationType]] = list()
+
+
+	def __call__(self, target: Any, message: str, notificationType: NotificationType):
+		self.sent.append((target, message, notificationType))
+
+
+	@property
+	def messages(self) -> List[str]:
+		return [message for _, message, _ in self.sent]
+
+
+@pytest.fixture
+def scheduler() -> VirtualScheduler:
+	return VirtualScheduler()
+
+
+@pytest.fixture
+def outbox() -> Outbox:
+	return Outbox()
+
+
+@pytest.fixture
+def policy(scheduler: VirtualScheduler, outbox: Outbox) -> NotificationPolicy:
+	return NotificationPolicy(send=outbox, doLater=scheduler.doLater, clock=scheduler.now)
+
+
+def test_priorityMessageGoesOutStraightAwayAndRepeatsBecomeADigest(scheduler: VirtualScheduler, outbox: Outbox, policy: NotificationPolicy):
+	for _ in range(3):
+		policy.notify(NotificationType.TRIGGERED, 'caravan', 'Your Alarm has just been triggered')
+		scheduler.advance(10)
+
+	assert outbox.messages == ['Your Alarm has just been triggered']
+	assert policy.pending == 2
+	assert policy.coalesced == 1
+
+	scheduler.advance(180)
+	assert outbox.sent[1] == ('caravan', 'Your Alarm has just been triggered (3 times in 20 s)', NotificationType.TRIGGERED)
+	assert policy.pending == 0
+
+
+def test_messageAfterAQuietPeriodGoesOutAgain(scheduler: VirtualScheduler, outbox: Outbox, policy: NotificationPolicy):
+	policy.notify(NotificationType.ARMED, 'caravan', 'Alarm is now active')
+	scheduler.advance(DEFAULT_RULES[NotificationType.ARMED].minInterval)
+	policy.notify(NotificationType.ARMED, 'caravan', 'Alarm is now active')
+
+	assert outbox.messages == ['Alarm is now active', 'Alarm is now active']
+
+
+def test_messageWithoutPriorityWaitsForTheWindow(scheduler: VirtualScheduler, outbox: Outbox, policy: NotificationPolicy):
+	policy.notify(NotificationType.TRIGGER_CLEARED, 'caravan', 'Alarm has now stopped making noise')
+	assert not outbox.sent
+
+	scheduler.advance(DEFAULT_RULES[NotificationType.TRIGGER_CLEARED].window)
+	assert outbox.messages == ['Alarm has now stopped making noise']
+
+
+def test_digestFromSeveralSendersListsThem(scheduler: VirtualScheduler, outbox: Outbox, policy: NotificationPolicy):
+	policy.notify(NotificationType.DISARMED, 'caravan', 'alice has just disabled the alarm', sender='alice')
+	scheduler.advance(5)
+	policy.notify(NotificationType.DISARMED, 'caravan', 'bob has just disabled the alarm', sender='bob')
+	scheduler.advance(60)
+
+	assert outbox.messages == ['alice has just disabled the alarm', 'The alarm was disabled (2 times in 5 s, by alice, bob)']
+
+
+def test_targetsAreThrottledSeparately(outbox: Outbox, policy: NotificationPolicy):
+	policy.notify(NotificationType.TRIGGERED, 'caravan', 'Your Alarm has just been triggered')
+	policy.notify(NotificationType.TRIGGERED, 'trailer', 'Your Alarm has just been triggered')
+
+	assert [target for target, _, _ in outbox.sent] == ['caravan', 'trailer']
+
+
+def test_typesWithoutARuleAreNotThrottled(scheduler: VirtualScheduler, outbox: Outbox):
+	policy = NotificationPolicy(send=outbox, doLater=scheduler.doLater, clock=scheduler.now, rules=dict())
+	for _ in range(3):
+		policy.notify(NotificationType.TRIGGERED, 'caravan', 'Your Alarm has just been triggered')
+
+	assert len(outbox.sent) == 3
+	assert scheduler.pending == 0
+
+
+def test_flushAllSendsTheCollectedDigests(outbox: Outbox, policy: NotificationPolicy):
+	policy.notify(NotificationType.TRIGGERED, 'caravan', 'Your Alarm has just been triggered')
+	policy.notify(NotificationType.TRIGGERED, 'caravan', 'Your Alarm has just been triggered')
+	policy.flushAll()
+
+	assert len(outbox.sent) == 2
+	assert policy.pending == 0
+
+
+def test_parseRulesOverridesTheDefaults():
+	rules = parseRules('{"triggered": {"minInterval": 120, "window": 600}, "triggerCleared": {"priority": true}}')
+
+	assert rules[NotificationType.TRIGGERED] == NotificationRule(120.0, 600.0, True)
+	assert rules[NotificationType.TRIGGER_CLEARED].priority
+	assert rules[NotificationType.ARMED] == DEFAULT_RULES[NotificationType.ARMED]
+	assert parseRules('  ') == DEFAULT_RULES
+
+
+@pytest.mark.parametrize('text', ['not json', '[]', '{"unknown": {}}', '{"armed": {"delay": 5}}'])
+def test_parseRulesRejectsInvalidSettings(text: str):
+	with pytest.raises(ValueError):
+		parseRules(text)
@@ -0,0 +1,100 @@
+from typing import List, Tuple
+
+from skills.Witi.libraries.Scheduler import VirtualScheduler
+
+
+def test_callsRunInTimestampOrder():
+	scheduler = VirtualScheduler()
+	ran: List[Tuple[float, str]] = list()
+	for interval, name in ((5, 'late'), (1, 'early'), (3, 'middle'), (1, 'early again')):
+		scheduler.doLater(interval=interval, func=lambda name=name: ran.append((scheduler.now(), name)))
+
+	assert scheduler.advance(4) == 3
+	assert ran == [(1, 'early'), (1, 'early again'), (3, 'middle')]
+	assert scheduler.now() == 4
+	assert scheduler.pending == 1
+	assert scheduler.nextDue == 5
+
+
+def test_callsScheduledWhileAdvancingRunInTheSameAdvance():
+	scheduler = VirtualScheduler(start=100)
+	ran: List[float] = list()
+
+	def chain(remaining: int):
+		ran.append(scheduler.now())
+		if remaining:
+			scheduler.doLater(interval=10, func=chain, args=[remaining - 1])
+
+	scheduler.doLater(interval=10, func=chain, args=[3])
+	scheduler.advance(60)
+
+	assert ran == [110, 120, 130, 140]
+	assert scheduler.pending == 0
+	assert scheduler.ran == 4
+
+
+def test_onAdvanceSeesTheClockOfEveryCall():
+	seen: List[float] = list()
+	scheduler = VirtualScheduler(onAdvance=seen.append)
+	scheduler.doLater(interval=2, func=lambda: None)
+	scheduler.advance(5)
+
+	assert seen == [2, 5]
+
+
+def test_periodicTaskFollowsTheIntervalItReturns():
+	scheduler = VirtualScheduler()
+	runs: List[float] = list()
+	intervals = iter((1, 1, 5, 5))
+
+	def tick() -> float:
+		runs.append(scheduler.now())
+		return next(intervals, 10)
+
+	task = scheduler.startPeriodic(name='monitor', func=tick, initialDelay=0)
+	scheduler.advance(20)
+	assert runs == [0, 1, 2, 7, 12]
+
+	# A wake brings the next run forward, the one queued before doesn't run twice
+	task.wake(1)
+	scheduler.advance(5)
+	assert runs[5:] == [21]
+
+	task.stop()
+	scheduler.advance(100)
+	assert runs[5:] == [21]
+	assert not task.running
+
+
+def test_periodicTaskErrorsGoToOnError():
+	scheduler = VirtualScheduler()
+	errors: List[Exception] = list()
+
+	def tick() -> float:
+		raise RuntimeError('gpio read failed')
+
+	scheduler.startPeriodic(name='monitor', func=tick, initialDelay=1, onError=errors.append)
+	scheduler.advance(1)
+
+	assert [str(error) for error in errors] == ['gpio read failed']
+
+
+def test_runUntilIdleLeavesTheExcludedLoopsQueued():
+	scheduler = VirtualScheduler()
+	ran: List[str] = list()
+
+	def loop():
+		ran.append('loop')
+		scheduler.doLater(interval=1, func=loop)
+
+	def timeout():
+		ran.append('timeout')
+
+	scheduler.doLater(interval=1, func=loop)
+	scheduler.doLater(interval=15, func=timeout)
+	scheduler.runUntilIdle(exclude=('loop',))
+
+	assert ran.count('timeout') == 1
+	assert ran.count('loop') == 15
+	assert scheduler.now() == 15
+	assert scheduler.pending == 1
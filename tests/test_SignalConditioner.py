@@ -0,0 +1,70 @@
+from skills.Witi.libraries.SignalConditioner import MAJORITY, OFF, SignalConditioner, WINDOW
+
+
+def test_offPassesTheRawLevelsThrough():
+	conditioner = SignalConditioner(pins=2)
+	conditioner.configure(OFF, samples=5, window=1.0)
+
+	assert conditioner.update([0, 1], now=0) == [0, 1]
+	assert conditioner.update([1, 0], now=0.1) == [1, 0]
+	assert not conditioner.pending
+
+
+def test_majorityFiltersASingleGlitch():
+	conditioner = SignalConditioner(pins=2)
+	conditioner.configure(MAJORITY, samples=3, window=0.2)
+
+	assert conditioner.update([0, 1], now=0) == [0, 1]
+	assert conditioner.update([1, 1], now=1) == [0, 1]
+	assert conditioner.pending
+	assert conditioner.update([0, 1], now=2) == [0, 1]
+	assert not conditioner.pending
+
+
+def test_majorityFollowsAChangeOnceMostPassesAgree():
+	conditioner = SignalConditioner(pins=2)
+	conditioner.configure(MAJORITY, samples=3, window=0.2)
+	conditioner.update([0, 1], now=0)
+
+	assert conditioner.update([1, 0], now=1) == [0, 1]
+	assert conditioner.update([1, 0], now=2) == [1, 0]
+	assert not conditioner.pending
+
+
+def test_windowWaitsForTheLevelToHold():
+	conditioner = SignalConditioner(pins=1)
+	conditioner.configure(WINDOW, samples=1, window=0.2)
+
+	assert conditioner.update([0], now=0) == [0]
+	assert conditioner.update([1], now=1) == [0]
+	assert conditioner.pending
+	assert conditioner.update([1], now=1.1) == [0]
+	assert conditioner.update([1], now=1.25) == [1]
+	assert not conditioner.pending
+
+
+def test_windowRestartsWhenTheLevelBouncesBack():
+	conditioner = SignalConditioner(pins=1)
+	conditioner.configure(WINDOW, samples=1, window=0.2)
+	conditioner.update([0], now=0)
+
+	conditioner.update([1], now=1)
+	conditioner.update([0], now=1.1)
+	assert conditioner.update([1], now=1.15) == [0]
+	assert conditioner.update([1], now=1.3) == [0]
+	assert conditioner.update([1], now=1.35) == [1]
+
+
+def test_unchangedSettingsKeepTheBuffers():
+	conditioner = SignalConditioner(pins=1)
+	conditioner.configure(MAJORITY, samples=3, window=0.2)
+	conditioner.update([0], now=0)
+	conditioner.update([1], now=1)
+
+	# Another setting changed, the pass above still counts towards the vote
+	conditioner.configure(MAJORITY, samples=3, window=0.2)
+	assert conditioner.update([1], now=2) == [1]
+
+	# New settings start over, the next levels are taken as they are
+	conditioner.configure(MAJORITY, samples=5, window=0.2)
+	assert conditioner.update([0], now=3) == [0]
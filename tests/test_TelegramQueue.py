@@ -0,0 +1,138 @@
+import json
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import pytest
+
+from skills.Witi.libraries.TelegramQueue import TelegramQueue
+
+
+class StubSender:
+	""" Fails the first `failures` sends, then delivers """
+
+	def __init__(self, failures: int = 0):
+		self.failures = failures
+		self.attempts = 0
+		self.sent: List[Tuple[str, str]] = list()
+
+
+	def __call__(self, chatId: str, message: str):
+		self.attempts += 1
+		if self.attempts <= self.failures:
+			raise ConnectionError('api unreachable')
+		self.sent.append((chatId, message))
+
+
+def waitFor(condition: Callable[[], bool], timeout: float = 2.0) -> bool:
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			return False
+		time.sleep(0.005)
+	return True
+
+
+@pytest.fixture
+def storage(tmp_path: Path) -> Path:
+	return tmp_path / 'undeliveredTelegramMessages.json'
+
+
+def createQueue(sender: StubSender, storage: Path, **kwargs) -> Tuple[TelegramQueue, List[str], List[str]]:
+	warnings: List[str] = list()
+	errors: List[str] = list()
+	telegramQueue = TelegramQueue(sender=sender, storage=storage, logger=warnings.append, errorLogger=errors.append, **kwargs)
+	return telegramQueue, warnings, errors
+
+
+def test_retriesWithExponentialBackoff(storage: Path):
+	sender = StubSender(failures=3)
+	telegramQueue, warnings, _errors = createQueue(sender, storage, baseDelay=0.01, maxDelay=0.02)
+	telegramQueue.start()
+	try:
+		telegramQueue.enqueue('42', 'Your Alarm has just been triggered')
+		assert waitFor(lambda: bool(sender.sent))
+	finally:
+		telegramQueue.stop()
+
+	assert sender.sent == [('42', 'Your Alarm has just been triggered')]
+	assert sender.attempts == 4
+	assert [warning.rsplit('retrying in ', 1)[1] for warning in warnings] == ['0.01 seconds', '0.02 seconds', '0.02 seconds']
+	# Delivered in the end, so nothing is left on disk
+	assert not storage.exists()
+
+
+def test_undeliveredMessagesAreReloadedOnTheNextStart(storage: Path):
+	sender = StubSender(failures=100)
+	telegramQueue, warnings, _errors = createQueue(sender, storage, maxRetries=2, baseDelay=0.001)
+	telegramQueue.start()
+	try:
+		telegramQueue.enqueue('42', 'Alarm is now active', critical=False)
+		telegramQueue.enqueue('42', 'Someone has just disabled the alarm', critical=True)
+		assert waitFor(lambda: sender.attempts == 4)
+	finally:
+		telegramQueue.stop()
+
+	assert any('Giving up' in warning for warning in warnings)
+	assert json.loads(storage.read_text()) == [
+		{'chatId': '42', 'message': 'Alarm is now active', 'critical': False},
+		{'chatId': '42', 'message': 'Someone has just disabled the alarm', 'critical': True}
+	]
+
+	sender = StubSender()
+	telegramQueue, _warnings, _errors = createQueue(sender, storage)
+	telegramQueue.start()
+	try:
+		assert waitFor(lambda: len(sender.sent) == 2)
+	finally:
+		telegramQueue.stop()
+
+	assert sender.sent == [('42', 'Alarm is now active'), ('42', 'Someone has just disabled the alarm')]
+	assert not storage.exists()
+
+
+def test_pendingMessagesArePersistedOnStop(storage: Path):
+	telegramQueue, _warnings, _errors = createQueue(StubSender(), storage)
+	telegramQueue.enqueue('42', 'first')
+	telegramQueue.enqueue('7', 'second', critical=True)
+	telegramQueue.stop()
+
+	assert [item['message'] for item in json.loads(storage.read_text())] == ['first', 'second']
+
+
+def test_storedMessagesWithoutPriorityStillLoad(storage: Path):
+	storage.write_text(json.dumps([{'chatId': '42', 'message': 'from an older version'}]))
+	telegramQueue, _warnings, _errors = createQueue(StubSender(), storage)
+
+	assert [(item.message, item.critical) for item in telegramQueue._load()] == [('from an older version', False)]
+
+
+def test_fullQueueDropsTheOldestNormalMessage(storage: Path):
+	telegramQueue, warnings, errors = createQueue(StubSender(), storage, maxSize=3)
+	assert telegramQueue.enqueue('42', 'Alarm is now active')
+	assert telegramQueue.enqueue('42', 'Your Alarm has just been triggered', critical=True)
+	assert telegramQueue.enqueue('42', 'Alarm has now stopped making noise')
+	assert not telegramQueue.enqueue('42', 'Your Alarm has just been triggered', critical=True)
+
+	assert [item.message for item in telegramQueue._queue] == [
+		'Your Alarm has just been triggered',
+		'Alarm has now stopped making noise',
+		'Your Alarm has just been triggered'
+	]
+	assert telegramQueue.dropped == 1
+	assert warnings == ['Telegram queue is full, dropping the message "Alarm is now active"']
+	assert not errors
+
+
+def test_fullQueueNeverDropsCriticalMessages(storage: Path):
+	telegramQueue, warnings, errors = createQueue(StubSender(), storage, maxSize=2)
+	for _ in range(3):
+		telegramQueue.enqueue('42', 'Your Alarm has just been triggered', critical=True)
+	# A normal message doesn't push out a critical one, it's the one dropped
+	assert not telegramQueue.enqueue('42', 'Alarm is now active')
+
+	assert telegramQueue.pending == 3
+	assert all(item.critical for item in telegramQueue._queue)
+	assert telegramQueue.dropped == 1
+	assert len(errors) == 1 and 'keeping' in errors[0]
+	assert warnings == ['Telegram queue is full, dropping the message "Alarm is now active"']
@@ -0,0 +1,15 @@
+import random
+
+import pytest
+
+import scenarios
+
+
+@pytest.mark.parametrize('name', list(scenarios.SCRIPTED))
+def test_scriptedScenario(name: str):
+	assert scenarios.SCRIPTED[name]() == []
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_generatedScenario(seed: int):
+	assert scenarios.generated(random.Random(seed)) == []